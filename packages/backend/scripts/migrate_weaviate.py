@@ -4,6 +4,7 @@ import asyncio
 import structlog
 from weaviate.classes.config import Configure, DataType, Property
 
+from wallstr.documents.services import backfill_stage_properties
 from wallstr.documents.weaviate import get_weaviate_client
 from wallstr.logging import configure_logging
 
@@ -23,9 +24,8 @@ async def migrate_weaviate() -> None:
             multi_tenancy_config=Configure.multi_tenancy(
                 enabled=True, auto_tenant_creation=True
             ),
-            vectorizer_config=Configure.Vectorizer.text2vec_openai(
-                model="text-embedding-3-small",
-            ),
+            # chunks are written with the vectors of wallstr.core.embeddings
+            vectorizer_config=Configure.Vectorizer.none(),
             properties=[
                 Property(name="record_id", data_type=DataType.UUID),
                 Property(name="user_id", data_type=DataType.UUID),
@@ -33,6 +33,20 @@ async def migrate_weaviate() -> None:
             ],
         )
 
+    documents_collection = wvc.collections.get("Documents")
+    documents_config = await documents_collection.config.get()
+    existing_properties = {p.name for p in documents_config.properties}
+    for property_ in documents_properties:
+        if property_.name not in existing_properties:
+            logger.info(f"Adding property [Documents.{property_.name}]")
+            await documents_collection.config.add_property(property_)
+    for tenant_id in await documents_collection.tenants.get():
+        updated = await backfill_stage_properties(
+            documents_collection.with_tenant(tenant_id)
+        )
+        if updated:
+            logger.info(f"Backfilled stages of {updated} chunks of tenant {tenant_id}")
+
     if not await wvc.collections.exists("Prompts"):
         logger.info("Creating collection [Prompts]")
         prompts_collection = await wvc.collections.create(
@@ -52,6 +66,17 @@ async def migrate_weaviate() -> None:
     logger.info("Migrating Weaviate done")
 
 
+# parser and embedding stages of the chunks, they are filtered on reprocessing,
+# collections created with text2vec_openai must not vectorize them
+documents_properties = [
+    Property(name="version", data_type=DataType.INT, skip_vectorization=True),
+    Property(name="inference_model", data_type=DataType.TEXT, skip_vectorization=True),
+    Property(name="tables_version", data_type=DataType.INT, skip_vectorization=True),
+    Property(name="chunking_version", data_type=DataType.INT, skip_vectorization=True),
+    Property(name="embedding_model", data_type=DataType.TEXT, skip_vectorization=True),
+    Property(name="embedding_version", data_type=DataType.INT, skip_vectorization=True),
+]
+
 prompts = [
     {
         "prompt": "What does the business do?",
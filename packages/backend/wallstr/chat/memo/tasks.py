@@ -17,8 +17,9 @@ from wallstr.chat.memo.services import MemoService
 from wallstr.chat.models import ChatMessageType
 from wallstr.chat.services import ChatService
 from wallstr.conf.llm_models import SUPPORTED_LLM_MODELS_TYPES
+from wallstr.core.embeddings import get_embedder
 from wallstr.core.llm import PROMPTS, get_llm, interleave_messages, load_prompts
-from wallstr.core.rate_limiters import get_rate_limiter
+from wallstr.core.rate_limiters import Priority, get_rate_limiter
 from wallstr.core.utils import tiktok
 from wallstr.documents.llm import get_rag
 from wallstr.logging import debug
@@ -89,6 +90,13 @@ async def generate_memo(
         memo = await memo_svc.create_memo(message, user_prompt)
 
     bind_contextvars(memo_id=memo.id)
+    # template prompts are the same for every memo, embed them in a single batch
+    # so the sections below hit the embeddings cache
+    await get_embedder().embed_many(
+        [section.prompt for group in MEMO_TEMPLATE.groups for section in group.prompts],
+        priority=Priority.MEMO,
+        user_id=memo.user_id,
+    )
     llm = get_llm(model=user.settings.llm_model or model)
     rate_limiter = get_rate_limiter(user.settings.llm_model or model)
 
@@ -118,8 +126,12 @@ async def generate_memo(
             async with tiktok(
                 f'Generate memo section: "{group.name} | {section.name}"'
             ):
-                await rate_limiter.acquire(llm, messages)
-                response = await llm.ainvoke(messages)
+                reservation = await rate_limiter.acquire(
+                    llm, messages, priority=Priority.MEMO, user_id=memo.user_id
+                )
+                async with rate_limiter.watch_errors():
+                    response = await llm.ainvoke(messages)
+                await rate_limiter.observe(response, reservation)
 
                 content = response if isinstance(response, str) else response.content
                 if not isinstance(content, str):
@@ -183,6 +183,25 @@ class ChatService(BaseService):
             )
             return [row[0] for row in result.all()]
 
+    async def get_chat_document_statuses(
+        self, chat_id: UUID
+    ) -> list[tuple[UUID, DocumentStatus]]:
+        """
+        Single round trip alternative to multiple `get_chat_document_ids` calls.
+        Errored documents are left out: they are neither searchable nor pending
+        """
+        async with self.tx():
+            result = await self.db.execute(
+                sql.select(ChatXDocumentModel.document_id, DocumentModel.status)
+                .join(DocumentModel)
+                .filter(
+                    ChatXDocumentModel.chat_id == chat_id,
+                    DocumentModel.errored_at.is_(None),
+                )
+                .order_by(ChatXDocumentModel.created_at.desc())
+            )
+            return [(row[0], row[1]) for row in result.all()]
+
     async def set_chat_title(self, chat_id: UUID, title: str) -> ChatModel:
         async with self.tx():
             result = await self.db.execute(
@@ -1,7 +1,7 @@
+import asyncio
 from collections.abc import Sequence
 from pathlib import Path
 from textwrap import dedent
-from typing import cast
 from uuid import UUID, uuid4
 
 import structlog
@@ -15,6 +15,7 @@ from sqlalchemy import sql
 from sqlalchemy.ext.asyncio import AsyncSession
 from structlog.contextvars import bind_contextvars
 
+from wallstr.auth.models import UserModel
 from wallstr.auth.services import UserService
 from wallstr.chat.memo.tasks import generate_memo
 from wallstr.chat.models import (
@@ -31,12 +32,20 @@ from wallstr.chat.schemas import (
 )
 from wallstr.chat.services import ChatService
 from wallstr.conf.llm_models import SUPPORTED_LLM_MODELS_TYPES
+from wallstr.core.embeddings import get_embedder
 from wallstr.core.llm import PROMPTS, get_llm, interleave_messages
-from wallstr.core.rate_limiters import get_rate_limiter
+from wallstr.core.rate_limiters import (
+    Priority,
+    get_rate_limiter,
+    get_response_headers,
+)
+from wallstr.core.utils import Stopwatch
+from wallstr.db import AsyncSessionMaker
 from wallstr.documents.llm import get_rag
 from wallstr.documents.models import DocumentStatus
-from wallstr.documents.weaviate import get_weaviate_client
+from wallstr.documents.weaviate import weaviate_client
 from wallstr.logging import debug
+from wallstr.sse.publisher import ChunkCoalescer, publish_event
 from wallstr.worker import dramatiq
 
 logger = structlog.get_logger()
@@ -53,9 +62,13 @@ async def process_chat_message(
     db_session = ctx.options.get("session")
     if not db_session:
         raise Exception("No session")
+    session_maker = ctx.options["session_maker"]
 
+    stopwatch = Stopwatch()
     chat_svc = ChatService(db_session)
-    message = await chat_svc.get_chat_message(UUID(message_id))
+    message = await stopwatch.measure(
+        "message", chat_svc.get_chat_message(UUID(message_id))
+    )
     if not message:
         raise Exception("Message not found")
 
@@ -69,16 +82,21 @@ async def process_chat_message(
 
     bind_contextvars(chat_id=message.chat_id, message_id=message.id)
 
-    user_svc = UserService(db_session)
-    user = await user_svc.get_user(message.user_id)
+    # use @memo keyword to trigger building a memo
+    is_memo = "@memo" in message.content
+
+    user, document_statuses = await asyncio.gather(
+        stopwatch.measure("user", get_user(session_maker, message.user_id)),
+        stopwatch.measure(
+            "documents", chat_svc.get_chat_document_statuses(message.chat_id)
+        ),
+    )
     if not user:
         raise Exception("User not found")
     if user.deleted_at:
         raise Exception("User is deleted")
 
     bind_contextvars(user_id=user.id)
-    # use @memo keyword to trigger building a memo
-    is_memo = "@memo" in message.content
 
     if is_memo:
         new_message = await chat_svc.create_chat_message(
@@ -93,25 +111,61 @@ async def process_chat_message(
 
     topic = f"{message.user_id}:{message.chat_id}:{message.id}"
     new_message_id = uuid4()
-    await redis.publish(
+    await publish_event(
+        redis,
         topic,
-        ChatMessageStartSSE(
-            id=new_message_id, chat_id=message.chat_id
-        ).model_dump_json(),
+        ChatMessageStartSSE(id=new_message_id, chat_id=message.chat_id),
     )
 
-    document_ids = await chat_svc.get_chat_document_ids(
-        message.chat_id, status=DocumentStatus.READY
+    ready_document_ids = [
+        document_id
+        for document_id, status in document_statuses
+        if status == DocumentStatus.READY
+    ]
+    # processing documents are searchable by the pages ingested already
+    document_ids = [
+        document_id
+        for document_id, status in document_statuses
+        if status in (DocumentStatus.READY, DocumentStatus.PROCESSING)
+    ]
+    logger.info(
+        f"Found {len(ready_document_ids)} ready and "
+        f"{len(document_ids) - len(ready_document_ids)} processing documents "
+        f"for chat {message.chat_id}"
     )
-    logger.info(f"Found {len(document_ids)} documents for chat {message.chat_id}")
 
     llm = get_llm(model=user.settings.llm_model or model)
+    rate_limiter = get_rate_limiter(user.settings.llm_model or model)
 
+    # examples are used only with the RAG context of the full mode,
+    # the Weaviate query runs along with the RAG one
+    examples_task = (
+        asyncio.create_task(
+            stopwatch.measure("prompts_examples", get_prompts_examples(message))
+        )
+        if document_ids and not user.settings.simple_mode
+        else None
+    )
+    try:
+        rag = await stopwatch.measure(
+            "rag", get_rag(document_ids, message.user_id, message.content)
+        )
+        examples = await examples_task if examples_task and rag else []
+    finally:
+        if examples_task:
+            examples_task.cancel()
     messages = (
-        await get_simple_llm_messages(document_ids, message)
+        get_simple_llm_messages(message, rag)
         if user.settings.simple_mode
-        else await get_llm_messages(db_session, document_ids, message)
+        else get_llm_messages(
+            message,
+            rag,
+            examples,
+            has_documents=bool(ready_document_ids) or bool(rag),
+            has_pending_documents=len(document_statuses) > len(ready_document_ids),
+        )
     )
+    stopwatch.mark("llm_messages")
     debug(messages)
     if isinstance(llm, ChatDeepSeek) and llm.model_name == "deepseek-reasoner":
         """
@@ -120,39 +174,65 @@ async def process_chat_message(
         """
         messages = interleave_messages(messages)
 
+    reservation = await stopwatch.measure(
+        "rate_limiter",
+        rate_limiter.acquire(
+            llm, messages, priority=Priority.CHAT, user_id=message.user_id
+        ),
+    )
+
+    async def publish_chunk(content: str) -> None:
+        await publish_event(
+            redis,
+            topic,
+            ChatMessageSSE(
+                id=new_message_id,
+                chat_id=message.chat_id,
+                content=content,
+            ),
+        )
+
     chunks: list[str] = []
+    has_headers = False
+    coalescer = ChunkCoalescer(publish_chunk)
     with get_openai_callback() as cb:
         kwargs = (
             {"stream_usage": True}
             if isinstance(llm, (ChatOpenAI, AzureChatOpenAI))
             else {}
         )
-        async for chunk in llm.astream(
-            messages,
-            config=None,
-            stop=None,
-            **kwargs,
-        ):
-            chunk_content = chunk if isinstance(chunk, str) else chunk.content
-
-            if not chunk_content:
-                continue
-            if not isinstance(chunk_content, str):
-                # TODO: don't output dict content when type handled
-                logger.error(f"Chunk content is not a string {chunk_content}")
-                continue
-            # strip leading new line on the start of the message
-            # TODO: use langchain BaseChunk merging
-            chunks.append(chunk_content.lstrip()) if len(
-                chunks
-            ) == 0 else chunks.append(chunk_content)
-            await redis.publish(
-                topic,
-                ChatMessageSSE(
-                    id=new_message_id, chat_id=message.chat_id, content=chunk_content
-                ).model_dump_json(),
-            )
+        async with rate_limiter.watch_errors(), coalescer:
+            async for chunk in llm.astream(
+                messages,
+                config=None,
+                stop=None,
+                **kwargs,
+            ):
+                if headers := get_response_headers(chunk):
+                    # only the first chunk carries the response headers
+                    await rate_limiter.update_from_headers(headers)
+                    has_headers = True
+                chunk_content = chunk if isinstance(chunk, str) else chunk.content
+
+                if not chunk_content:
+                    continue
+                if not isinstance(chunk_content, str):
+                    # TODO: don't output dict content when type handled
+                    logger.error(f"Chunk content is not a string {chunk_content}")
+                    continue
+                if not chunks:
+                    stopwatch.mark("first_token")
+                    logger.info(f"Chat message stages: {stopwatch}")
+                # strip leading new line on the start of the message
+                # TODO: use langchain BaseChunk merging
+                chunks.append(chunk_content.lstrip()) if len(
+                    chunks
+                ) == 0 else chunks.append(chunk_content)
+                await coalescer.add(chunk_content)
+    logger.info(f"Published {len(chunks)} chunks in {coalescer.published} messages")
     if isinstance(llm, (ChatOpenAI, AzureChatOpenAI)):
+        if not has_headers:
+            await rate_limiter.reconcile(reservation, cb.total_tokens)
         logger.info(
             f"OpenAI tokens used: {cb.total_tokens:_}, cost: {cb.total_cost:.3f}$"
         )
@@ -175,15 +255,17 @@ async def process_chat_message(
             user_prompt=message.content,
         )
         if title:
-            await redis.publish(
+            await publish_event(
+                redis,
                 f"{message.user_id}:{message.chat_id}",
                 ChatTitleUpdatedSSE(
                     id=new_message_id,
                     content=title,
-                ).model_dump_json(),
+                ),
             )
 
-    await redis.publish(
+    await publish_event(
+        redis,
         topic,
         ChatMessageEndSSE(
             id=new_message_id,
@@ -191,7 +273,7 @@ async def process_chat_message(
             chat_id=new_message.chat_id,
             created_at=new_message.created_at,
             content=new_message.content,
-        ).model_dump_json(),
+        ),
     )
 
 
@@ -222,9 +304,13 @@ async def derive_chat_title(
         HumanMessage(content=f"User prompt: {user_prompt}"),
         HumanMessage(content=f"AI response: {content}"),
     ]
-    await rate_limiter.acquire(llm, messages)
+    reservation = await rate_limiter.acquire(
+        llm, messages, priority=Priority.TITLE, user_id=chat.user_id
+    )
     with get_openai_callback() as cb:
-        response = await llm.ainvoke(messages)
+        async with rate_limiter.watch_errors():
+            response = await llm.ainvoke(messages)
+    await rate_limiter.observe(response, reservation)
     logger.info(
         f"OpenAI tokens used for getting title: {cb.total_tokens:_}, cost: {cb.total_cost:.3f}$"
     )
@@ -254,10 +340,9 @@ async def derive_chat_title(
     return title
 
 
-async def get_simple_llm_messages(
-    document_ids: list[UUID], message: ChatMessageModel
+def get_simple_llm_messages(
+    message: ChatMessageModel, rag: list[HumanMessage]
 ) -> list[SystemMessage | HumanMessage | AIMessage]:
-    rag = await get_rag(document_ids, message.user_id, message.content)
     messages: list[SystemMessage | HumanMessage | AIMessage] = [
         SystemMessage(PROMPTS.system_simple_prompt),
         *rag,
@@ -266,19 +351,22 @@ async def get_simple_llm_messages(
     return messages
 
 
-async def get_llm_messages(
-    db_session: AsyncSession, document_ids: list[UUID], message: ChatMessageModel
+def get_llm_messages(
+    message: ChatMessageModel,
+    rag: list[HumanMessage],
+    examples: list[SystemMessage],
+    *,
+    has_documents: bool,
+    has_pending_documents: bool,
 ) -> list[SystemMessage | HumanMessage | AIMessage]:
-    if not document_ids:
+    if not has_documents:
         prompt = dedent("""
         Tell the user that he didn't upload any documents yet, and suggest to do it"
         Remind that the more documents he uploads, the better the AI will reply on his questions.
         As well point that you can work only with the documents that were uploaded to the chat.
         """)
 
-        chat_svc = ChatService(db_session)
-        all_document_ids = await chat_svc.get_chat_document_ids(message.chat_id)
-        if len(all_document_ids):
+        if has_pending_documents:
             prompt = dedent("""
             Please inform the user that their documents are still being analyzed by the service
             and that they should send their message later once the processing is complete.
@@ -289,7 +377,6 @@ async def get_llm_messages(
             HumanMessage(prompt),
         ]
 
-    rag = await get_rag(document_ids, message.user_id, message.content)
     messages: list[SystemMessage | HumanMessage | AIMessage]
     if not rag:
         messages = [
@@ -302,7 +389,7 @@ async def get_llm_messages(
     else:
         messages = [
             SystemMessage(PROMPTS.system_prompt),
-            *await get_prompts_examples(message),
+            *examples,
             *rag,
             HumanMessage(content=message.content),
         ]
@@ -310,6 +397,14 @@ async def get_llm_messages(
     return messages
 
 
+async def get_user(session_maker: AsyncSessionMaker, user_id: UUID) -> UserModel | None:
+    """
+    Uses own session to run concurrently with the queries of the task session
+    """
+    async with session_maker() as db_session:
+        return await UserService(db_session).get_user(user_id)
+
+
 async def get_history(
     db_session: AsyncSession, message: ChatMessageModel, limit: int = 15
 ) -> list[AIMessage]:
@@ -331,20 +426,24 @@ async def get_history(
 
 
 async def get_prompts_examples(message: ChatMessageModel) -> list[SystemMessage]:
-    wvc = get_weaviate_client(with_openai=True)
-    await wvc.connect()
+    """
+    Examples are optional for the reply, a failure returns none of them
+    """
     try:
-        collection = wvc.collections.get("Prompts")
-        response = await collection.query.near_text(
-            query=message.content,
-            certainty=0.5,
-            limit=10,
-        )
-        return [
-            SystemMessage(f"""
+        vector = await get_embedder().embed(message.content)
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get("Prompts")
+            response = await collection.query.near_vector(
+                near_vector=vector,
+                certainty=0.5,
+                limit=10,
+            )
+    except Exception as e:
+        logger.warning(f"Failed to get prompts examples: {e}")
+        return []
+    return [
+        SystemMessage(f"""
         Example of response you provide:
         {"\n".join([f"- {prompt.properties["reply"]}" for prompt in response.objects])}
         """)
-        ]
-    finally:
-        await wvc.close()
+    ]
@@ -15,6 +15,7 @@ from wallstr.chat.models import (
 from wallstr.chat.schemas import DocumentPayload
 from wallstr.chat.services import ChatService
 from wallstr.documents.models import DocumentModel, DocumentStatus, DocumentType
+from wallstr.models.base import utc_now
 
 
 @pytest.fixture
@@ -183,3 +184,35 @@ async def test_get_chat_document_ids(
         chat_id, status=DocumentStatus.UPLOADED
     )
     assert len(empty_doc_ids) == 0
+
+
+@pytest.mark.asyncio
+async def test_get_chat_document_statuses(
+    chat_svc: ChatService, chat_with_docs: ChatWithDocs
+) -> None:
+    statuses = dict(await chat_svc.get_chat_document_statuses(chat_with_docs.chat_id))
+
+    assert statuses == {
+        chat_with_docs.doc1_id: DocumentStatus.READY,
+        chat_with_docs.doc2_id: DocumentStatus.UPLOADING,
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_chat_document_statuses_skips_errored(
+    db_session: AsyncSession, chat_svc: ChatService, chat_with_docs: ChatWithDocs
+) -> None:
+    async with db_session.begin():
+        await db_session.execute(
+            sql.update(DocumentModel)
+            .filter_by(id=chat_with_docs.doc2_id)
+            .values(
+                status=DocumentStatus.PROCESSING,
+                error={"error": "failed"},
+                errored_at=utc_now(),
+            )
+        )
+
+    statuses = dict(await chat_svc.get_chat_document_statuses(chat_with_docs.chat_id))
+
+    assert statuses == {chat_with_docs.doc1_id: DocumentStatus.READY}
@@ -6,7 +6,11 @@ import tomllib
 from pydantic import HttpUrl, SecretStr, ValidationInfo, computed_field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from wallstr.conf.llm_models import SUPPORTED_LLM_MODELS_TYPES, ModelsConfig
+from wallstr.conf.llm_models import (
+    SUPPORTED_LLM_MODELS_TYPES,
+    ModelConfig,
+    ModelsConfig,
+)
 
 
 def get_version() -> str:
@@ -54,6 +58,13 @@ class Settings(BaseSettings):
     OLLAMA_URL: SecretStr | None = None
     WEAVIATE_API_URL: SecretStr | None = None
     WEAVIATE_GRPC_URL: SecretStr | None = None
+    # Connected clients per event loop (API process / dramatiq worker)
+    WEAVIATE_POOL_SIZE: int = 4
+    # Lifetime of presigned document URLs, they are cached a bit shorter
+    DOCUMENT_URL_EXPIRE_MINUTES: int = 60
+    # Processes for the PDF layout inference (heavy worker),
+    # defaults to 2, at most the CPUs available to the worker
+    LAYOUT_POOL_SIZE: int | None = None
     SENTRY_DSN: SecretStr | None = None
     LOGFIRE_TOKEN: SecretStr | None = None
 
@@ -63,6 +74,9 @@ class Settings(BaseSettings):
     REPLICATE_API_KEY: SecretStr | None = None
     # LLM models
     MODELS: ModelsConfig = ModelsConfig()
+    # Limits of the embeddings model, EMBEDDINGS__TPM / EMBEDDINGS__RPM,
+    # default to the OpenAI tier 2 limits
+    EMBEDDINGS: ModelConfig = ModelConfig()
 
     CORS_ALLOW_ORIGINS: list[str] = []
 
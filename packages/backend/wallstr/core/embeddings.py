@@ -0,0 +1,235 @@
+import asyncio
+from array import array
+from contextvars import ContextVar
+from datetime import timedelta
+from hashlib import sha256
+from uuid import UUID
+
+import httpx
+import structlog
+import tiktoken
+from langchain_openai import OpenAIEmbeddings
+from openai import DefaultAsyncHttpxClient
+
+from wallstr.conf import settings
+from wallstr.core.rate_limiters import (
+    Priority,
+    RateLimiter,
+    get_embeddings_rate_limiter,
+    noop_rate_limiter,
+)
+from wallstr.core.redis import get_redis
+from wallstr.core.utils import LRUCache
+
+logger = structlog.get_logger()
+
+# Must match the text2vec_openai vectorizer of the Prompts collection and of the
+# Documents collections created before the client-side embeddings,
+# see scripts/migrate_weaviate.py
+EMBEDDING_MODEL = "text-embedding-3-small"
+# bump the version with any change of the embedding settings,
+# stored vectors of another model or version are recomputed
+EMBEDDING_VERSION = 1
+EMBEDDINGS_CACHE_SIZE = 4096
+EMBEDDINGS_CACHE_TTL = timedelta(days=30)
+# vectors of a document take megabytes, they're cached for a shorter time
+# and persisted with the parsed documents, see DocumentService._ingest_document
+CHUNK_EMBEDDINGS_CACHE_TTL = timedelta(days=1)
+# OpenAI limits of a single request: 2048 inputs and 300k tokens in total
+EMBEDDINGS_BATCH_SIZE = 2048
+EMBEDDINGS_BATCH_TOKENS = 300_000
+# concurrent requests of a single `embed_many`, the rate limiter spreads them further
+EMBEDDINGS_CONCURRENCY = 4
+
+# OpenAIEmbeddings returns only the vectors, the rate limit headers of a batch
+# are collected by the HTTP client into the list of the batch task
+_response_headers: ContextVar[list[httpx.Headers] | None] = ContextVar(
+    "embeddings_response_headers", default=None
+)
+
+
+async def _collect_response_headers(response: httpx.Response) -> None:
+    headers = _response_headers.get()
+    if headers is not None:
+        headers.append(response.headers)
+
+
+class Embedder:
+    """
+    Computes text embeddings in batches and caches them
+    in a process LRU and in Redis keyed by (model, sha256(text))
+    """
+
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        *,
+        use_redis: bool = True,
+        cache_size: int = EMBEDDINGS_CACHE_SIZE,
+        cache_ttl: timedelta = EMBEDDINGS_CACHE_TTL,
+        rate_limiter: RateLimiter = noop_rate_limiter,
+    ) -> None:
+        self.model = model
+        self.use_redis = use_redis
+        self.cache_ttl = cache_ttl
+        self.cache: LRUCache[str, list[float]] = LRUCache(cache_size)
+        self.rate_limiter = rate_limiter
+        # batches are cut by `embed_many`, one request per batch
+        self.embeddings = OpenAIEmbeddings(
+            model=model,
+            api_key=settings.OPENAI_API_KEY,
+            chunk_size=EMBEDDINGS_BATCH_SIZE,
+            http_async_client=DefaultAsyncHttpxClient(
+                event_hooks={"response": [_collect_response_headers]}
+            ),
+        )
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(
+        self,
+        texts: list[str],
+        *,
+        priority: int = Priority.CHAT,
+        user_id: UUID | None = None,
+        local_cache: bool = True,
+        cache_ttl: timedelta | None = None,
+    ) -> list[list[float]]:
+        """
+        Missing vectors are computed by batches of the provider limits,
+        `local_cache=False` keeps bulk embeddings out of the process LRU,
+        `cache_ttl` overrides the expiration in Redis
+        """
+        keys = [self._key(text) for text in texts]
+        vectors: dict[str, list[float]] = {}
+        missing: dict[str, str] = {}
+
+        for key, text in zip(keys, texts, strict=True):
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        if missing and self.use_redis:
+            for key, vector in (await self._redis_get(list(missing))).items():
+                vectors[key] = vector
+                if local_cache:
+                    self.cache.set(key, vector)
+                del missing[key]
+
+        if missing:
+            batches = self._batch(missing)
+            logger.debug(
+                f"Embedding {len(missing)}/{len(texts)} texts with {self.model} "
+                f"in {len(batches)} batches"
+            )
+            semaphore = asyncio.Semaphore(EMBEDDINGS_CONCURRENCY)
+
+            async def embed_batch(batch: dict[str, str], tokens: int) -> None:
+                async with semaphore:
+                    headers: list[httpx.Headers] = []
+                    _response_headers.set(headers)
+                    reservation = await self.rate_limiter.acquire(
+                        self.embeddings, tokens, priority=priority, user_id=user_id
+                    )
+                    async with self.rate_limiter.watch_errors():
+                        computed = await self.embeddings.aembed_documents(
+                            list(batch.values())
+                        )
+                    # the last response carries the latest state of the limits
+                    await self.rate_limiter.observe(
+                        headers[-1] if headers else {}, reservation
+                    )
+                new_vectors = dict(zip(batch, computed, strict=True))
+                vectors.update(new_vectors)
+                if local_cache:
+                    for key, vector in new_vectors.items():
+                        self.cache.set(key, vector)
+                if self.use_redis:
+                    await self._redis_set(new_vectors, cache_ttl or self.cache_ttl)
+
+            await asyncio.gather(
+                *(embed_batch(batch, tokens) for batch, tokens in batches)
+            )
+
+        return [vectors[key] for key in keys]
+
+    def _batch(self, texts: dict[str, str]) -> list[tuple[dict[str, str], int]]:
+        """
+        Splits the texts into requests, returns them with their tokens
+        """
+        batches: list[tuple[dict[str, str], int]] = []
+        batch: dict[str, str] = {}
+        batch_tokens = 0
+        for key, text in texts.items():
+            tokens = len(self.encoding.encode(text, disallowed_special=()))
+            if batch and (
+                len(batch) >= EMBEDDINGS_BATCH_SIZE
+                or batch_tokens + tokens > EMBEDDINGS_BATCH_TOKENS
+            ):
+                batches.append((batch, batch_tokens))
+                batch, batch_tokens = {}, 0
+            batch[key] = text
+            batch_tokens += tokens
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    def _key(self, text: str) -> str:
+        return (
+            f"embeddings:{self.model}:v{EMBEDDING_VERSION}:"
+            f"{sha256(text.encode()).hexdigest()}"
+        )
+
+    async def _redis_get(self, keys: list[str]) -> dict[str, list[float]]:
+        try:
+            values = await get_redis().mget(keys)
+        except Exception as e:
+            logger.warning(f"Failed to read embeddings cache: {e}")
+            return {}
+        return {
+            key: unpack_vector(value)
+            for key, value in zip(keys, values, strict=True)
+            if value is not None
+        }
+
+    async def _redis_set(
+        self, vectors: dict[str, list[float]], cache_ttl: timedelta
+    ) -> None:
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for key, vector in vectors.items():
+                    pipe.set(key, pack_vector(vector), ex=cache_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to write embeddings cache: {e}")
+
+
+def pack_vector(vector: list[float]) -> bytes:
+    """
+    Compact float32 form of the vector, 6 KB for text-embedding-3-small
+    """
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(value: bytes) -> list[float]:
+    vector = array("f")
+    vector.frombytes(value)
+    return vector.tolist()
+
+
+_embedders: dict[str, Embedder] = {}
+
+
+def get_embedder(model: str = EMBEDDING_MODEL) -> Embedder:
+    embedder = _embedders.get(model)
+    if embedder is None:
+        embedder = Embedder(model, rate_limiter=get_embeddings_rate_limiter(model))
+        _embedders[model] = embedder
+    return embedder
@@ -129,6 +129,7 @@ def get_llm(
                         api_key=settings.MODELS.GPT_4O_MINI.OPENAI_API_KEY
                         or settings.OPENAI_API_KEY,
                         model=settings.MODELS.GPT_4O_MINI.NAME,
+                        include_response_headers=True,
                     )
                 elif settings.MODELS.GPT_4O_MINI.PROVIDER == "AZURE":
                     return AzureChatOpenAI(
@@ -136,6 +137,7 @@ def get_llm(
                         api_version=settings.MODELS.GPT_4O_MINI.AZURE_API_VERSION,
                         azure_endpoint=settings.MODELS.GPT_4O_MINI.AZURE_API_URL,
                         model=settings.MODELS.GPT_4O_MINI.NAME,
+                        include_response_headers=True,
                     )
 
                 raise exc_not_supported_provider(
@@ -150,6 +152,7 @@ def get_llm(
                         api_key=settings.MODELS.GPT_4O.OPENAI_API_KEY
                         or settings.OPENAI_API_KEY,
                         model=settings.MODELS.GPT_4O.NAME,
+                        include_response_headers=True,
                     )
                 elif settings.MODELS.GPT_4O.PROVIDER == "AZURE":
                     return AzureChatOpenAI(
@@ -157,6 +160,7 @@ def get_llm(
                         api_version=settings.MODELS.GPT_4O.AZURE_API_VERSION,
                         azure_endpoint=settings.MODELS.GPT_4O.AZURE_API_URL,
                         model=settings.MODELS.GPT_4O.NAME,
+                        include_response_headers=True,
                     )
 
                 raise exc_not_supported_provider(model, settings.MODELS.GPT_4O.PROVIDER)
@@ -1,30 +1,176 @@
 import asyncio
+import heapq
+import itertools
 import time
-from collections import deque
-from collections.abc import Sequence
-from datetime import datetime, timedelta
+from collections.abc import AsyncGenerator, Mapping, Sequence
+from contextlib import asynccontextmanager
+from enum import IntEnum
 from typing import TypedDict, overload
+from uuid import UUID
 
 import structlog
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, BaseMessage
 from langchain_core.prompt_values import PromptValue
-from langchain_openai import AzureChatOpenAI, ChatOpenAI
+from langchain_openai import AzureChatOpenAI, ChatOpenAI, OpenAIEmbeddings
+from openai import RateLimitError
 from tiktoken import encoding_for_model
 
-from wallstr.conf.llm_models import SUPPORTED_LLM_MODELS_TYPES
+from wallstr.conf import settings
+from wallstr.conf.llm_models import SUPPORTED_LLM_MODELS_TYPES, ModelConfig
 from wallstr.core.llm import LLMModel, estimate_input_tokens
+from wallstr.core.redis import get_redis
+from wallstr.core.utils import LRUCache
 
 logger = structlog.get_logger()
 
 
-class Request(TypedDict):
+class Priority(IntEnum):
+    """
+    Workload classes sharing the LLM capacity, lower is served first
+    """
+
+    CHAT = 0
+    TITLE = 1
+    MEMO = 2
+    PARSING = 3
+
+
+# Share of the capacity a priority class leaves to the more urgent ones,
+# processes only order their own waiters, the headroom works across them
+PRIORITY_HEADROOM: dict[int, float] = {
+    Priority.CHAT: 0.0,
+    Priority.TITLE: 0.1,
+    Priority.MEMO: 0.2,
+    Priority.PARSING: 0.3,
+}
+
+
+# (priority, finish tag, arrival)
+type WaiterKey = tuple[int, float, int]
+
+
+class Reservation(TypedDict):
     tokens: int
     requests: int
-    created_at: datetime
 
 
-# Add distributed Redis rate-limiter
+class RateLimits(TypedDict):
+    tpm: int
+    rpm: int
+
+
+class PriorityStats(TypedDict):
+    acquired: int
+    throttled: int
+    total_wait: float
+    max_wait: float
+
+
+class RateLimiterStats(PriorityStats):
+    waiting: int
+    # by the priority class name
+    priorities: dict[str, PriorityStats]
+
+
+# Token buckets are shared by all API and worker processes through Redis.
+# Both buckets refill continuously at capacity / 60s, time is taken from Redis
+# to avoid clock skew between hosts. Capacity 0 means unlimited.
+# A reservation must leave `headroom` share of the capacity available.
+# Returns seconds to wait before the reservation could succeed, 0 if reserved
+RESERVE_SCRIPT = """
+local tpm = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+local requests = tonumber(ARGV[4])
+local headroom = tonumber(ARGV[5])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "requests", "updated_at")
+local available_tokens = tonumber(state[1]) or tpm
+local available_requests = tonumber(state[2]) or rpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+available_tokens = math.min(tpm, available_tokens + elapsed * tpm / 60)
+available_requests = math.min(rpm, available_requests + elapsed * rpm / 60)
+
+-- a reservation bigger than the capacity minus the headroom would wait forever
+local needed_tokens = tokens + math.min(headroom * tpm, math.max(0, tpm - tokens))
+local needed_requests = requests
+    + math.min(headroom * rpm, math.max(0, rpm - requests))
+
+local wait = 0
+if tpm > 0 and available_tokens < needed_tokens then
+    wait = math.max(wait, (needed_tokens - available_tokens) * 60 / tpm)
+end
+if rpm > 0 and available_requests < needed_requests then
+    wait = math.max(wait, (needed_requests - available_requests) * 60 / rpm)
+end
+if wait == 0 then
+    available_tokens = available_tokens - tokens
+    available_requests = available_requests - requests
+end
+
+redis.call(
+    "HSET", KEYS[1],
+    "tokens", available_tokens,
+    "requests", available_requests,
+    "updated_at", now
+)
+redis.call("EXPIRE", KEYS[1], 120)
+return tostring(wait)
+"""
+
+# Overrides the available capacity with the provider's view,
+# empty argument keeps the bucket value
+SYNC_SCRIPT = """
+local tpm = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "requests", "updated_at")
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local available_tokens = math.min(tpm, (tonumber(state[1]) or tpm) + elapsed * tpm / 60)
+local available_requests = math.min(
+    rpm, (tonumber(state[2]) or rpm) + elapsed * rpm / 60
+)
+if ARGV[3] ~= "" then
+    available_tokens = tonumber(ARGV[3])
+end
+if ARGV[4] ~= "" then
+    available_requests = tonumber(ARGV[4])
+end
+
+redis.call(
+    "HSET", KEYS[1],
+    "tokens", available_tokens,
+    "requests", available_requests,
+    "updated_at", now
+)
+redis.call("EXPIRE", KEYS[1], 120)
+return 0
+"""
+
+# Returns unused estimated tokens to the bucket (positive delta)
+# or charges tokens consumed above the estimate (negative delta)
+REFUND_SCRIPT = """
+local tpm = tonumber(ARGV[1])
+local delta = tonumber(ARGV[2])
+local available_tokens = tonumber(redis.call("HGET", KEYS[1], "tokens"))
+if available_tokens == nil then
+    return 0
+end
+redis.call("HSET", KEYS[1], "tokens", math.min(tpm, available_tokens + delta))
+return 0
+"""
+
+
 class RateLimiter:
+    """
+    Distributed rate limiter for LLM providers,
+    tokens per minute and requests per minute are limited with Redis token buckets
+    """
+
     def __init__(
         self, model: str, *, key: str, tpm: int | None = None, rpm: int | None = None
     ) -> None:
@@ -33,131 +179,415 @@ class RateLimiter:
         self.tpm = tpm
         self.rpm = rpm
 
-        self.tpm_capacity = tpm or float("inf")
-        self.rpm_capacity = rpm or float("inf")
+        # Waiters of the process are served one by one with weighted fair queuing:
+        # by priority class, then by the virtual finish tag of the user's request,
+        # so a user fanning out many requests doesn't starve the others.
+        # Only the head of the queue talks to Redis and sleeps until its slot is free
+        self._waiters: list[tuple[int, float, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+        self._turn_taken = False
+        self._holder: tuple[WaiterKey, asyncio.Future[None]] | None = None
+        self._virtual_time: dict[int, float] = {}
+        self._finish_tags: LRUCache[tuple[int, str], float] = LRUCache(10_000)
+        self._stats: dict[int, PriorityStats] = {}
 
-        self.dequeue: deque[Request] = deque()
-        self.lock = asyncio.Lock()
-        self.tick = 0.1
-        self.locked_at: None | float = None
+    @property
+    def redis_key(self) -> str:
+        return f"ratelimit:{self.model}:{self.key}"
 
     @overload
-    async def acquire(self, llm: LLMModel, input_: PromptValue) -> None: ...
+    async def acquire(
+        self,
+        llm: LLMModel,
+        input_: PromptValue,
+        *,
+        priority: int = Priority.CHAT,
+        user_id: UUID | None = None,
+        weight: float = 1.0,
+    ) -> Reservation: ...
 
     @overload
-    async def acquire(self, llm: LLMModel, input_: int) -> None: ...
+    async def acquire(
+        self,
+        llm: LLMModel | OpenAIEmbeddings,
+        input_: int,
+        *,
+        priority: int = Priority.CHAT,
+        user_id: UUID | None = None,
+        weight: float = 1.0,
+    ) -> Reservation: ...
 
     @overload
     async def acquire(
         self,
         llm: LLMModel,
         input_: Sequence[BaseMessage],
-    ) -> None: ...
+        *,
+        priority: int = Priority.CHAT,
+        user_id: UUID | None = None,
+        weight: float = 1.0,
+    ) -> Reservation: ...
 
     # https://cookbook.openai.com/examples/how_to_count_tokens_with_tiktoken
     async def acquire(
         self,
-        llm: LLMModel,
+        llm: LLMModel | OpenAIEmbeddings,
         input_: int | PromptValue | Sequence[BaseMessage],
-    ) -> None:
-        if self.model == "noop":
-            return
+        *,
+        priority: int = Priority.CHAT,
+        user_id: UUID | None = None,
+        weight: float = 1.0,
+    ) -> Reservation:
+        """
+        Waits until the reservation fits into the limits
 
-        if not isinstance(llm, (ChatOpenAI, AzureChatOpenAI)):
+        Waiters with lower `priority` are served first, within the same priority
+        users share the capacity proportionally to their `weight`
+        """
+        if self.model == "noop" or not (self.tpm or self.rpm):
+            return Reservation(tokens=0, requests=0)
+
+        if isinstance(llm, OpenAIEmbeddings):
+            model_name = llm.model
+        elif isinstance(llm, (ChatOpenAI, AzureChatOpenAI)):
+            if not llm.model_name:
+                raise ValueError(f"Model name is not set for {llm}")
+            model_name = llm.model_name
+        else:
             """
             Rate limiter is implemented only for OpenAI models
             """
-            return
-
-        if not llm.model_name:
-            raise ValueError(f"Model name is not set for {llm}")
+            return Reservation(tokens=0, requests=0)
 
         tokens_per_message = 3
         if isinstance(input_, PromptValue):
-            enc = encoding_for_model(llm.model_name)
+            enc = encoding_for_model(model_name)
             tokens = len(enc.encode(input_.to_string()))
             messages = len(input_.to_messages())
         elif isinstance(input_, int):
             tokens = input_
             messages = 1
-        elif isinstance(input_, list):
+        elif isinstance(input_, list) and not isinstance(llm, OpenAIEmbeddings):
             tokens = estimate_input_tokens(llm, input_)
             messages = len(input_)
         else:
             raise ValueError(f"Unknown input type {input_}")
         tokens += tokens_per_message * messages
-        while not await self._consume(tokens, requests=1):
-            await asyncio.sleep(self.tick)
-
-    async def _consume(self, tokens: int, requests: int) -> bool:
-        async with self.lock:
-            now = datetime.now()
-            if self.tpm_capacity >= tokens and self.rpm_capacity >= requests:
-                if self.locked_at is not None:
-                    logger.debug(
-                        f"RateLimiter unlocked in {time.perf_counter() - self.locked_at:.3f}s"
-                    )
-                    self.locked_at = None
-                logger.debug(
-                    f"Consume {tokens} tokens from {self.tpm_capacity}, {self.rpm_capacity} requests"
-                )
-                self.dequeue.append(
-                    Request(tokens=tokens, requests=requests, created_at=now)
-                )
-                self.tpm_capacity -= tokens
-                self.rpm_capacity -= requests
-                return True
-            # free capacity
-            while len(self.dequeue) and (
-                now - self.dequeue[0]["created_at"]
-            ) > timedelta(minutes=1.5):
-                logger.warn(f"dequeu[0] {self.dequeue[0]}")
-                slot = self.dequeue.popleft()
-                logger.warn(f"slot {slot}")
-                self.tpm_capacity += slot["tokens"]
-                self.rpm_capacity += slot["requests"]
-        if self.locked_at is None:
-            logger.debug("RateLimiter locked")
-            self.locked_at = time.perf_counter()
-        return False
-
-
-TIERS = {
-    "gpt-4o-mini": {
-        "tier1": {
-            "tpm": 100_000,
-            "rpm": 500,
-        },
-        "tier2": {
-            "tpm": 2_000_000,
-            "rpm": 5000,
-        },
-    },
-    "gpt-4o": {
-        "tier1": {
-            "tpm": 100_000,
-            "rpm": 500,
-        },
-        "tier2": {
-            "tpm": 450_000,
-            "rpm": 5000,
-        },
-    },
-    "llama3-70b": {},
+        if self.tpm:
+            # a request bigger than the bucket would wait forever
+            tokens = min(tokens, self.tpm)
+
+        reservation = Reservation(tokens=tokens, requests=1)
+        key = self._waiter_key(priority, user_id, tokens / weight)
+        started_at = time.perf_counter()
+        holds_turn = False
+        try:
+            throttled = await self._take_turn(key)
+            holds_turn = True
+            while (wait := await self._reserve(reservation, priority)) > 0:
+                if not throttled:
+                    logger.debug(f"RateLimiter locked, retry in {wait:.3f}s")
+                    throttled = True
+                if await self._sleep(wait, key):
+                    # more urgent waiter arrived, let it go first
+                    holds_turn = False
+                    await self._take_turn(key, preempted=True)
+                    holds_turn = True
+        finally:
+            if holds_turn:
+                self._pass_turn()
+
+        elapsed = time.perf_counter() - started_at
+        stats = self._stats.setdefault(
+            priority,
+            PriorityStats(acquired=0, throttled=0, total_wait=0.0, max_wait=0.0),
+        )
+        stats["acquired"] += 1
+        if throttled:
+            logger.debug(f"RateLimiter unlocked in {elapsed:.3f}s")
+            stats["throttled"] += 1
+            stats["total_wait"] += elapsed
+            stats["max_wait"] = max(stats["max_wait"], elapsed)
+        return reservation
+
+    def stats(self) -> RateLimiterStats:
+        priorities = {
+            _priority_name(priority): PriorityStats(**stats)
+            for priority, stats in sorted(self._stats.items())
+        }
+        return RateLimiterStats(
+            acquired=sum(stats["acquired"] for stats in priorities.values()),
+            throttled=sum(stats["throttled"] for stats in priorities.values()),
+            waiting=sum(1 for *_, waiter in self._waiters if not waiter.done()),
+            total_wait=sum(stats["total_wait"] for stats in priorities.values()),
+            max_wait=max(
+                (stats["max_wait"] for stats in priorities.values()), default=0.0
+            ),
+            priorities=priorities,
+        )
+
+    async def reconcile(
+        self, reservation: Reservation, actual_tokens: int | None
+    ) -> None:
+        """
+        Refunds the difference between estimated and actually used tokens
+        """
+        if not self.tpm or not reservation["tokens"] or actual_tokens is None:
+            return
+        delta = reservation["tokens"] - actual_tokens
+        if delta == 0:
+            return
+        try:
+            await get_redis().eval(  # type: ignore[misc]
+                REFUND_SCRIPT, 1, self.redis_key, str(self.tpm), str(delta)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to reconcile rate limiter tokens: {e}")
+
+    def _waiter_key(
+        self, priority: int, user_id: UUID | None, cost: float
+    ) -> WaiterKey:
+        """
+        Virtual finish tag of the request in its priority class,
+        https://en.wikipedia.org/wiki/Fair_queuing#Weighted_fair_queuing
+        """
+        user_key = (priority, str(user_id or ""))
+        start = max(
+            self._virtual_time.get(priority, 0.0),
+            self._finish_tags.get(user_key) or 0.0,
+        )
+        finish_tag = start + cost
+        self._finish_tags.set(user_key, finish_tag)
+        return (priority, finish_tag, next(self._counter))
+
+    async def observe(
+        self,
+        response: BaseMessage | str | Mapping[str, str],
+        reservation: Reservation | None = None,
+    ) -> None:
+        """
+        Updates the buckets by the provider response or its headers,
+        headers take precedence over the reported usage
+        """
+        if headers := get_response_headers(response):
+            await self.update_from_headers(headers)
+        elif reservation is not None:
+            await self.reconcile(reservation, get_used_tokens(response))
+
+    @asynccontextmanager
+    async def watch_errors(self) -> AsyncGenerator[None, None]:
+        try:
+            yield
+        except Exception as e:
+            await self.update_from_error(e)
+            raise
+
+    async def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Adjusts limits and the available capacity by the provider rate limit headers
+        https://platform.openai.com/docs/guides/rate-limits#rate-limits-in-headers
+        """
+        headers = {name.lower(): value for name, value in headers.items()}
+        limit_tokens = _parse_int(headers.get("x-ratelimit-limit-tokens"))
+        limit_requests = _parse_int(headers.get("x-ratelimit-limit-requests"))
+        if limit_tokens and limit_tokens != self.tpm:
+            logger.info(f"RateLimiter {self.model} TPM {self.tpm} -> {limit_tokens}")
+            self.tpm = limit_tokens
+        if limit_requests and limit_requests != self.rpm:
+            logger.info(f"RateLimiter {self.model} RPM {self.rpm} -> {limit_requests}")
+            self.rpm = limit_requests
+
+        remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+        remaining_requests = _parse_int(headers.get("x-ratelimit-remaining-requests"))
+        if remaining_tokens is None and remaining_requests is None:
+            return
+        await self._sync(tokens=remaining_tokens, requests=remaining_requests)
+
+    async def update_from_error(self, error: BaseException) -> None:
+        """
+        Drains the buckets for `retry-after` seconds on 429 responses,
+        so other waiters don't hit the provider until the limit resets
+        """
+        if not isinstance(error, RateLimitError):
+            return
+        retry_after = _parse_retry_after(error.response.headers)
+        if retry_after is None:
+            return
+        logger.warning(f"RateLimiter {self.model} got 429, retry in {retry_after}s")
+        await self._sync(
+            tokens=-int((self.tpm or 0) * retry_after / 60),
+            requests=-int((self.rpm or 0) * retry_after / 60),
+        )
+
+    async def _sync(self, *, tokens: int | None, requests: int | None) -> None:
+        if not (self.tpm or self.rpm):
+            return
+        try:
+            await get_redis().eval(  # type: ignore[misc]
+                SYNC_SCRIPT,
+                1,
+                self.redis_key,
+                str(self.tpm or 0),
+                str(self.rpm or 0),
+                "" if tokens is None else str(tokens),
+                "" if requests is None else str(requests),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to sync rate limiter: {e}")
+
+    async def _take_turn(self, key: WaiterKey, *, preempted: bool = False) -> bool:
+        """
+        Returns True if the caller had to wait for its turn,
+        a preempted holder queues back and hands its turn to the next waiter
+        """
+        if not preempted and not self._turn_taken and not self._waiters:
+            self._turn_taken = True
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (*key, waiter))
+        if preempted:
+            self._pass_turn()
+        elif self._holder and key[0] < self._holder[0][0]:
+            preempt = self._holder[1]
+            if not preempt.done():
+                preempt.set_result(None)
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the turn was handed over right before the cancellation
+                self._pass_turn()
+            raise
+        return True
+
+    def _pass_turn(self) -> None:
+        while self._waiters:
+            priority, finish_tag, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                # the turn stays taken and is handed over to the next waiter
+                self._virtual_time[priority] = finish_tag
+                waiter.set_result(None)
+                return
+        self._turn_taken = False
+
+    async def _sleep(self, wait: float, key: WaiterKey) -> bool:
+        """
+        Sleeps until the bucket refills,
+        returns True if a waiter of a higher priority class arrived meanwhile
+        """
+        preempt = asyncio.get_running_loop().create_future()
+        self._holder = (key, preempt)
+        try:
+            await asyncio.wait([preempt], timeout=wait)
+        finally:
+            self._holder = None
+        return preempt.done()
+
+    async def _reserve(
+        self, reservation: Reservation, priority: int = Priority.CHAT
+    ) -> float:
+        try:
+            wait = await get_redis().eval(  # type: ignore[misc]
+                RESERVE_SCRIPT,
+                1,
+                self.redis_key,
+                str(self.tpm or 0),
+                str(self.rpm or 0),
+                str(reservation["tokens"]),
+                str(reservation["requests"]),
+                str(PRIORITY_HEADROOM.get(priority, 0.0)),
+            )
+        except Exception as e:
+            # fail open, provider 429s are retried by the client
+            logger.warning(f"Rate limiter is unavailable: {e}")
+            return 0
+        return float(wait)
+
+
+def _priority_name(priority: int) -> str:
+    try:
+        return Priority(priority).name.lower()
+    except ValueError:
+        return str(priority)
+
+
+def get_used_tokens(response: BaseMessage | str | Mapping[str, str]) -> int | None:
+    """
+    Total tokens reported by the provider, None if usage isn't reported
+    """
+    if isinstance(response, AIMessage) and response.usage_metadata:
+        return response.usage_metadata["total_tokens"]
+    return None
+
+
+def get_response_headers(
+    response: BaseMessage | str | Mapping[str, str],
+) -> Mapping[str, str] | None:
+    """
+    Response headers of OpenAI models created with `include_response_headers`,
+    or the headers themselves for the clients that don't return messages
+    """
+    if isinstance(response, BaseMessage):
+        return response.response_metadata.get("headers")
+    if isinstance(response, Mapping):
+        return response
+    return None
+
+
+def _parse_int(value: str | None) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """
+    `retry-after-ms` is OpenAI specific, `retry-after` is seconds or HTTP date
+    """
+    try:
+        if retry_after_ms := headers.get("retry-after-ms"):
+            return float(retry_after_ms) / 1000
+        if retry_after := headers.get("retry-after"):
+            return float(retry_after)
+    except ValueError:
+        pass
+    return None
+
+
+# OpenAI tier 2 limits, used when the model limits aren't configured
+TIERS: dict[str, RateLimits] = {
+    "gpt-4o-mini": {"tpm": 2_000_000, "rpm": 5000},
+    "gpt-4o": {"tpm": 450_000, "rpm": 5000},
+    "text-embedding-3-small": {"tpm": 1_000_000, "rpm": 5000},
 }
 
 
-gpt4o_mini_rate_limiter = RateLimiter(
-    model="gpt-4o-mini",
-    key="main",
-    tpm=TIERS["gpt-4o-mini"]["tier2"]["tpm"],
-    rpm=TIERS["gpt-4o-mini"]["tier2"]["tpm"],
+def _create_rate_limiter(model: str, config: ModelConfig | None) -> RateLimiter:
+    """
+    Initial limits come from MODELS__<model>__TPM/RPM settings,
+    falling back to the tier limits of the model,
+    and are adjusted by the provider headers afterwards
+    """
+    tier = TIERS.get(model)
+    tpm = config.TPM if config and config.TPM > 0 else None
+    rpm = config.RPM if config and config.RPM > 0 else None
+    return RateLimiter(
+        model=model,
+        key="main",
+        tpm=tpm or (tier["tpm"] if tier else None),
+        rpm=rpm or (tier["rpm"] if tier else None),
+    )
+
+
+gpt4o_mini_rate_limiter = _create_rate_limiter(
+    "gpt-4o-mini", settings.MODELS.GPT_4O_MINI
 )
-gpt4o_rate_limiter = RateLimiter(
-    model="gpt-4o",
-    key="main",
-    tpm=TIERS["gpt-4o"]["tier2"]["tpm"],
-    rpm=TIERS["gpt-4o"]["tier2"]["tpm"],
+gpt4o_rate_limiter = _create_rate_limiter("gpt-4o", settings.MODELS.GPT_4O)
+text_embedding_3_small_rate_limiter = _create_rate_limiter(
+    "text-embedding-3-small", settings.EMBEDDINGS
 )
 llama3_70b_rate_limiter = RateLimiter(
     model="llama3-70b",
@@ -184,3 +614,33 @@ def get_rate_limiter(model: SUPPORTED_LLM_MODELS_TYPES) -> RateLimiter:
         return gemini_2_0_rate_limiter
 
     return noop_rate_limiter
+
+
+def get_embeddings_rate_limiter(model: str) -> RateLimiter:
+    if model == "text-embedding-3-small":
+        return text_embedding_3_small_rate_limiter
+
+    return noop_rate_limiter
+
+
+def log_rate_limiter_stats() -> None:
+    """
+    Logs wait times by priority class of the rate limiters used by the process
+    """
+    for rate_limiter in (
+        gpt4o_mini_rate_limiter,
+        gpt4o_rate_limiter,
+        text_embedding_3_small_rate_limiter,
+        llama3_70b_rate_limiter,
+        gemini_2_0_rate_limiter,
+    ):
+        stats = rate_limiter.stats()
+        if not stats["acquired"] and not stats["waiting"]:
+            continue
+        logger.info(
+            f"RateLimiter {rate_limiter.model}: {stats['acquired']} acquired, "
+            f"{stats['throttled']} throttled, {stats['waiting']} waiting, "
+            f"max wait {stats['max_wait']:.3f}s",
+            model=rate_limiter.model,
+            **stats,
+        )
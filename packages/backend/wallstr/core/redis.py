@@ -0,0 +1,27 @@
+import asyncio
+from weakref import WeakKeyDictionary
+
+from redis.asyncio import Redis
+
+from wallstr.conf import settings
+
+_clients: WeakKeyDictionary[asyncio.AbstractEventLoop, Redis] = WeakKeyDictionary()
+
+
+def get_redis() -> Redis:
+    """
+    Returns the Redis client of the running event loop for process-wide helpers
+    (rate limiters, caches) that don't have access to the request/worker state
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = Redis.from_url(settings.REDIS_URL.get_secret_value())
+        _clients[loop] = client
+    return client
+
+
+async def close_redis() -> None:
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,151 @@
+from unittest import mock
+from uuid import uuid4
+
+import httpx
+import pytest
+
+from wallstr.core.embeddings import (
+    CHUNK_EMBEDDINGS_CACHE_TTL,
+    Embedder,
+    _collect_response_headers,
+    pack_vector,
+    unpack_vector,
+)
+from wallstr.core.rate_limiters import Priority, RateLimiter, Reservation
+from wallstr.core.redis import close_redis, get_redis
+
+
+async def test_embed_many_caches_vectors() -> None:
+    embedder = Embedder(use_redis=False)
+    aembed_documents = mock.AsyncMock(
+        side_effect=lambda texts: [[float(len(text))] for text in texts]
+    )
+    with mock.patch.object(
+        type(embedder.embeddings), "aembed_documents", aembed_documents
+    ):
+        vectors = await embedder.embed_many(["a", "bb", "a"])
+        assert vectors == [[1.0], [2.0], [1.0]]
+        aembed_documents.assert_awaited_once_with(["a", "bb"])
+
+        assert await embedder.embed("bb") == [2.0]
+        assert aembed_documents.await_count == 1
+
+
+async def test_embed_many_evicts_least_recently_used() -> None:
+    embedder = Embedder(use_redis=False, cache_size=1)
+    aembed_documents = mock.AsyncMock(side_effect=lambda texts: [[0.0] for _ in texts])
+    with mock.patch.object(
+        type(embedder.embeddings), "aembed_documents", aembed_documents
+    ):
+        await embedder.embed("a")
+        await embedder.embed("b")
+        await embedder.embed("a")
+        assert aembed_documents.await_count == 3
+
+
+async def test_embed_many_batches_under_rate_limiter() -> None:
+    rate_limiter = RateLimiter("text-embedding-3-small", key="test")
+    rate_limiter.acquire = mock.AsyncMock(  # type: ignore[method-assign]
+        return_value=Reservation(tokens=0, requests=0)
+    )
+    embedder = Embedder(use_redis=False, rate_limiter=rate_limiter)
+    aembed_documents = mock.AsyncMock(
+        side_effect=lambda texts: [[float(len(text))] for text in texts]
+    )
+    with (
+        mock.patch.object(
+            type(embedder.embeddings), "aembed_documents", aembed_documents
+        ),
+        mock.patch("wallstr.core.embeddings.EMBEDDINGS_BATCH_SIZE", 2),
+    ):
+        vectors = await embedder.embed_many(
+            ["a", "bb", "ccc"], priority=Priority.PARSING, local_cache=False
+        )
+    assert vectors == [[1.0], [2.0], [3.0]]
+    assert [call.args[0] for call in aembed_documents.await_args_list] == [
+        ["a", "bb"],
+        ["ccc"],
+    ]
+    assert rate_limiter.acquire.await_count == 2
+    assert rate_limiter.acquire.await_args is not None
+    assert rate_limiter.acquire.await_args.kwargs["priority"] == Priority.PARSING
+    assert len(embedder.cache) == 0
+
+
+def get_rate_limiter() -> tuple[RateLimiter, mock.AsyncMock, mock.AsyncMock]:
+    rate_limiter = RateLimiter("text-embedding-3-small", key="test")
+    rate_limiter.acquire = mock.AsyncMock(  # type: ignore[method-assign]
+        return_value=Reservation(tokens=10, requests=1)
+    )
+    observe = mock.AsyncMock()
+    update_from_error = mock.AsyncMock()
+    rate_limiter.observe = observe  # type: ignore[method-assign]
+    rate_limiter.update_from_error = update_from_error  # type: ignore[method-assign]
+    return rate_limiter, observe, update_from_error
+
+
+async def test_embed_many_observes_rate_limit_headers() -> None:
+    rate_limiter, observe, _ = get_rate_limiter()
+    embedder = Embedder(use_redis=False, rate_limiter=rate_limiter)
+    headers = {"x-ratelimit-remaining-tokens": "1000"}
+
+    async def embed_documents(texts: list[str]) -> list[list[float]]:
+        # the hook of the HTTP client of OpenAIEmbeddings
+        await _collect_response_headers(httpx.Response(200, headers=headers))
+        return [[0.0] for _ in texts]
+
+    with mock.patch.object(
+        type(embedder.embeddings),
+        "aembed_documents",
+        mock.AsyncMock(side_effect=embed_documents),
+    ):
+        await embedder.embed("a")
+
+    observe.assert_awaited_once_with(
+        httpx.Headers(headers), Reservation(tokens=10, requests=1)
+    )
+
+
+async def test_embed_many_watches_errors() -> None:
+    rate_limiter, observe, update_from_error = get_rate_limiter()
+    embedder = Embedder(use_redis=False, rate_limiter=rate_limiter)
+    error = Exception("rate limited")
+    with (
+        mock.patch.object(
+            type(embedder.embeddings),
+            "aembed_documents",
+            mock.AsyncMock(side_effect=error),
+        ),
+        pytest.raises(Exception, match="rate limited"),
+    ):
+        await embedder.embed("a")
+
+    update_from_error.assert_awaited_once_with(error)
+    observe.assert_not_awaited()
+
+
+async def test_embed_many_caches_chunks_in_redis() -> None:
+    text = f"Revenue {uuid4()}"
+    aembed_documents = mock.AsyncMock(side_effect=lambda texts: [[0.5] for _ in texts])
+    try:
+        for _ in range(2):
+            # a new process, the vector comes from Redis
+            embedder = Embedder()
+            with mock.patch.object(
+                type(embedder.embeddings), "aembed_documents", aembed_documents
+            ):
+                vectors = await embedder.embed_many(
+                    [text], local_cache=False, cache_ttl=CHUNK_EMBEDDINGS_CACHE_TTL
+                )
+            assert vectors == [[0.5]]
+            assert len(embedder.cache) == 0
+        aembed_documents.assert_awaited_once_with([text])
+        ttl = await get_redis().ttl(embedder._key(text))
+        assert 0 < ttl <= CHUNK_EMBEDDINGS_CACHE_TTL.total_seconds()
+    finally:
+        await get_redis().delete(embedder._key(text))
+        await close_redis()
+
+
+def test_pack_roundtrip() -> None:
+    assert unpack_vector(pack_vector([0.5, -1.25])) == [0.5, -1.25]
@@ -0,0 +1,264 @@
+import asyncio
+from collections.abc import AsyncGenerator
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+from langchain_openai import ChatOpenAI
+from pydantic import SecretStr
+
+from wallstr.conf.llm_models import ModelConfig
+from wallstr.core.rate_limiters import (
+    PRIORITY_HEADROOM,
+    Priority,
+    RateLimiter,
+    Reservation,
+    _create_rate_limiter,
+    _parse_retry_after,
+)
+from wallstr.core.redis import close_redis, get_redis
+
+
+@pytest.fixture
+def llm() -> ChatOpenAI:
+    return ChatOpenAI(api_key=SecretStr("<not-real-openai-api-key>"), model="gpt-4o")
+
+
+class FakeRateLimiter(RateLimiter):
+    """
+    Redis bucket replaced with a gate opened by the test
+    """
+
+    def __init__(self) -> None:
+        super().__init__("gpt-4o", key="test", tpm=1000, rpm=10)
+        self.gate = asyncio.Event()
+        self.reserved: list[int] = []
+
+    async def _reserve(
+        self, reservation: Reservation, priority: int = Priority.CHAT
+    ) -> float:
+        if not self.gate.is_set():
+            await self.gate.wait()
+        self.reserved.append(reservation["tokens"])
+        return 0
+
+
+async def test_acquire_serves_waiters_in_arrival_order(llm: ChatOpenAI) -> None:
+    rate_limiter = FakeRateLimiter()
+    tasks = [
+        asyncio.create_task(rate_limiter.acquire(llm, tokens)) for tokens in (1, 2, 3)
+    ]
+    await asyncio.sleep(0)
+    assert rate_limiter.stats()["waiting"] == 2
+
+    rate_limiter.gate.set()
+    await asyncio.gather(*tasks)
+
+    assert rate_limiter.reserved == [4, 5, 6]
+    stats = rate_limiter.stats()
+    assert stats["acquired"] == 3
+    assert stats["throttled"] == 2
+    assert stats["waiting"] == 0
+
+
+async def test_acquire_serves_lower_priority_first(llm: ChatOpenAI) -> None:
+    rate_limiter = FakeRateLimiter()
+    head = asyncio.create_task(rate_limiter.acquire(llm, 1))
+    await asyncio.sleep(0)
+    low = asyncio.create_task(rate_limiter.acquire(llm, 2, priority=10))
+    high = asyncio.create_task(rate_limiter.acquire(llm, 3, priority=0))
+    await asyncio.sleep(0)
+
+    rate_limiter.gate.set()
+    await asyncio.gather(head, low, high)
+
+    assert rate_limiter.reserved == [4, 6, 5]
+    stats = rate_limiter.stats()
+    assert list(stats["priorities"]) == ["chat", "10"]
+    assert stats["priorities"]["chat"]["acquired"] == 2
+    assert stats["priorities"]["chat"]["throttled"] == 1
+    assert stats["priorities"]["10"]["throttled"] == 1
+    assert stats["max_wait"] == max(
+        priority["max_wait"] for priority in stats["priorities"].values()
+    )
+
+
+async def test_acquire_skips_cancelled_waiters(llm: ChatOpenAI) -> None:
+    rate_limiter = FakeRateLimiter()
+    head = asyncio.create_task(rate_limiter.acquire(llm, 1))
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(rate_limiter.acquire(llm, 2))
+    last = asyncio.create_task(rate_limiter.acquire(llm, 3))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    rate_limiter.gate.set()
+    await asyncio.gather(head, last)
+
+    assert rate_limiter.reserved == [4, 6]
+
+
+async def test_acquire_shares_capacity_between_users(llm: ChatOpenAI) -> None:
+    rate_limiter = FakeRateLimiter()
+    alice, bob = uuid4(), uuid4()
+    head = asyncio.create_task(rate_limiter.acquire(llm, 7))
+    await asyncio.sleep(0)
+    alice_tasks = [
+        asyncio.create_task(rate_limiter.acquire(llm, 1, user_id=alice))
+        for _ in range(3)
+    ]
+    bob_task = asyncio.create_task(rate_limiter.acquire(llm, 2, user_id=bob))
+    await asyncio.sleep(0)
+
+    rate_limiter.gate.set()
+    await asyncio.gather(head, *alice_tasks, bob_task)
+
+    # bob is served right after the first alice's request despite arriving last
+    assert rate_limiter.reserved == [10, 4, 5, 4, 4]
+
+
+class ThrottledRateLimiter(RateLimiter):
+    """
+    The first reservation waits for a minute, others pass
+    """
+
+    def __init__(self) -> None:
+        super().__init__("gpt-4o", key="test", tpm=1000, rpm=10)
+        self.throttled = False
+        self.reserved: list[int] = []
+
+    async def _reserve(
+        self, reservation: Reservation, priority: int = Priority.CHAT
+    ) -> float:
+        if not self.throttled:
+            self.throttled = True
+            return 60
+        self.reserved.append(reservation["tokens"])
+        return 0
+
+
+async def test_acquire_preempts_lower_priority_holder(llm: ChatOpenAI) -> None:
+    rate_limiter = ThrottledRateLimiter()
+    memo = asyncio.create_task(rate_limiter.acquire(llm, 1, priority=Priority.MEMO))
+    await asyncio.sleep(0)
+    chat = asyncio.create_task(rate_limiter.acquire(llm, 2, priority=Priority.CHAT))
+
+    await asyncio.wait_for(asyncio.gather(memo, chat), timeout=1)
+
+    assert rate_limiter.reserved == [5, 4]
+
+
+async def test_update_from_headers_adjusts_limits() -> None:
+    rate_limiter = RateLimiter("gpt-4o", key="test", tpm=1000, rpm=10)
+    with mock.patch.object(rate_limiter, "_sync") as sync:
+        await rate_limiter.update_from_headers(
+            {
+                "X-RateLimit-Limit-Tokens": "30000",
+                "X-RateLimit-Limit-Requests": "500",
+                "X-RateLimit-Remaining-Tokens": "29000",
+                "X-RateLimit-Remaining-Requests": "499",
+                "X-RateLimit-Reset-Tokens": "2s",
+            }
+        )
+
+    assert rate_limiter.tpm == 30000
+    assert rate_limiter.rpm == 500
+    sync.assert_awaited_once_with(tokens=29000, requests=499)
+
+
+def test_create_rate_limiter_falls_back_to_tier_limits() -> None:
+    rate_limiter = _create_rate_limiter("gpt-4o", ModelConfig())
+    assert rate_limiter.tpm == 450_000
+    assert rate_limiter.rpm == 5000
+
+    rate_limiter = _create_rate_limiter("gpt-4o", ModelConfig(TPM=1000))
+    assert rate_limiter.tpm == 1000
+    assert rate_limiter.rpm == 5000
+
+    rate_limiter = _create_rate_limiter("text-embedding-3-small", ModelConfig())
+    assert rate_limiter.tpm == 1_000_000
+
+    rate_limiter = _create_rate_limiter("llama3-70b", None)
+    assert rate_limiter.tpm is None
+    assert rate_limiter.rpm is None
+
+
+@pytest.fixture
+async def redis_key() -> AsyncGenerator[str, None]:
+    """
+    Bucket key of the Redis from REDIS_URL, the scripts run for real
+    """
+    key = f"test-{uuid4()}"
+    yield key
+    await get_redis().delete(f"ratelimit:gpt-4o:{key}")
+    await close_redis()
+
+
+async def test_reserve_waits_for_refill_and_refund(redis_key: str) -> None:
+    # 10 tokens per second
+    rate_limiter = RateLimiter("gpt-4o", key=redis_key, tpm=600, rpm=1000)
+
+    assert await rate_limiter._reserve(Reservation(tokens=600, requests=1)) == 0
+    wait = await rate_limiter._reserve(Reservation(tokens=60, requests=1))
+    assert 5 < wait <= 6
+
+    # 100 tokens of the estimate weren't used
+    await rate_limiter.reconcile(Reservation(tokens=600, requests=1), 500)
+    assert await rate_limiter._reserve(Reservation(tokens=60, requests=1)) == 0
+
+
+async def test_reserve_waits_for_requests(redis_key: str) -> None:
+    # a request per second
+    rate_limiter = RateLimiter("gpt-4o", key=redis_key, tpm=1000, rpm=60)
+
+    for _ in range(60):
+        assert await rate_limiter._reserve(Reservation(tokens=1, requests=1)) == 0
+    wait = await rate_limiter._reserve(Reservation(tokens=1, requests=1))
+    assert 0.5 < wait <= 1
+
+
+async def test_sync_overrides_available_capacity(redis_key: str) -> None:
+    rate_limiter = RateLimiter("gpt-4o", key=redis_key, tpm=600, rpm=1000)
+
+    await rate_limiter.update_from_headers(
+        {"x-ratelimit-remaining-tokens": "0", "x-ratelimit-remaining-requests": "999"}
+    )
+    wait = await rate_limiter._reserve(Reservation(tokens=60, requests=1))
+    assert 5 < wait <= 6
+
+    await rate_limiter.update_from_headers({"x-ratelimit-remaining-tokens": "600"})
+    assert await rate_limiter._reserve(Reservation(tokens=600, requests=1)) == 0
+
+
+async def test_reserve_leaves_headroom_across_processes(redis_key: str) -> None:
+    # the heavy worker and the chat worker share the bucket of the model
+    parsing = RateLimiter("gpt-4o", key=redis_key, tpm=1000, rpm=1000)
+    chat = RateLimiter("gpt-4o", key=redis_key, tpm=1000, rpm=1000)
+
+    tokens = 1000 - int(PRIORITY_HEADROOM[Priority.PARSING] * 1000) - 100
+    assert (
+        await parsing._reserve(Reservation(tokens=tokens, requests=1), Priority.PARSING)
+        == 0
+    )
+    assert (
+        await parsing._reserve(Reservation(tokens=200, requests=1), Priority.PARSING)
+        > 0
+    )
+    assert await chat._reserve(Reservation(tokens=200, requests=1), Priority.CHAT) == 0
+
+
+async def test_reserve_headroom_doesnt_block_big_reservations(redis_key: str) -> None:
+    rate_limiter = RateLimiter("gpt-4o", key=redis_key, tpm=1000, rpm=1000)
+    assert (
+        await rate_limiter._reserve(
+            Reservation(tokens=1000, requests=1), Priority.PARSING
+        )
+        == 0
+    )
+
+
+def test_parse_retry_after() -> None:
+    assert _parse_retry_after({"retry-after-ms": "1500", "retry-after": "2"}) == 1.5
+    assert _parse_retry_after({"retry-after": "2"}) == 2.0
+    assert _parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+    assert _parse_retry_after({}) is None
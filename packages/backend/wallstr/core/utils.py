@@ -1,10 +1,11 @@
 import asyncio
 import base64
 import time
-from collections.abc import AsyncGenerator
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Awaitable
 from contextlib import asynccontextmanager
 from functools import cache
-from typing import cast
+from typing import Generic, TypeVar, cast
 from uuid import uuid4
 
 import structlog
@@ -12,6 +13,10 @@ from uvicorn import Server
 
 logger = structlog.get_logger()
 
+T = TypeVar("T")
+K = TypeVar("K")
+V = TypeVar("V")
+
 
 def generate_unique_slug(length: int = 12) -> str:
     random_uuid = uuid4()
@@ -78,6 +83,67 @@ async def tiktok(
         logger.trace(f"{message} finished. {elapsed_str}")
 
 
+class Stopwatch:
+    """
+    Collects elapsed time per named stage, stages may run concurrently
+
+    Usage:
+        stopwatch = Stopwatch()
+        user, rag = await asyncio.gather(
+            stopwatch.measure("user", get_user()),
+            stopwatch.measure("rag", get_rag()),
+        )
+        stopwatch.mark("first_token")
+        logger.info(f"Stages: {stopwatch}")
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.timings: dict[str, float] = {}
+
+    async def measure(self, stage: str, aw: Awaitable[T]) -> T:
+        tik = time.perf_counter()
+        try:
+            return await aw
+        finally:
+            self.timings[stage] = time.perf_counter() - tik
+
+    def mark(self, stage: str) -> None:
+        """Records elapsed time since the stopwatch start"""
+        self.timings[stage] = time.perf_counter() - self.started_at
+
+    def __str__(self) -> str:
+        return ", ".join(
+            f"{stage}={_format_elapsed_time(elapsed)}"
+            for stage, elapsed in self.timings.items()
+        )
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Bounded in-process cache, evicts the least recently used entries
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
 def _format_elapsed_time(seconds: float) -> str:
     """Formats time in `xm ys` if > 60s, otherwise in seconds."""
     if seconds >= 60:
@@ -1,20 +1,18 @@
 from datetime import timedelta
-from typing import Annotated
+from typing import Annotated, Any, cast
 from uuid import UUID
 
-import boto3
-import botocore.config
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from unstructured.staging.base import elements_from_base64_gzipped_json
 from weaviate.classes.query import Filter
 
 from wallstr.auth.dependencies import Auth
 from wallstr.auth.schemas import HTTPUnauthorizedError
-from wallstr.conf import settings
 from wallstr.documents.models import DocumentStatus
 from wallstr.documents.schemas import DocumentPreview, DocumentSection
 from wallstr.documents.services import DocumentService
 from wallstr.documents.tasks import process_document
+from wallstr.documents.weaviate import weaviate_client
 from wallstr.openapi import generate_unique_id_function
 
 router = APIRouter(
@@ -46,44 +44,33 @@ async def get_document_by_section(
     section_id: UUID,
     document_svc: Annotated[DocumentService, Depends(DocumentService.inject_svc)],
 ) -> DocumentSection:
-    wvc = request.state.wvc
-
-    collection = wvc.collections.get("Documents")
-    tenant_id = str(auth.user_id)
-    response = await collection.with_tenant(tenant_id).query.fetch_objects(
-        filters=(
-            Filter.by_id().equal(section_id)
-            & Filter.by_property("user_id").equal(auth.user_id)
-        ),
-        limit=1,
-    )
+    async with weaviate_client() as wvc:
+        collection = wvc.collections.get("Documents")
+        tenant_id = str(auth.user_id)
+        response = await collection.with_tenant(tenant_id).query.fetch_objects(
+            filters=(
+                Filter.by_id().equal(section_id)
+                & Filter.by_property("user_id").equal(auth.user_id)
+            ),
+            limit=1,
+        )
     if not response.objects:
         raise HTTPException(status_code=404, detail="Section not found")
 
     chunk = response.objects[0]
-    document = await document_svc.get_document(chunk.properties["document_id"])
-    if not document:
+    metadata = cast(dict[str, Any], chunk.properties["metadata"])
+    try:
+        preview = await document_svc.get_document_preview(
+            auth.user_id, cast(UUID, chunk.properties["document_id"])
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=403, detail="User is not the owner of the document"
+        ) from e
+    if not preview:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    s3_client = boto3.client(
-        "s3",
-        endpoint_url=str(settings.STORAGE_URL),
-        aws_access_key_id=settings.STORAGE_ACCESS_KEY.get_secret_value(),
-        aws_secret_access_key=settings.STORAGE_SECRET_KEY.get_secret_value(),
-        config=botocore.config.Config(signature_version="s3v4"),
-    )
-    document_url = s3_client.generate_presigned_url(
-        ClientMethod="get_object",
-        Params={
-            "Bucket": settings.STORAGE_BUCKET,
-            "Key": document.storage_path,
-        },
-        ExpiresIn=60 * 5,
-    )
-
-    elements = elements_from_base64_gzipped_json(
-        chunk.properties["metadata"]["orig_elements"]
-    )
+    elements = elements_from_base64_gzipped_json(metadata["orig_elements"])
     bboxes = [
         {
             **element.metadata.coordinates.to_dict(),  # type: ignore[no-untyped-call]
@@ -94,9 +81,9 @@ async def get_document_by_section(
     ]
 
     section = DocumentSection(
-        document_title=document.filename,
-        document_url=document_url,
-        page_number=chunk.properties["metadata"]["page_number"],
+        document_title=preview.document_title,
+        document_url=preview.document_url,
+        page_number=metadata["page_number"],
         bboxes=bboxes,
     )
 
@@ -116,31 +103,15 @@ async def get_document_url(
     document_id: UUID,
     document_svc: Annotated[DocumentService, Depends(DocumentService.inject_svc)],
 ) -> DocumentPreview:
-    document = await document_svc.get_document(document_id)
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found")
-
-    if document.user_id != auth.user_id:
+    try:
+        preview = await document_svc.get_document_preview(auth.user_id, document_id)
+    except ValueError as e:
         raise HTTPException(
             status_code=403, detail="User is not the owner of the document"
-        )
-
-    s3_client = boto3.client(
-        "s3",
-        endpoint_url=str(settings.STORAGE_URL),
-        aws_access_key_id=settings.STORAGE_ACCESS_KEY.get_secret_value(),
-        aws_secret_access_key=settings.STORAGE_SECRET_KEY.get_secret_value(),
-        config=botocore.config.Config(signature_version="s3v4"),
-    )
-    document_url = s3_client.generate_presigned_url(
-        ClientMethod="get_object",
-        Params={
-            "Bucket": settings.STORAGE_BUCKET,
-            "Key": document.storage_path,
-        },
-        ExpiresIn=60 * 5,
-    )
-    return DocumentPreview(document_title=document.filename, document_url=document_url)
+        ) from e
+    if not preview:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return preview
 
 
 @router.post(
@@ -0,0 +1,180 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import resource
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, TypedDict
+
+import onnxruntime
+import structlog
+from PIL import Image
+from unstructured_inference.inference.layout import DocumentLayout, PageLayout
+from unstructured_inference.models.base import get_model
+
+from wallstr.conf import settings
+
+logger = structlog.get_logger()
+
+# pages per task, small enough to balance long documents between the processes
+LAYOUT_CHUNK_PAGES = 8
+# every process loads its own model, more of them mostly cost memory
+LAYOUT_POOL_DEFAULT_SIZE = 2
+
+
+class LayoutProcessStats(TypedDict):
+    pid: int
+    max_rss: int
+
+
+class LayoutPool:
+    """
+    Process pool for the layout inference, every process keeps its model loaded
+    (unstructured_inference caches models per process) and infers a range of pages
+    """
+
+    def __init__(self, model_name: str, size: int) -> None:
+        self.model_name = model_name
+        self.size = size
+        # ONNX runtime threads of every process, the processes share the CPUs
+        self.threads = max(1, get_available_cpus() // size)
+        self._executor: ProcessPoolExecutor | None = None
+        # the event loop infers while a worker thread may rebuild a broken pool
+        self._lock = threading.Lock()
+        self.ready = False
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    # forked ONNX runtime threads deadlock, start clean processes
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_model,
+                    initargs=(self.model_name, self.threads),
+                )
+            return self._executor
+
+    def warmup(self) -> list[LayoutProcessStats]:
+        """
+        Blocking, starts all the processes and waits for the model to be loaded,
+        returns the memory of every process
+        """
+        futures = [self.executor.submit(_get_process_stats) for _ in range(self.size)]
+        stats = [future.result() for future in futures]
+        self.ready = True
+        return stats
+
+    async def infer(self, paths: list[Path], first_page: int = 1) -> DocumentLayout:
+        """
+        Infers the layout of the page images, pages keep the order of `paths`
+        and are numbered from `first_page`
+        """
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(
+                self.executor, _infer_pages, self.model_name, chunk, first_page
+            )
+            for first_page, chunk in split_pages(paths, self.size, first_page)
+        ]
+        try:
+            chunks = await asyncio.gather(*futures)
+        except BrokenProcessPool:
+            # a process died (e.g. OOM), the worker warms up a new pool
+            self.close()
+            raise
+        return DocumentLayout.from_pages([page for chunk in chunks for page in chunk])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self.ready = False
+
+
+def split_pages(
+    paths: list[Path], size: int, first_page: int = 1
+) -> list[tuple[int, list[Path]]]:
+    """
+    Splits the pages into ranges of (first page number, paths)
+    """
+    if not paths:
+        return []
+    chunk_size = min(LAYOUT_CHUNK_PAGES, math.ceil(len(paths) / size))
+    return [
+        (first_page + start, paths[start : start + chunk_size])
+        for start in range(0, len(paths), chunk_size)
+    ]
+
+
+def get_available_cpus() -> int:
+    """
+    CPUs the process may run on, unlike `os.cpu_count()` respects the cpuset
+    of the container
+    """
+    return len(os.sched_getaffinity(0)) or 1
+
+
+def _load_model(model_name: str, threads: int) -> None:
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    _limit_onnx_threads(get_model(model_name), threads)
+
+
+def _limit_onnx_threads(model: Any, threads: int) -> None:
+    """
+    ONNX runtime starts a thread per core in every session by default,
+    unstructured_inference creates the session of the model without options,
+    so only the layout model gets a new session with the thread limits
+    """
+    session = getattr(model, "model", None)
+    if not isinstance(session, onnxruntime.InferenceSession):
+        return
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    model.model = onnxruntime.InferenceSession(
+        model.model_path, sess_options=options, providers=session.get_providers()
+    )
+
+
+def _get_process_stats() -> LayoutProcessStats:
+    # ru_maxrss is in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"pid": os.getpid(), "max_rss": max_rss}
+
+
+def _infer_pages(
+    model_name: str, paths: list[Path], first_page: int
+) -> list[PageLayout]:
+    model = get_model(model_name)
+    pages = []
+    for number, path in enumerate(paths, start=first_page):
+        with Image.open(path) as image:
+            page = PageLayout.from_image(
+                image, image_path=path, number=number, detection_model=model
+            )
+        # the pages are sent back to the parent process, drop the unpicklable parts
+        page.image = None
+        page.detection_model = None
+        page.element_extraction_model = None
+        pages.append(page)
+    return pages
+
+
+_layout_pools: dict[str, LayoutPool] = {}
+
+
+def get_layout_pool(model_name: str) -> LayoutPool:
+    pool = _layout_pools.get(model_name)
+    if pool is None:
+        size = settings.LAYOUT_POOL_SIZE or min(
+            LAYOUT_POOL_DEFAULT_SIZE, get_available_cpus()
+        )
+        pool = LayoutPool(model_name, size=size)
+        _layout_pools[model_name] = pool
+    return pool
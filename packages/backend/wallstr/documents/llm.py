@@ -7,7 +7,8 @@ from weaviate.classes.query import Filter, MetadataQuery
 from weaviate.collections.classes.internal import Object
 from weaviate.collections.classes.types import WeaviateProperties
 
-from wallstr.documents.weaviate import get_weaviate_client
+from wallstr.core.embeddings import get_embedder
+from wallstr.documents.weaviate import weaviate_client
 from wallstr.logging import debug
 
 logger = structlog.get_logger()
@@ -23,9 +24,8 @@ async def get_rag(
 ) -> list[HumanMessage]:
     if not document_ids:
         return []
-    wvc = get_weaviate_client(with_openai=True)
-    await wvc.connect()
-    try:
+    vector = await get_embedder().embed(content)
+    async with weaviate_client() as wvc:
         # Check if user's tenant exists
         tenant_id = str(user_id)
         collection = wvc.collections.get("Documents")
@@ -33,9 +33,9 @@ async def get_rag(
             logger.info(f"Tenant {tenant_id} not found")
             return []
 
-        response = await collection.with_tenant(tenant_id).query.near_text(
+        response = await collection.with_tenant(tenant_id).query.near_vector(
             filters=Filter.by_property("document_id").contains_any(document_ids),
-            query=content,
+            near_vector=vector,
             distance=distance,
             limit=limit,
             return_metadata=MetadataQuery(distance=True),
@@ -49,8 +49,6 @@ async def get_rag(
         return [
             HumanMessage(f"# RAG Context\n{context}"),
         ]
-    finally:
-        await wvc.close()
 
 
 async def get_pages(
@@ -63,9 +61,7 @@ async def get_pages(
     """
     Don't use it until parsing adds page for every record_id
     """
-    wvc = get_weaviate_client(with_openai=True)
-    try:
-        await wvc.connect()
+    async with weaviate_client() as wvc:
         tenant_id = str(user_id)
         collection = wvc.collections.get("Documents")
         if not await collection.tenants.get_by_names([tenant_id]):
@@ -82,8 +78,6 @@ async def get_pages(
         )
 
         return [str(obj.properties["text"]) for obj in response.objects]
-    finally:
-        await wvc.close()
 
 
 def _get_rag_line(chunk: Object[WeaviateProperties, None]) -> str:
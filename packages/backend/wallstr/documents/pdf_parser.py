@@ -1,11 +1,20 @@
 import asyncio
 import base64
 import io
+import tempfile
+import threading
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
 from hashlib import sha256
 from pathlib import Path
-from typing import Any, Literal, cast
+from types import TracebackType
+from typing import Any, Literal, Self, TypedDict, cast
+from uuid import UUID
 
 import pdf2image
+import pikepdf
 import structlog
 from langchain_community.callbacks import get_openai_callback
 from langchain_core.messages import HumanMessage
@@ -19,19 +28,37 @@ from unstructured.partition.pdf_image.pdfminer_processing import (
     merge_inferred_with_extracted_layout,
     process_data_with_pdfminer,
 )
-from unstructured_inference.inference.layout import (
-    DocumentLayout,
-    process_data_with_model,
-)
+from unstructured.staging.base import elements_from_dicts
+from unstructured_inference.inference.layout import DocumentLayout
 from unstructured_inference.utils import LayoutElement
 from unstructured_ingest.utils.chunking import assign_and_map_hash_ids
 
 from wallstr.conf import settings
 from wallstr.core.llm import LLMModel, estimate_input_tokens
+from wallstr.core.rate_limiters import Priority, RateLimiter, noop_rate_limiter
+from wallstr.core.redis import get_redis
 from wallstr.core.utils import tiktok
+from wallstr.documents.layout import get_layout_pool
+from wallstr.documents.storage import DocumentFile
 
 logger = structlog.get_logger()
 
+PDF_IMAGE_DPI = 200
+# small batches make the first pages searchable quickly
+PARSE_BATCH_PAGES = 10
+
+# bump the version with any change of the prompt or the Table schema
+TABLE_PROMPT = "Extract all data from the image in json format"
+TABLE_PROMPT_VERSION = 1
+TABLES_CACHE_TTL = timedelta(days=90)
+# concurrent vision calls per parse, the rate limiter spreads them further
+TABLES_CONCURRENCY = 8
+TABLE_RETRIES = 3
+TABLE_RETRY_DELAY = 1.0
+
+# pdfminer runs next to the layout inference, which has its own process pool
+_pdfminer_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdfminer")
+
 
 class Table(BaseModel):
     title: str | None = Field(description="Title of the table")
@@ -41,8 +68,139 @@ class Table(BaseModel):
     )
 
 
+class TablesStats(TypedDict):
+    extracted: int
+    cached: int
+    failed: int
+    estimated_tokens: int
+
+
+class ParsedPages(TypedDict):
+    chunks: list[dict[str, Any]]
+    # elements of every page of the batch, before chunking
+    pages: list[list[dict[str, Any]]]
+    pages_done: int
+    pages_total: int
+
+
+def extract_pages_with_pdfminer(
+    path: Path, first_page: int, last_page: int
+) -> tuple[list[Any], list[Any]]:
+    """
+    Blocking, pdfminer layout and links of the 1-based page range,
+    the pages are copied to a separate PDF, so pdfminer reads only them
+    """
+    buffer = io.BytesIO()
+    with pikepdf.open(path) as pdf, pikepdf.new() as subset:
+        subset.pages.extend(pdf.pages[first_page - 1 : last_page])
+        subset.save(buffer)
+    buffer.seek(0)
+    return process_data_with_pdfminer(file=buffer, dpi=PDF_IMAGE_DPI)
+
+
+def _format_table(table: Table) -> str:
+    return f"""
+        Table: {table.title}
+        Description:
+        {table.content}
+        Data:
+        {table.data}
+        """
+
+
+class PageImages:
+    """
+    Pages of the PDF rasterized once per parse and stored in a temporary directory,
+    shared by the layout inference, the table extraction and the debug output
+
+    Usage:
+        with PageImages(file.path) as pages:
+            pages.render(first_page=1, last_page=10)
+            image = pages.open(1)
+    """
+
+    def __init__(self, path: Path, dpi: int = PDF_IMAGE_DPI) -> None:
+        self.path = path
+        self.dpi = dpi
+        # by 1-based page number
+        self.paths: dict[int, Path] = {}
+        self._pages_total: int | None = None
+        self._temp_dir: tempfile.TemporaryDirectory[str] | None = None
+        # renders run in threads, the directory is removed once they finish
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> Self:
+        self._temp_dir = tempfile.TemporaryDirectory(prefix="wallstr-pages-")
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        with self._lock:
+            if self._temp_dir is not None:
+                self._temp_dir.cleanup()
+                self._temp_dir = None
+            self.paths = {}
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def count(self) -> int:
+        """
+        Blocking, number of pages of the PDF
+        """
+        if self._pages_total is None:
+            self._pages_total = int(
+                pdf2image.pdfinfo_from_path(str(self.path))["Pages"]
+            )
+        return self._pages_total
+
+    def render(self, first_page: int = 1, last_page: int | None = None) -> list[Path]:
+        """
+        Blocking, rasterizes the pages of the range with a single poppler call,
+        rendered pages aren't rendered again
+        """
+        numbers = range(first_page, (last_page or self.count()) + 1)
+        with self._lock:
+            if self._temp_dir is None:
+                raise Exception("PageImages is not entered")
+            missing = [number for number in numbers if number not in self.paths]
+            if missing:
+                paths = pdf2image.convert_from_path(
+                    self.path,
+                    dpi=self.dpi,
+                    output_folder=self._temp_dir.name,
+                    first_page=missing[0],
+                    last_page=missing[-1],
+                    paths_only=True,
+                )
+                for number, path in zip(
+                    range(missing[0], missing[-1] + 1),
+                    cast(list[str], paths),
+                    strict=True,
+                ):
+                    self.paths[number] = Path(path)
+            return [self.paths[number] for number in numbers]
+
+    def open(self, number: int) -> Image.Image:
+        """
+        Blocking, loads the page image by 1-based page number
+        """
+        with Image.open(self.paths[number]) as image:
+            image.load()
+            return cast(Image.Image, image)
+
+
 class PdfParser:
+    # stage versions, a bump reruns the stage and the stages after it:
+    # layout (pdfminer + inference model) -> tables -> chunking -> embedding,
+    # the embedding stage is EMBEDDING_MODEL and EMBEDDING_VERSION of the embedder
     version: int = 1
+    tables_version: int = TABLE_PROMPT_VERSION
+    chunking_version: int = 1
     inference_model: (
         Literal["yolox"]
         | Literal["yolox_quantized"]
@@ -53,54 +211,155 @@ class PdfParser:
         | Literal["detectron2_mask_rcnn"]
     ) = "yolox_quantized"
 
-    def __init__(self, llm: LLMModel, llm_with_vision: LLMModel) -> None:
+    def __init__(
+        self,
+        llm: LLMModel,
+        llm_with_vision: LLMModel,
+        *,
+        vision_rate_limiter: RateLimiter = noop_rate_limiter,
+        user_id: UUID | None = None,
+    ) -> None:
         self.llm = llm
         self.llm_with_vision = llm_with_vision
+        self.vision_rate_limiter = vision_rate_limiter
+        # fair share of the rate limits between the users
+        self.user_id = user_id
 
-    async def parse(self, file_buffer: io.BytesIO) -> list[dict[str, Any]]:
-        file_buffer.seek(0)
-
-        async with tiktok(f"Infer the layout with {PdfParser.inference_model} model"):
-            loop = asyncio.get_event_loop()
-            file_buffer.seek(0)
-            inferred_document_layout = await loop.run_in_executor(
-                None,
-                lambda: process_data_with_model(
-                    file_buffer,
-                    model_name=PdfParser.inference_model,
-                    pdf_image_dpi=200,
-                ),
-            )
+    async def parse(self, file: DocumentFile) -> list[dict[str, Any]]:
+        chunks = []
+        async for batch in self.parse_pages(file):
+            chunks.extend(batch["chunks"])
+        return chunks
 
-        logger.info("Extract the layout with pdfminer")
-        extracted_layout, layouts_links = process_data_with_pdfminer(
-            file=file_buffer,
-            dpi=200,
-        )
+    async def parse_pages(
+        self, file: DocumentFile, *, batch_pages: int = PARSE_BATCH_PAGES
+    ) -> AsyncIterator[ParsedPages]:
+        """
+        Parses the document by batches of pages and yields their chunks
+        as soon as they are ready. The pages are rendered batch by batch,
+        the layout of a batch is inferred by the layout pool once it's rendered
+        and pdfminer extracts the text of the batch pages only
+        """
+        with PageImages(file.path) as pages:
+            loop = asyncio.get_running_loop()
+            inferences: list[asyncio.Task[DocumentLayout]] = []
+            extractions: list[asyncio.Future[tuple[list[Any], list[Any]]]] = []
+            try:
+                pages_total = await loop.run_in_executor(None, pages.count)
+                logger.info(f"Parsing {pages_total} pages")
+
+                batches = [
+                    (start, min(start + batch_pages, pages_total))
+                    for start in range(0, pages_total, batch_pages)
+                ]
+                layout_pool = get_layout_pool(PdfParser.inference_model)
+                # batches take the lock in order, so the first pages come first
+                render_lock = asyncio.Lock()
+
+                async def infer(start: int, end: int) -> DocumentLayout:
+                    async with render_lock, tiktok(f"Render pages {start + 1}-{end}"):
+                        paths = await loop.run_in_executor(
+                            None, pages.render, start + 1, end
+                        )
+                    return await layout_pool.infer(paths, first_page=start + 1)
+
+                # everything is submitted upfront, the executors take the batches
+                # in order, so the rendering, the inference and the extraction
+                # of the next batches overlap with the tables of the current one
+                inferences = [
+                    asyncio.create_task(infer(start, end)) for start, end in batches
+                ]
+                extractions = [
+                    loop.run_in_executor(
+                        _pdfminer_executor,
+                        extract_pages_with_pdfminer,
+                        file.path,
+                        start + 1,
+                        end,
+                    )
+                    for start, end in batches
+                ]
+
+                for i, (start, end) in enumerate(batches):
+                    async with tiktok(
+                        f"Infer the layout of pages {start + 1}-{end} "
+                        f"with {PdfParser.inference_model} model"
+                    ):
+                        inferred_document_layout = await inferences[i]
+                    async with tiktok(
+                        f"Wait for the pdfminer layout of {start + 1}-{end}"
+                    ):
+                        extracted_layout, layouts_links = await extractions[i]
 
+                    elements = await self._parse_layout(
+                        pages,
+                        inferred_document_layout,
+                        extracted_layout,
+                        layouts_links,
+                        first_page=start + 1,
+                    )
+                    yield {
+                        "chunks": self.chunk_elements(elements),
+                        "pages": elements,
+                        "pages_done": end,
+                        "pages_total": pages_total,
+                    }
+            finally:
+                for extraction in extractions:
+                    extraction.cancel()
+                for inference in inferences:
+                    inference.cancel()
+
+    async def _parse_layout(
+        self,
+        pages: PageImages,
+        inferred_document_layout: DocumentLayout,
+        extracted_layout: list[Any],
+        layouts_links: list[Any],
+        *,
+        first_page: int,
+    ) -> list[list[dict[str, Any]]]:
+        """
+        Returns the elements of every page
+        """
         merged_document_layout = merge_inferred_with_extracted_layout(
             inferred_document_layout=inferred_document_layout,
-            extracted_layout=extracted_layout,  # type: ignore
+            extracted_layout=extracted_layout,
             hi_res_model_name=PdfParser.inference_model,
         )
         cleaned_document_layout = clean_pdfminer_inner_elements(merged_document_layout)
         logger.info("Parsing document tables")
         with get_openai_callback() as cb:
-            final_document_layout, estimated_tokens = await self._parse_tables_with_llm(
-                file_buffer, cleaned_document_layout
+            final_document_layout, stats = await self._parse_tables_with_llm(
+                pages, cleaned_document_layout
             )
             logger.info(
                 f"OpenAI tokens used: {cb.total_tokens:_}, cost: {cb.total_cost:.3f}$"
             )
-            logger.info(f"OpenAI estimated tokens: {estimated_tokens:_}")
+            logger.info(f"OpenAI estimated tokens: {stats['estimated_tokens']:_}")
         elements = document_to_element_list(
             final_document_layout,
             sortable=True,
             include_page_breaks=False,
             infer_list_items=False,
             layouts_links=layouts_links,
+            starting_page_number=first_page,
         )
-        logger.info("Chunking the file...")
+        pages_elements: list[list[dict[str, Any]]] = [
+            [] for _ in inferred_document_layout.pages
+        ]
+        for element in elements:
+            page_number = element.metadata.page_number or first_page
+            pages_elements[page_number - first_page].append(element.to_dict())
+        return pages_elements
+
+    def chunk_elements(self, pages: list[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+        """
+        Chunks the stored elements of the pages,
+        so a new chunking doesn't require the layout and the tables again
+        """
+        logger.info("Chunking the pages...")
+        elements = elements_from_dicts([element for page in pages for element in page])
         chunked_elements = self._chunk(elements)
         chunked_elements_dicts = [e.to_dict() for e in chunked_elements]
         chunked_elements_dicts = assign_and_map_hash_ids(
@@ -109,44 +368,57 @@ class PdfParser:
         return chunked_elements_dicts
 
     async def _parse_tables_with_llm(
-        self, file_buffer: io.BytesIO, layout: DocumentLayout
-    ) -> tuple[DocumentLayout, int]:
-        async def extract_table_text(image: Image.Image, element: LayoutElement) -> int:
-            element.text, estimated_tokens = await self._extract_table_text(
-                image, element
+        self, pages: PageImages, layout: DocumentLayout
+    ) -> tuple[DocumentLayout, TablesStats]:
+        stats: TablesStats = {
+            "extracted": 0,
+            "cached": 0,
+            "failed": 0,
+            "estimated_tokens": 0,
+        }
+        queue: asyncio.Queue[tuple[Image.Image, LayoutElement]] = asyncio.Queue()
+        for page in layout.pages:
+            table_elements = [
+                element for element in page.elements if element.type == "Table"
+            ]
+            if not table_elements:
+                continue
+
+            # crop right away, so only the small crops are kept in memory
+            cropped_images = await asyncio.to_thread(
+                self._crop_tables, pages, page.number, table_elements
             )
-            return estimated_tokens
-
-        estimated_tokens = 0
-        async with tiktok("Extracting tables from layout"):
-            tasks = []
-            for page in layout.pages:
-                table_elements = [
-                    element for element in page.elements if element.type == "Table"
-                ]
-                if not table_elements:
-                    continue
+            for cropped_image, element in zip(
+                cropped_images, table_elements, strict=True
+            ):
+                queue.put_nowait((cropped_image, element))
 
-                image = pdf2image.convert_from_bytes(
-                    file_buffer.getvalue(),
-                    dpi=200,
-                    first_page=page.number,
-                    last_page=page.number,
-                )[0]
+        async def worker() -> None:
+            while not queue.empty():
+                cropped_image, element = queue.get_nowait()
+                element.text = await self._extract_table_text(cropped_image, stats)
 
-                for element in table_elements:
-                    tasks.append(extract_table_text(image, element))
+        tables = queue.qsize()
+        async with tiktok(f"Extracting {tables} tables from layout"):
+            await asyncio.gather(
+                *(worker() for _ in range(min(TABLES_CONCURRENCY, tables)))
+            )
+        logger.info(
+            f"Tables extracted: {stats['extracted']}, cached: {stats['cached']}, "
+            f"failed: {stats['failed']}"
+        )
+        return layout, stats
 
-            try:
-                # TODO: add rate limiting per user
-                estimated_tokens = sum(await asyncio.gather(*tasks))
-            except Exception as e:
-                logger.exception(f"Failed to extract table text: {e}")
-        return layout, estimated_tokens
+    def _crop_tables(
+        self, pages: PageImages, number: int, elements: list[LayoutElement]
+    ) -> list[Image.Image]:
+        """
+        Blocking, loads the page image and crops the tables of the page
+        """
+        image = pages.open(number)
+        return [self._crop_table(image, element) for element in elements]
 
-    async def _extract_table_text(
-        self, image: Image.Image, element: LayoutElement
-    ) -> tuple[str, int]:
+    def _crop_table(self, image: Image.Image, element: LayoutElement) -> Image.Image:
         padding = 1
         cropped_image = image.crop(
             (
@@ -163,16 +435,56 @@ class PdfParser:
             filename = f"table_{sha256(cropped_image.tobytes()).hexdigest()}.png"
             cropped_image.save(debug_dir / filename)
             logger.info(f"Saved table image to {filename}")
+        return cropped_image
 
+    async def _extract_table_text(
+        self, cropped_image: Image.Image, stats: TablesStats
+    ) -> str:
+        """
+        Never fails, a table that can't be extracted gets an empty text
+        """
         image_buffer = io.BytesIO()
         cropped_image.save(image_buffer, format="PNG")
-        image_base64 = base64.b64encode(image_buffer.getvalue()).decode("utf-8")
+        image = image_buffer.getvalue()
+        cache_key = self._table_cache_key(image)
+        table = await self._get_cached_table(cache_key)
+        if table:
+            logger.debug("Table found in cache", key=cache_key)
+            stats["cached"] += 1
+            return _format_table(table)
+
+        for attempt in range(1, TABLE_RETRIES + 1):
+            try:
+                table, estimated_tokens = await self._extract_table(
+                    image, cropped_image
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Failed to extract table text, attempt {attempt}/{TABLE_RETRIES}: {e}"
+                )
+                if attempt < TABLE_RETRIES:
+                    await asyncio.sleep(TABLE_RETRY_DELAY * 2 ** (attempt - 1))
+                continue
+
+            stats["extracted"] += 1
+            stats["estimated_tokens"] += estimated_tokens
+            await self._set_cached_table(cache_key, table)
+            return _format_table(table)
+
+        logger.error(f"Failed to extract table text {cache_key}")
+        stats["failed"] += 1
+        return ""
+
+    async def _extract_table(
+        self, image: bytes, cropped_image: Image.Image
+    ) -> tuple[Table, int]:
+        image_base64 = base64.b64encode(image).decode("utf-8")
         messages = [
             HumanMessage(
                 [
                     {
                         "type": "text",
-                        "text": "Extract all data from the image in json format",
+                        "text": TABLE_PROMPT,
                     },
                     {
                         "type": "image_url",
@@ -184,25 +496,49 @@ class PdfParser:
         estimated_tokens = estimate_input_tokens(
             self.llm_with_vision, messages, image=cropped_image
         )
-        logger.info(f"Estimated input tokens: {estimated_tokens:_}")
+        logger.debug(f"Estimated input tokens: {estimated_tokens:_}")
+        reservation = await self.vision_rate_limiter.acquire(
+            self.llm_with_vision,
+            estimated_tokens,
+            priority=Priority.PARSING,
+            user_id=self.user_id,
+        )
+        async with self.vision_rate_limiter.watch_errors():
+            response = await self.llm_with_vision.with_structured_output(
+                Table, include_raw=True
+            ).ainvoke(messages)
+        response = cast(dict[str, Any], response)
+        await self.vision_rate_limiter.observe(response["raw"], reservation)
+        if response["parsed"] is None:
+            raise Exception(f"Invalid table: {response['parsing_error']}")
+        table = cast(Table, response["parsed"])
+        logger.debug("Extracted table text", data=table.model_dump())
+        return table, estimated_tokens
+
+    def _table_cache_key(self, image: bytes) -> str:
+        """
+        Same crop, vision model and prompt give the same table
+        """
+        model_name = getattr(self.llm_with_vision, "model_name", None) or getattr(
+            self.llm_with_vision, "model", None
+        )
+        return (
+            f"tables:{model_name}:v{TABLE_PROMPT_VERSION}:{sha256(image).hexdigest()}"
+        )
+
+    async def _get_cached_table(self, key: str) -> Table | None:
         try:
-            response = await self.llm_with_vision.with_structured_output(Table).ainvoke(
-                messages
-            )
-            response = cast(Table, response)
-            logger.debug("Extracted table text", data=response.model_dump())
+            value = await get_redis().get(key)
         except Exception as e:
-            logger.error(f"Failed to extract table text: {e}")
-            return "", 0
+            logger.warning(f"Failed to read tables cache: {e}")
+            return None
+        return Table.model_validate_json(value) if value else None
 
-        text = f"""
-        Table: {response.title}
-        Description:
-        {response.content}
-        Data:
-        {response.data}
-        """
-        return text, estimated_tokens
+    async def _set_cached_table(self, key: str, table: Table) -> None:
+        try:
+            await get_redis().set(key, table.model_dump_json(), ex=TABLES_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to write tables cache: {e}")
 
     def _chunk(self, elements: list[Element]) -> list[Element]:
         """
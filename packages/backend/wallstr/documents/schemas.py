@@ -46,6 +46,9 @@ class DocumentStatusSSE(SSE):
     updated_at: datetime
     error: str | None
     errored_at: datetime | None
+    # progress of the processing document
+    pages_processed: int | None = None
+    pages_total: int | None = None
 
     @computed_field
     def type(self) -> str:
@@ -62,3 +65,8 @@ class DocumentSection(BaseModel):
 class DocumentPreview(BaseModel):
     document_title: str
     document_url: str
+
+
+class CachedDocumentPreview(BaseModel):
+    preview: DocumentPreview
+    expires_at: float
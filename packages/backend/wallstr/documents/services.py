@@ -1,36 +1,203 @@
-import io
+import asyncio
+import base64
+import gzip
+import itertools
+import json
+import time
 from datetime import timedelta
+from hashlib import sha256
+from typing import Any, NotRequired, TypedDict, cast
 from uuid import NAMESPACE_DNS, UUID, uuid5
 
-import boto3
-import botocore.config
+import structlog
 from redis.asyncio import Redis
 from sqlalchemy import or_, sql
 from sqlalchemy.ext.asyncio import AsyncSession
 from weaviate.classes.query import Filter
+from weaviate.collections import CollectionAsync
 
 from wallstr.conf import settings
+from wallstr.core.embeddings import (
+    CHUNK_EMBEDDINGS_CACHE_TTL,
+    EMBEDDING_MODEL,
+    EMBEDDING_VERSION,
+    get_embedder,
+    pack_vector,
+    unpack_vector,
+)
 from wallstr.core.llm import get_llm, get_llm_with_vision
+from wallstr.core.rate_limiters import Priority, get_rate_limiter
+from wallstr.core.redis import get_redis
+from wallstr.core.utils import LRUCache
 from wallstr.documents.models import DocumentModel, DocumentStatus, DocumentType
-from wallstr.documents.pdf_parser import PdfParser
-from wallstr.documents.schemas import DocumentStatusSSE
-from wallstr.documents.weaviate import get_weaviate_client
+from wallstr.documents.pdf_parser import PARSE_BATCH_PAGES, PdfParser
+from wallstr.documents.schemas import (
+    CachedDocumentPreview,
+    DocumentPreview,
+    DocumentStatusSSE,
+)
+from wallstr.documents.storage import (
+    DocumentFile,
+    Storage,
+    download_document,
+    get_storage,
+)
+from wallstr.documents.weaviate import BatchWriter, weaviate_client
 from wallstr.models.base import utc_now
 from wallstr.services import BaseService
+from wallstr.sse.publisher import publish_event
+
+logger = structlog.get_logger()
+
+PARSE_CACHE_PREFIX = "parse-cache"
+# seconds before the expiration of a presigned URL it's not served from cache
+DOCUMENT_URL_EXPIRE_MARGIN = 60
+
+# page of the cursor over a tenant, offset pagination of Weaviate
+# is limited by QUERY_MAXIMUM_RESULTS and the cursor doesn't take filters
+STORED_CHUNKS_PAGE_SIZE = 1000
+
+_document_previews: LRUCache[str, tuple[DocumentPreview, float]] = LRUCache(1024)
+
+
+class ParsedDocument(TypedDict):
+    chunks: list[dict[str, Any]]
+    pages_total: int
+    # base64 float32 vectors of the chunks by sha256 of their text,
+    # computed by the `embedding` stage
+    vectors: NotRequired[dict[str, str]]
+    embedding: NotRequired[str]
+
+
+class StoredChunk(TypedDict):
+    uuid: UUID
+    stages: dict[str, Any]
+    # float32 vector
+    vector: bytes | None
+
+
+class ParsedElements(TypedDict):
+    # elements of every page, before chunking
+    pages: list[list[dict[str, Any]]]
+
+
+# stages of the chunks stored before the stage properties, they never match
+LEGACY_STAGE_PROPERTIES: dict[str, Any] = {
+    "version": 0,
+    "inference_model": "",
+    "tables_version": 0,
+    "chunking_version": 0,
+    "embedding_model": "",
+    "embedding_version": 0,
+}
+EMBEDDING_STAGE_PROPERTIES = ("embedding_model", "embedding_version")
+
+
+def get_stage_properties() -> dict[str, Any]:
+    """
+    Parser and embedding stages stored with every chunk
+    """
+    return {
+        "version": PdfParser.version,
+        "inference_model": PdfParser.inference_model,
+        "tables_version": PdfParser.tables_version,
+        "chunking_version": PdfParser.chunking_version,
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_version": EMBEDDING_VERSION,
+    }
+
+
+def get_embedding_stage() -> str:
+    return f"{EMBEDDING_MODEL}-v{EMBEDDING_VERSION}"
+
+
+def get_text_hash(text: str) -> str:
+    return sha256(text.encode()).hexdigest()
+
+
+async def backfill_stage_properties(collection: CollectionAsync[Any, Any]) -> int:
+    """
+    Sets the missing stage properties of the tenant's chunks to the legacy stages,
+    null properties aren't matched by the reprocess filters.
+    The stored vectors are sent back, so the collections created with
+    text2vec_openai don't re-vectorize the chunks.
+    Returns the number of updated chunks
+    """
+    updated = 0
+    after: UUID | None = None
+    while True:
+        data = await collection.query.fetch_objects(
+            return_properties=list(LEGACY_STAGE_PROPERTIES),
+            include_vector=True,
+            limit=STORED_CHUNKS_PAGE_SIZE,
+            after=after,
+        )
+        if not data.objects:
+            break
+        after = data.objects[-1].uuid
+
+        updates = [
+            (
+                obj.uuid,
+                {
+                    name: value
+                    for name, value in LEGACY_STAGE_PROPERTIES.items()
+                    if obj.properties.get(name) is None
+                },
+                # a single vector, not the multi-vector of late interaction
+                cast(list[float] | None, obj.vector.get("default")),
+            )
+            for obj in data.objects
+        ]
+        updates = [update for update in updates if update[1]]
+        for batch in itertools.batched(updates, 100):
+            await asyncio.gather(
+                *(
+                    collection.data.update(
+                        uuid=uuid, properties=properties, vector=vector
+                    )
+                    for uuid, properties, vector in batch
+                )
+            )
+        updated += len(updates)
+    return updated
+
+
+def get_elements_cache_key(content_hash: str) -> str:
+    """
+    Elements are shared between uploads of the same file,
+    the key changes with the layout and the tables stages
+    """
+    return (
+        f"{PARSE_CACHE_PREFIX}/{content_hash}/elements-"
+        f"v{PdfParser.version}-t{PdfParser.tables_version}-"
+        f"{PdfParser.inference_model}.json.gz"
+    )
+
+
+def get_parse_cache_key(content_hash: str) -> str:
+    """
+    Parsed documents are shared between uploads of the same file,
+    the key changes with any stage of the parser
+    """
+    return (
+        f"{PARSE_CACHE_PREFIX}/{content_hash}/"
+        f"v{PdfParser.version}-t{PdfParser.tables_version}-"
+        f"c{PdfParser.chunking_version}-{PdfParser.inference_model}.json.gz"
+    )
 
 
 class DocumentService(BaseService):
-    def __init__(self, db_session: AsyncSession, redis: Redis | None = None) -> None:
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        redis: Redis | None = None,
+        storage: Storage | None = None,
+    ) -> None:
         super().__init__(db_session)
 
-        self.s3_client = boto3.client(
-            "s3",
-            endpoint_url=str(settings.STORAGE_URL),
-            aws_access_key_id=settings.STORAGE_ACCESS_KEY.get_secret_value(),
-            aws_secret_access_key=settings.STORAGE_SECRET_KEY.get_secret_value(),
-            config=botocore.config.Config(signature_version="s3v4"),
-        )
         self.redis = redis
+        self.storage = storage or get_storage()
 
     async def get_document(self, document_id: UUID) -> DocumentModel | None:
         async with self.tx():
@@ -45,15 +212,69 @@ class DocumentService(BaseService):
         if user_id != document.user_id:
             raise ValueError("User is not the owner of the document")
 
-        url = self.s3_client.generate_presigned_url(
-            ClientMethod="put_object",
-            Params={
-                "Bucket": settings.STORAGE_BUCKET,
-                "Key": document.storage_path,
-            },
-            ExpiresIn=60 * 5,
+        return self.storage.presign("put_object", document.storage_path, 60 * 5)
+
+    def generate_document_url(self, document: DocumentModel) -> str:
+        return self.storage.presign(
+            "get_object",
+            document.storage_path,
+            settings.DOCUMENT_URL_EXPIRE_MINUTES * 60,
+        )
+
+    async def get_document_preview(
+        self, user_id: UUID, document_id: UUID
+    ) -> DocumentPreview | None:
+        """
+        Presigned URL of the user's document, cached in the process and in Redis
+        until shortly before the URL expires
+
+        Raises ValueError if the user is not the owner of the document
+        """
+        key = f"document_previews:{user_id}:{document_id}"
+        if cached := _document_previews.get(key):
+            preview, expires_at = cached
+            if expires_at > time.time():
+                return preview
+
+        try:
+            value = await get_redis().get(key)
+        except Exception as e:
+            logger.warning(f"Failed to read document previews cache: {e}")
+            value = None
+        if value:
+            cached_preview = CachedDocumentPreview.model_validate_json(value)
+            _document_previews.set(
+                key, (cached_preview.preview, cached_preview.expires_at)
+            )
+            return cached_preview.preview
+
+        document = await self.get_document(document_id)
+        if not document:
+            return None
+        if document.user_id != user_id:
+            raise ValueError("User is not the owner of the document")
+
+        url_ttl = settings.DOCUMENT_URL_EXPIRE_MINUTES * 60
+        cache_ttl = url_ttl - max(DOCUMENT_URL_EXPIRE_MARGIN, url_ttl // 10)
+        preview = DocumentPreview(
+            document_title=document.filename,
+            document_url=self.generate_document_url(document),
         )
-        return url
+        if cache_ttl <= 0:
+            return preview
+        expires_at = time.time() + cache_ttl
+        _document_previews.set(key, (preview, expires_at))
+        try:
+            await get_redis().set(
+                key,
+                CachedDocumentPreview(
+                    preview=preview, expires_at=expires_at
+                ).model_dump_json(),
+                ex=cache_ttl,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to write document previews cache: {e}")
+        return preview
 
     async def mark_document_uploaded(
         self, user_id: UUID, document_id: UUID
@@ -142,48 +363,14 @@ class DocumentService(BaseService):
                     "Document cannot be processed, it is being processed already"
                 )
 
-            await self.mark_document_processing(document.user_id, document.id)
+            document = await self.mark_document_processing(
+                document.user_id, document.id
+            )
 
         try:
-            file_buffer = io.BytesIO()
-            self.s3_client.download_fileobj(
-                Bucket=settings.STORAGE_BUCKET,
-                Key=document.storage_path,
-                Fileobj=file_buffer,
-            )
-
-            parser_cls = get_parser_cls(document.doc_type)
-            llm = get_llm("gpt-4o")
-            llm_with_vision = get_llm_with_vision()
-            parser = parser_cls(llm, llm_with_vision)
-
-            chunks = await parser.parse(file_buffer)
-            record_id = uuid5(NAMESPACE_DNS, document.storage_path)
-            for chunk in chunks:
-                chunk["record_id"] = record_id
-                chunk["user_id"] = document.user_id
-                chunk["document_id"] = document.id
-                chunk["version"] = PdfParser.version
-                chunk["inference_model"] = PdfParser.inference_model
-
-            # Put data to weaviate
-            collection_name = "Documents"
-            wvc = get_weaviate_client(with_openai=True)
-            await wvc.connect()
-            try:
-                tenant_id = str(document.user_id)
-                collection = wvc.collections.get(collection_name)
-                if await collection.tenants.get_by_names([tenant_id]):
-                    await collection.with_tenant(tenant_id).data.delete_many(
-                        where=Filter.by_property("record_id").equal(str(record_id))
-                    )
-                for batch in range(0, len(chunks), 100):
-                    objects = chunks[batch : batch + 100]
-                    await collection.with_tenant(tenant_id).data.insert_many(objects)
-            except Exception:
-                raise
-            finally:
-                await wvc.close()
+            async with download_document(self.storage, document.storage_path) as file:
+                logger.info(f"Downloaded document, {file.size:_} bytes")
+                await self._ingest_document(document, file)
         except Exception as e:
             document = await self.mark_document_errored(
                 document.id, {"message": str(e), "code": "parse_error"}
@@ -193,10 +380,338 @@ class DocumentService(BaseService):
             document = await self.mark_document_ready(document.user_id, document.id)
         return document
 
-    async def _notify_document_status(self, document: DocumentModel) -> None:
+    async def _ingest_document(
+        self, document: DocumentModel, file: DocumentFile
+    ) -> None:
+        record_id = uuid5(NAMESPACE_DNS, document.storage_path)
+        # chunks of the previous parse, the ones left after the upsert are vanished
+        stored_chunks = await self._get_stored_chunks(document, record_id)
+        # vectors of the chunks by their text hash, shared with the parse cache
+        vectors: dict[str, bytes] = {}
+
+        content_hash = sha256(file.buffer).hexdigest()
+        cache_key = get_parse_cache_key(content_hash)
+        parsed_document: ParsedDocument | None = await self._get_cached(cache_key)
+        if parsed_document:
+            logger.info(f"Parsed document found in cache {cache_key}")
+            cached_vectors = {}
+            if parsed_document.get("embedding") == get_embedding_stage():
+                cached_vectors = parsed_document.get("vectors", {})
+            vectors = {
+                text_hash: base64.b64decode(vector)
+                for text_hash, vector in cached_vectors.items()
+            }
+            await self._upsert_chunks(
+                document,
+                record_id,
+                [chunk.copy() for chunk in parsed_document["chunks"]],
+                stored_chunks,
+                vectors,
+            )
+            await self._delete_chunks(document, stored_chunks)
+            if vectors.keys() != cached_vectors.keys():
+                # cached without the vectors or by a stale embedding stage
+                await self._put_parsed_document(cache_key, parsed_document, vectors)
+            await self._notify_document_status(
+                document,
+                pages_processed=parsed_document["pages_total"],
+                pages_total=parsed_document["pages_total"],
+            )
+            return
+
+        parser_cls = get_parser_cls(document.doc_type)
+        llm = get_llm("gpt-4o")
+        llm_with_vision = get_llm_with_vision("gpt-4o-mini")
+        parser = parser_cls(
+            llm,
+            llm_with_vision,
+            vision_rate_limiter=get_rate_limiter("gpt-4o-mini"),
+            user_id=document.user_id,
+        )
+
+        parsed_document = {"chunks": [], "pages_total": 0}
+        elements_key = get_elements_cache_key(content_hash)
+        parsed_elements: ParsedElements | None = await self._get_cached(elements_key)
+        if parsed_elements:
+            # only the chunking has changed, no layout inference and vision calls
+            logger.info(f"Parsed elements found in cache {elements_key}")
+            pages = parsed_elements["pages"]
+            parsed_document["pages_total"] = len(pages)
+            # same batches as the parsing, the chunks don't cross them
+            for start in range(0, len(pages), PARSE_BATCH_PAGES):
+                end = min(start + PARSE_BATCH_PAGES, len(pages))
+                chunks = parser.chunk_elements(pages[start:end])
+                parsed_document["chunks"].extend(chunk.copy() for chunk in chunks)
+                await self._upsert_chunks(
+                    document, record_id, chunks, stored_chunks, vectors
+                )
+                await self._notify_document_status(
+                    document, pages_processed=end, pages_total=len(pages)
+                )
+        else:
+            parsed_elements = {"pages": []}
+            # pages are searchable as soon as their batch is inserted
+            async for batch in parser.parse_pages(file):
+                parsed_elements["pages"].extend(batch["pages"])
+                parsed_document["chunks"].extend(
+                    chunk.copy() for chunk in batch["chunks"]
+                )
+                parsed_document["pages_total"] = batch["pages_total"]
+                await self._upsert_chunks(
+                    document, record_id, batch["chunks"], stored_chunks, vectors
+                )
+                await self._notify_document_status(
+                    document,
+                    pages_processed=batch["pages_done"],
+                    pages_total=batch["pages_total"],
+                )
+            await self._put_cached(elements_key, parsed_elements)
+        await self._delete_chunks(document, stored_chunks)
+        await self._put_parsed_document(cache_key, parsed_document, vectors)
+
+    async def _get_stored_chunks(
+        self, document: DocumentModel, record_id: UUID
+    ) -> dict[str, StoredChunk]:
+        """
+        Returns the chunks of the record by their element id,
+        duplicates left by an interrupted parse are deleted.
+        The tenant is read with the cursor, so a record isn't limited
+        by QUERY_MAXIMUM_RESULTS, vectors are fetched for the record only
+        """
+        stored_chunks: dict[str, StoredChunk] = {}
+        duplicates: list[UUID] = []
+        tenant_id = str(document.user_id)
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get("Documents")
+            if not await collection.tenants.get_by_names([tenant_id]):
+                return stored_chunks
+
+            collection = collection.with_tenant(tenant_id)
+            after: UUID | None = None
+            while True:
+                data = await collection.query.fetch_objects(
+                    return_properties=[
+                        "record_id",
+                        "element_id",
+                        *get_stage_properties(),
+                    ],
+                    limit=STORED_CHUNKS_PAGE_SIZE,
+                    after=after,
+                )
+                if not data.objects:
+                    break
+                after = data.objects[-1].uuid
+
+                for obj in data.objects:
+                    if str(obj.properties.get("record_id")) != str(record_id):
+                        continue
+                    element_id = obj.properties.get("element_id")
+                    if not isinstance(element_id, str) or element_id in stored_chunks:
+                        duplicates.append(obj.uuid)
+                        continue
+                    stored_chunks[element_id] = {
+                        "uuid": obj.uuid,
+                        "stages": {
+                            name: obj.properties.get(name)
+                            for name in get_stage_properties()
+                        },
+                        "vector": None,
+                    }
+
+            by_uuid = {chunk["uuid"]: chunk for chunk in stored_chunks.values()}
+            for uuids in itertools.batched(by_uuid, 100):
+                data = await collection.query.fetch_objects(
+                    filters=Filter.by_id().contains_any(list(uuids)),
+                    return_properties=[],
+                    include_vector=True,
+                    limit=len(uuids),
+                )
+                for obj in data.objects:
+                    # a single vector, not the multi-vector of late interaction
+                    vector = cast(list[float] | None, obj.vector.get("default"))
+                    if vector:
+                        by_uuid[obj.uuid]["vector"] = pack_vector(vector)
+
+            for batch in itertools.batched(duplicates, 100):
+                await collection.data.delete_many(
+                    where=Filter.by_id().contains_any(list(batch))
+                )
+        logger.info(
+            f"Stored chunks: {len(stored_chunks)}, duplicates: {len(duplicates)}"
+        )
+        return stored_chunks
+
+    async def _upsert_chunks(
+        self,
+        document: DocumentModel,
+        record_id: UUID,
+        chunks: list[dict[str, Any]],
+        stored_chunks: dict[str, StoredChunk],
+        vectors: dict[str, bytes],
+    ) -> None:
+        """
+        Inserts only the new chunks, the stored ones keep their vectors
+        unless the embedding stage is stale, and are popped from `stored_chunks`.
+        Only the texts missing from `vectors` are embedded,
+        `vectors` gets the vectors of all the chunks
+        """
+        stages = get_stage_properties()
+        new_chunks = []
+        stale_chunks: list[tuple[UUID, bytes | None]] = []
+        unembedded_chunks: list[tuple[UUID, dict[str, Any]]] = []
+        for chunk in chunks:
+            chunk["record_id"] = record_id
+            chunk["user_id"] = document.user_id
+            chunk["document_id"] = document.id
+            chunk.update(stages)
+
+            stored_chunk = stored_chunks.pop(chunk["element_id"], None)
+            if stored_chunk is None:
+                new_chunks.append(chunk)
+            elif any(
+                stored_chunk["stages"].get(name) != stages[name]
+                for name in EMBEDDING_STAGE_PROPERTIES
+            ):
+                unembedded_chunks.append((stored_chunk["uuid"], chunk))
+            else:
+                if stored_chunk["vector"] is not None:
+                    vectors.setdefault(
+                        get_text_hash(chunk["text"]), stored_chunk["vector"]
+                    )
+                if stored_chunk["stages"] != stages:
+                    stale_chunks.append((stored_chunk["uuid"], stored_chunk["vector"]))
+        logger.info(
+            f"Chunks new: {len(new_chunks)}, re-embedded: {len(unembedded_chunks)}, "
+            f"unchanged: {len(chunks) - len(new_chunks) - len(unembedded_chunks)}"
+        )
+
+        missing: dict[str, str] = {}
+        for chunk in [*new_chunks, *(chunk for _, chunk in unembedded_chunks)]:
+            text_hash = get_text_hash(chunk["text"])
+            if text_hash not in vectors:
+                missing[text_hash] = chunk["text"]
+        if missing:
+            # the same text of other uploads and other users is embedded once,
+            # vectors stay out of the process LRU, which serves the queries
+            computed = await get_embedder().embed_many(
+                list(missing.values()),
+                priority=Priority.PARSING,
+                user_id=document.user_id,
+                local_cache=False,
+                cache_ttl=CHUNK_EMBEDDINGS_CACHE_TTL,
+            )
+            for text_hash, vector in zip(missing, computed, strict=True):
+                vectors[text_hash] = pack_vector(vector)
+
+        def get_vector(chunk: dict[str, Any]) -> list[float]:
+            return unpack_vector(vectors[get_text_hash(chunk["text"])])
+
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get("Documents").with_tenant(
+                str(document.user_id)
+            )
+            async with BatchWriter(collection) as writer:
+                for chunk in new_chunks:
+                    await writer.add(chunk, get_vector(chunk))
+            # the text of a stored chunk is the same, only its vector is replaced
+            for unembedded_batch in itertools.batched(unembedded_chunks, 100):
+                await asyncio.gather(
+                    *(
+                        collection.data.update(
+                            uuid=uuid, properties=stages, vector=get_vector(chunk)
+                        )
+                        for uuid, chunk in unembedded_batch
+                    )
+                )
+            # only the stage properties change, the stored vector is sent back,
+            # so a collection created with a vectorizer doesn't re-vectorize
+            for stale_batch in itertools.batched(stale_chunks, 100):
+                await asyncio.gather(
+                    *(
+                        collection.data.update(
+                            uuid=uuid,
+                            properties=stages,
+                            vector=unpack_vector(vector) if vector else None,
+                        )
+                        for uuid, vector in stale_batch
+                    )
+                )
+
+    async def _delete_chunks(
+        self, document: DocumentModel, stored_chunks: dict[str, StoredChunk]
+    ) -> None:
+        """
+        Deletes the chunks vanished from the document
+        """
+        if not stored_chunks:
+            return
+        logger.info(f"Chunks vanished: {len(stored_chunks)}")
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get("Documents").with_tenant(
+                str(document.user_id)
+            )
+            for batch in itertools.batched(stored_chunks.values(), 100):
+                await collection.data.delete_many(
+                    where=Filter.by_id().contains_any(
+                        [stored_chunk["uuid"] for stored_chunk in batch]
+                    )
+                )
+        stored_chunks.clear()
+
+    async def _get_cached(self, key: str) -> Any:
+        try:
+            data = await self.storage.get(key)
+            if data is None:
+                return None
+            return json.loads(gzip.decompress(data))
+        except Exception as e:
+            # the cache is an optimization, the document is parsed instead
+            logger.warning(f"Failed to read parse cache {key}: {e}")
+            return None
+
+    async def _put_parsed_document(
+        self, key: str, parsed_document: ParsedDocument, vectors: dict[str, bytes]
+    ) -> None:
+        """
+        Stores the vectors of the chunks next to them,
+        so a duplicate upload isn't embedded again
+        """
+        text_hashes = {
+            get_text_hash(chunk["text"]) for chunk in parsed_document["chunks"]
+        }
+        parsed_document["vectors"] = {
+            text_hash: base64.b64encode(vector).decode()
+            for text_hash, vector in vectors.items()
+            if text_hash in text_hashes
+        }
+        parsed_document["embedding"] = get_embedding_stage()
+        await self._put_cached(key, parsed_document)
+
+    async def _put_cached(
+        self, key: str, value: ParsedDocument | ParsedElements
+    ) -> None:
+        try:
+            await self.storage.put(
+                key,
+                gzip.compress(json.dumps(value, default=str).encode()),
+                ContentType="application/json",
+                ContentEncoding="gzip",
+            )
+        except Exception as e:
+            # the cache is an optimization, the document is parsed already
+            logger.exception(e)
+
+    async def _notify_document_status(
+        self,
+        document: DocumentModel,
+        *,
+        pages_processed: int | None = None,
+        pages_total: int | None = None,
+    ) -> None:
         topic = f"{document.user_id}:documents:{document.id}"
         if self.redis is not None:
-            await self.redis.publish(
+            await publish_event(
+                self.redis,
                 topic,
                 DocumentStatusSSE(
                     id=document.id,
@@ -204,7 +719,9 @@ class DocumentService(BaseService):
                     updated_at=utc_now(),
                     error="Processing error" if document.error else None,
                     errored_at=document.errored_at,
-                ).model_dump_json(),
+                    pages_processed=pages_processed,
+                    pages_total=pages_total,
+                ),
             )
 
 
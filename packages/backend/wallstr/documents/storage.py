@@ -0,0 +1,139 @@
+import asyncio
+import mmap
+import os
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Literal
+
+import boto3
+import botocore.config
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from wallstr.conf import settings
+
+# shared by the API handlers / worker tasks of the process
+STORAGE_MAX_POOL_CONNECTIONS = 32
+# downloads of big files are split into concurrent ranged GETs
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 2**20,
+    multipart_chunksize=8 * 2**20,
+    max_concurrency=8,
+)
+
+
+class Storage:
+    """
+    Process-wide S3 client, boto3 clients are thread-safe and pool the connections,
+    blocking calls run in threads to keep the event loop free
+    """
+
+    def __init__(self, bucket: str) -> None:
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=str(settings.STORAGE_URL),
+            aws_access_key_id=settings.STORAGE_ACCESS_KEY.get_secret_value(),
+            aws_secret_access_key=settings.STORAGE_SECRET_KEY.get_secret_value(),
+            config=botocore.config.Config(
+                signature_version="s3v4",
+                max_pool_connections=STORAGE_MAX_POOL_CONNECTIONS,
+            ),
+        )
+
+    def presign(
+        self, method: Literal["get_object", "put_object"], key: str, expires_in: int
+    ) -> str:
+        """
+        Signs locally, no request is made
+        """
+        return self.client.generate_presigned_url(
+            ClientMethod=method,
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+    async def download(self, key: str, fileobj: IO[bytes]) -> None:
+        await asyncio.to_thread(
+            self.client.download_fileobj,
+            Bucket=self.bucket,
+            Key=key,
+            Fileobj=fileobj,
+            Config=TRANSFER_CONFIG,
+        )
+
+    async def get(self, key: str) -> bytes | None:
+        def get() -> bytes | None:
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    return None
+                raise
+            return response["Body"].read()
+
+        return await asyncio.to_thread(get)
+
+    async def put(self, key: str, body: bytes, **kwargs: Any) -> None:
+        await asyncio.to_thread(
+            self.client.put_object, Bucket=self.bucket, Key=key, Body=body, **kwargs
+        )
+
+    def close(self) -> None:
+        self.client.close()
+
+
+_storages: dict[str, Storage] = {}
+
+
+def get_storage(bucket: str = settings.STORAGE_BUCKET) -> Storage:
+    storage = _storages.get(bucket)
+    if storage is None:
+        storage = Storage(bucket)
+        _storages[bucket] = storage
+    return storage
+
+
+def close_storage() -> None:
+    while _storages:
+        _, storage = _storages.popitem()
+        storage.close()
+
+
+@dataclass(frozen=True)
+class DocumentFile:
+    """
+    Downloaded document, parsers read it by `path` or through the read-only
+    memory map `buffer`, so the file is never copied into the process memory
+    """
+
+    path: Path
+    buffer: mmap.mmap
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer)
+
+
+@asynccontextmanager
+async def download_document(
+    storage: Storage, storage_path: str
+) -> AsyncIterator[DocumentFile]:
+    """
+    Streams the document into a temporary file, removed on exit
+
+    Usage:
+        async with download_document(storage, document.storage_path) as file:
+            await parser.parse(file)
+    """
+    suffix = Path(storage_path).suffix
+    with tempfile.NamedTemporaryFile(prefix="wallstr-", suffix=suffix) as f:
+        await storage.download(storage_path, f)
+        f.flush()
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Document {storage_path} is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield DocumentFile(path=Path(f.name), buffer=buffer)
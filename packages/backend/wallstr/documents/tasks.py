@@ -27,7 +27,7 @@ async def process_document(document_id: str) -> None:
     if not redis:
         raise Exception("No redis")
 
-    document_svc = DocumentService(db_session, redis)
+    document_svc = DocumentService(db_session, redis, ctx.options.get("storage"))
     try:
         async with time_limit(minutes=10):
             await document_svc.parse_document(UUID(document_id))
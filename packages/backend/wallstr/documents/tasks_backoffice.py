@@ -1,5 +1,6 @@
 import asyncio
 import itertools
+from typing import cast
 from uuid import UUID
 
 import structlog
@@ -8,9 +9,9 @@ from dramatiq.middleware import CurrentMessage
 from weaviate.classes.query import Filter
 
 from wallstr.documents.models import DocumentModel
-from wallstr.documents.pdf_parser import PdfParser
-from wallstr.documents.services import DocumentService
+from wallstr.documents.services import DocumentService, get_stage_properties
 from wallstr.documents.tasks import process_document
+from wallstr.documents.weaviate import weaviate_client
 from wallstr.worker import dramatiq
 
 logger = structlog.get_logger()
@@ -29,42 +30,45 @@ async def reprocess_documents(all_: bool = False) -> None:
 
     db_session = ctx.options["session"]
     redis = ctx.options["redis"]
-    wvc = ctx.options["wvc"]
 
-    await wvc.connect()
-    document_svc = DocumentService(db_session, redis)
+    document_svc = DocumentService(db_session, redis, ctx.options.get("storage"))
 
     collection_name = "Documents"
-    collection = wvc.collections.get(collection_name)
-    tenants = await collection.tenants.get()
-    await wvc.close()
+    async with weaviate_client() as wvc:
+        collection = wvc.collections.get(collection_name)
+        tenants = await collection.tenants.get()
 
     total_documents = 0
     for tenant_id in tenants:
-        document_ids = set()
-
-        await wvc.connect()
-        wvc_offset = 0
-        wvc_limit = 100
-        while True:
-            data = await collection.with_tenant(tenant_id).query.fetch_objects(
-                return_properties=["document_id"],
-                filters=(
-                    Filter.by_property("version").not_equal(PdfParser.version)
-                    | Filter.by_property("inference_model").not_equal(
-                        PdfParser.inference_model
-                    )
-                ),
-                limit=wvc_limit,
-                offset=wvc_offset,
-            )
-            wvc_offset += wvc_limit
-
-            if not data.objects:
-                break
-
-            document_ids |= {obj.properties["document_id"] for obj in data.objects}
-        await wvc.close()
+        document_ids: set[UUID] = set()
+
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get(collection_name)
+            wvc_offset = 0
+            wvc_limit = 100
+            while True:
+                data = await collection.with_tenant(tenant_id).query.fetch_objects(
+                    return_properties=["document_id"],
+                    # a document is reparsed only by its stale stages,
+                    # see DocumentService._ingest_document. Null stages aren't
+                    # matched, they are backfilled by scripts/migrate_weaviate.py
+                    filters=Filter.any_of(
+                        [
+                            Filter.by_property(name).not_equal(value)
+                            for name, value in get_stage_properties().items()
+                        ]
+                    ),
+                    limit=wvc_limit,
+                    offset=wvc_offset,
+                )
+                wvc_offset += wvc_limit
+
+                if not data.objects:
+                    break
+
+                document_ids |= {
+                    cast(UUID, obj.properties["document_id"]) for obj in data.objects
+                }
 
         logger.info(f"Found {len(document_ids)} documents for tenant {tenant_id}")
         # TODO: there is limitation of dramatiq and pika in concurrency model
@@ -0,0 +1,79 @@
+from typing import Any
+from unittest import mock
+
+import pytest
+import pytest_mock
+
+from wallstr.documents.weaviate import BatchWriter
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(mocker: pytest_mock.MockFixture) -> None:
+    mocker.patch("wallstr.documents.weaviate.BATCH_RETRY_DELAY", 0)
+
+
+def _collection(*results: Any) -> mock.Mock:
+    collection = mock.Mock()
+    collection.data.insert_many = mock.AsyncMock(side_effect=results or None)
+    if not results:
+        collection.data.insert_many.return_value = mock.Mock(errors={})
+    return collection
+
+
+def _batches(collection: mock.Mock) -> list[list[int]]:
+    return [
+        [obj["i"] for obj in call.args[0]]
+        for call in collection.data.insert_many.await_args_list
+    ]
+
+
+async def test_batches_are_cut_by_objects_and_bytes() -> None:
+    collection = _collection()
+    async with BatchWriter(collection, concurrency=1, max_objects=2) as writer:
+        for i in range(5):
+            await writer.add({"i": i})
+    assert _batches(collection) == [[0, 1], [2, 3], [4]]
+    assert writer.inserted == 5
+
+    collection = _collection()
+    async with BatchWriter(collection, concurrency=1, max_bytes=50) as writer:
+        await writer.add({"i": 0, "text": "x" * 20})
+        await writer.add({"i": 1, "text": "x" * 20})
+        await writer.add({"i": 2})
+    assert _batches(collection) == [[0], [1, 2]]
+
+
+async def test_rejected_objects_are_retried() -> None:
+    collection = _collection(
+        mock.Mock(errors={1: mock.Mock(message="timeout")}),
+        mock.Mock(errors={}),
+    )
+    async with BatchWriter(collection, concurrency=1) as writer:
+        for i in range(3):
+            await writer.add({"i": i})
+    assert _batches(collection) == [[0, 1, 2], [1]]
+    assert writer.inserted == 3
+
+
+async def test_failed_batch_is_retried_by_halves() -> None:
+    collection = _collection(
+        Exception("Deadline Exceeded"),
+        mock.Mock(errors={}),
+        mock.Mock(errors={}),
+    )
+    async with BatchWriter(collection, concurrency=1) as writer:
+        for i in range(3):
+            await writer.add({"i": i})
+    assert _batches(collection) == [[0, 1, 2], [0, 1], [2]]
+    assert writer.inserted == 3
+
+
+async def test_errors_are_raised_after_retries() -> None:
+    collection = _collection()
+    collection.data.insert_many.return_value = mock.Mock(
+        errors={0: mock.Mock(message="invalid property")}
+    )
+    with pytest.raises(Exception, match="Failed to insert 1 objects"):
+        async with BatchWriter(collection) as writer:
+            await writer.add({"i": 0})
+    assert collection.data.insert_many.await_count == 3
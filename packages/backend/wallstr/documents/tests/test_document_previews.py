@@ -0,0 +1,68 @@
+from collections.abc import AsyncGenerator
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import sql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from wallstr.auth.models import UserModel
+from wallstr.documents.models import DocumentModel, DocumentStatus, DocumentType
+from wallstr.documents.services import DocumentService
+from wallstr.documents.storage import Storage
+
+
+@pytest.fixture
+async def document(
+    db_session: AsyncSession, alice: UserModel
+) -> AsyncGenerator[DocumentModel, None]:
+    async with db_session.begin():
+        document = DocumentModel(
+            user_id=alice.id,
+            filename="10-K.pdf",
+            doc_type=DocumentType.PDF,
+            storage_path=f"{alice.id}/10-K.pdf",
+            status=DocumentStatus.READY,
+        )
+        db_session.add(document)
+    yield document
+    async with db_session.begin():
+        await db_session.execute(sql.delete(DocumentModel).filter_by(id=document.id))
+
+
+async def test_get_document_preview_is_cached(
+    db_session: AsyncSession, alice: UserModel, document: DocumentModel
+) -> None:
+    cache: dict[str, str] = {}
+
+    async def get(key: str) -> str | None:
+        return cache.get(key)
+
+    async def set(key: str, value: str, **kwargs: object) -> None:
+        cache[key] = value
+
+    storage = mock.Mock(spec=Storage)
+    storage.presign.return_value = "https://storage/10-K.pdf?signature"
+    document_svc = DocumentService(db_session, storage=storage)
+
+    with mock.patch(
+        "wallstr.documents.services.get_redis",
+        return_value=mock.Mock(get=get, set=set),
+    ):
+        preview = await document_svc.get_document_preview(alice.id, document.id)
+        assert preview
+        assert preview.document_title == "10-K.pdf"
+        assert preview.document_url == "https://storage/10-K.pdf?signature"
+
+        with mock.patch.object(document_svc, "get_document") as get_document:
+            assert (
+                await document_svc.get_document_preview(alice.id, document.id)
+                == preview
+            )
+            get_document.assert_not_called()
+        assert storage.presign.call_count == 1
+        assert len(cache) == 1
+
+        assert await document_svc.get_document_preview(alice.id, uuid4()) is None
+        with pytest.raises(ValueError):
+            await document_svc.get_document_preview(uuid4(), document.id)
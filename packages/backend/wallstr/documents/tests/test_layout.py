@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+import onnxruntime
+
+from wallstr.documents.layout import (
+    LAYOUT_CHUNK_PAGES,
+    LayoutPool,
+    _load_model,
+    split_pages,
+)
+
+
+def test_split_pages() -> None:
+    paths = [Path(f"page-{i}.ppm") for i in range(1, 6)]
+
+    chunks = split_pages(paths, size=2)
+    assert [first_page for first_page, _ in chunks] == [1, 4]
+    assert [path for _, chunk in chunks for path in chunk] == paths
+
+    assert split_pages(paths, size=8) == [
+        (i, [path]) for i, path in enumerate(paths, 1)
+    ]
+    assert split_pages([], size=2) == []
+
+
+def test_split_pages_caps_chunk_size() -> None:
+    paths = [Path(f"page-{i}.ppm") for i in range(1, 101)]
+
+    chunks = split_pages(paths, size=2)
+    assert all(len(chunk) <= LAYOUT_CHUNK_PAGES for _, chunk in chunks)
+    assert chunks[1][0] == LAYOUT_CHUNK_PAGES + 1
+
+
+def test_split_pages_from_first_page() -> None:
+    paths = [Path(f"page-{i}.ppm") for i in range(11, 15)]
+
+    chunks = split_pages(paths, size=2, first_page=11)
+    assert chunks == [(11, paths[:2]), (13, paths[2:])]
+
+
+def test_layout_pool_shares_cpus_between_processes() -> None:
+    with mock.patch("os.sched_getaffinity", return_value=set(range(8))):
+        assert LayoutPool("yolox", size=2).threads == 4
+        assert LayoutPool("yolox", size=16).threads == 1
+
+
+def test_load_model_limits_threads_of_the_layout_session() -> None:
+    class Session:
+        def __init__(self, path: str, sess_options: Any = None, **kwargs: Any):
+            self.sess_options = sess_options
+
+        def get_providers(self) -> list[str]:
+            return ["CPUExecutionProvider"]
+
+    model = mock.Mock(model=Session("yolox.onnx"), model_path="yolox.onnx")
+    with (
+        mock.patch.object(onnxruntime, "InferenceSession", Session),
+        mock.patch("wallstr.documents.layout.get_model", return_value=model),
+        mock.patch.dict(os.environ),
+    ):
+        _load_model("yolox", threads=2)
+        # other sessions of the process keep the defaults
+        assert onnxruntime.InferenceSession is Session
+
+    assert model.model.sess_options.intra_op_num_threads == 2
+    assert model.model.sess_options.inter_op_num_threads == 1
+
+
+def test_layout_middleware_rebuilds_broken_pool(tmp_path: Path) -> None:
+    from wallstr.worker.middlewares import LayoutModelMiddleware
+
+    ready_file = tmp_path / "ready"
+    pool = mock.Mock(spec=LayoutPool, model_name="yolox", ready=False)
+
+    def warmup() -> list[dict[str, int]]:
+        # the worker isn't ready while the model is loaded
+        assert not ready_file.exists()
+        pool.ready = True
+        return [{"pid": 1, "max_rss": 0}]
+
+    pool.warmup.side_effect = warmup
+    middleware = LayoutModelMiddleware(pool, ready_file=ready_file)
+    middleware.before_worker_boot(mock.Mock(), mock.Mock())
+    assert ready_file.exists()
+
+    middleware.after_process_message(mock.Mock(), mock.Mock())
+    assert pool.warmup.call_count == 1
+
+    # a process died during the message
+    pool.ready = False
+    middleware.after_process_message(mock.Mock(), mock.Mock(), exception=Exception())
+    assert pool.warmup.call_count == 2
+    assert ready_file.exists()
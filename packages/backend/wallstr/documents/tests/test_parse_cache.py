@@ -0,0 +1,70 @@
+from unittest import mock
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from wallstr.documents.pdf_parser import PdfParser
+from wallstr.documents.services import (
+    DocumentService,
+    ParsedDocument,
+    get_elements_cache_key,
+    get_parse_cache_key,
+)
+from wallstr.documents.storage import Storage
+
+
+def test_parse_cache_key() -> None:
+    key = get_parse_cache_key("abc")
+    assert key.startswith("parse-cache/abc/")
+    assert f"v{PdfParser.version}" in key
+    assert PdfParser.inference_model in key
+
+
+def test_chunking_version_keeps_elements_cache() -> None:
+    elements_key = get_elements_cache_key("abc")
+    parse_key = get_parse_cache_key("abc")
+    with mock.patch.object(
+        PdfParser, "chunking_version", PdfParser.chunking_version + 1
+    ):
+        assert get_elements_cache_key("abc") == elements_key
+        assert get_parse_cache_key("abc") != parse_key
+
+    with mock.patch.object(PdfParser, "tables_version", PdfParser.tables_version + 1):
+        assert get_elements_cache_key("abc") != elements_key
+        assert get_parse_cache_key("abc") != parse_key
+
+
+async def test_parsed_document_roundtrip(db_session: AsyncSession) -> None:
+    objects: dict[str, bytes] = {}
+
+    async def put(key: str, body: bytes, **kwargs: str) -> None:
+        objects[key] = body
+
+    async def get(key: str) -> bytes | None:
+        return objects.get(key)
+
+    storage = mock.Mock(spec=Storage, put=put, get=get)
+    document_svc = DocumentService(db_session, storage=storage)
+
+    key = get_parse_cache_key("abc")
+    assert await document_svc._get_cached(key) is None
+
+    parsed_document: ParsedDocument = {
+        "chunks": [{"element_id": str(uuid4()), "text": "Revenue", "metadata": {}}],
+        "pages_total": 3,
+    }
+    await document_svc._put_cached(key, parsed_document)
+    assert await document_svc._get_cached(key) == parsed_document
+
+
+async def test_parse_cache_read_errors_are_misses(db_session: AsyncSession) -> None:
+    async def get(key: str) -> bytes | None:
+        if key.endswith("corrupt"):
+            return b"not gzip"
+        raise Exception("AccessDenied")
+
+    storage = mock.Mock(spec=Storage, get=get)
+    document_svc = DocumentService(db_session, storage=storage)
+
+    assert await document_svc._get_cached("parse-cache/abc/corrupt") is None
+    assert await document_svc._get_cached(get_parse_cache_key("abc")) is None
@@ -0,0 +1,169 @@
+import asyncio
+from collections.abc import Generator
+from pathlib import Path
+from unittest import mock
+
+import pdf2image
+import pytest
+from PIL import Image
+
+from wallstr.conf import settings
+from wallstr.documents.pdf_parser import (
+    PageImages,
+    PdfParser,
+    Table,
+    TablesStats,
+    extract_pages_with_pdfminer,
+)
+
+
+def get_pdf(path: Path, *colors: str) -> Path:
+    images = [Image.new("RGB", (200, 100), color) for color in colors]
+    images[0].save(path, format="PDF", save_all=True, append_images=images[1:])
+    return path
+
+
+def test_page_images_render_once(tmp_path: Path) -> None:
+    pdf = get_pdf(tmp_path / "document.pdf", "white", "black")
+    with PageImages(pdf, dpi=72) as pages:
+        with mock.patch.object(
+            pdf2image, "convert_from_path", wraps=pdf2image.convert_from_path
+        ) as convert:
+            pages.render()
+            pages.render()
+        assert convert.call_count == 1
+        assert len(pages) == 2
+
+        assert pages.open(1).getpixel((10, 10)) == (255, 255, 255)
+        assert pages.open(2).getpixel((10, 10)) == (0, 0, 0)
+        paths = list(pages.paths.values())
+
+    assert not pages.paths
+    assert not any(path.exists() for path in paths)
+
+
+def test_page_images_render_by_batches(tmp_path: Path) -> None:
+    pdf = get_pdf(tmp_path / "document.pdf", "white", "black", "white")
+    with PageImages(pdf, dpi=72) as pages:
+        assert len(pages) == 3
+        with mock.patch.object(
+            pdf2image, "convert_from_path", wraps=pdf2image.convert_from_path
+        ) as convert:
+            [first] = pages.render(1, 1)
+            assert list(pages.paths) == [1]
+            assert pages.render(1, 3)[0] == first
+        assert [call.kwargs["first_page"] for call in convert.call_args_list] == [1, 2]
+        assert pages.open(2).getpixel((10, 10)) == (0, 0, 0)
+
+
+def test_extract_pages_with_pdfminer(tmp_path: Path) -> None:
+    pdf = get_pdf(tmp_path / "document.pdf", "white", "black", "white")
+
+    extracted_layout, layouts_links = extract_pages_with_pdfminer(pdf, 2, 3)
+
+    assert len(extracted_layout) == 2
+    assert layouts_links == [[], []]
+
+
+def get_stats() -> TablesStats:
+    return {"extracted": 0, "cached": 0, "failed": 0, "estimated_tokens": 0}
+
+
+def get_parser(*responses: Table | Exception) -> tuple[PdfParser, mock.AsyncMock]:
+    llm_with_vision = mock.Mock(model_name="gpt-4o-mini")
+    ainvoke = mock.AsyncMock(
+        side_effect=[
+            response
+            if isinstance(response, Exception)
+            else {"raw": "", "parsed": response, "parsing_error": None}
+            for response in responses
+        ]
+    )
+    llm_with_vision.with_structured_output.return_value.ainvoke = ainvoke
+    return PdfParser(mock.Mock(), llm_with_vision), ainvoke
+
+
+@pytest.fixture
+def redis_cache() -> Generator[dict[str, str], None, None]:
+    cache: dict[str, str] = {}
+
+    async def get(key: str) -> str | None:
+        return cache.get(key)
+
+    async def set(key: str, value: str, **kwargs: object) -> None:
+        cache[key] = value
+
+    with (
+        mock.patch(
+            "wallstr.documents.pdf_parser.get_redis",
+            return_value=mock.Mock(get=get, set=set),
+        ),
+        mock.patch(
+            "wallstr.documents.pdf_parser.estimate_input_tokens", return_value=100
+        ),
+    ):
+        yield cache
+
+
+async def test_extract_table_text_is_cached(redis_cache: dict[str, str]) -> None:
+    parser, ainvoke = get_parser(
+        Table(title="Revenue", data="{}", content="Revenue by year")
+    )
+    image = Image.new("RGB", (100, 50), "white")
+    stats = get_stats()
+
+    text = await parser._extract_table_text(image, stats)
+    assert "Revenue by year" in text
+    assert await parser._extract_table_text(image, stats) == text
+
+    assert ainvoke.await_count == 1
+    assert len(redis_cache) == 1
+    assert stats == {"extracted": 1, "cached": 1, "failed": 0, "estimated_tokens": 100}
+
+
+async def test_extract_table_text_retries(redis_cache: dict[str, str]) -> None:
+    parser, ainvoke = get_parser(
+        Exception("timeout"),
+        Table(title="Revenue", data="{}", content="Revenue by year"),
+        Exception("timeout"),
+        Exception("timeout"),
+        Exception("timeout"),
+    )
+    stats = get_stats()
+
+    with mock.patch("wallstr.documents.pdf_parser.TABLE_RETRY_DELAY", 0):
+        text = await parser._extract_table_text(
+            Image.new("RGB", (100, 50), "white"), stats
+        )
+        assert "Revenue by year" in text
+
+        text = await parser._extract_table_text(
+            Image.new("RGB", (100, 50), "black"), stats
+        )
+        assert text == ""
+
+    assert ainvoke.await_count == 5
+    assert stats["extracted"] == 1
+    assert stats["failed"] == 1
+
+
+async def test_parse_tables_crops_off_the_event_loop(
+    redis_cache: dict[str, str],
+) -> None:
+    parser, _ = get_parser(Table(title="Revenue", data="{}", content="Revenue"))
+    table = mock.Mock(type="Table", text="")
+    table.bbox = mock.Mock(x1=0, y1=0, x2=50, y2=20)
+    layout = mock.Mock(pages=[mock.Mock(number=1, elements=[table])])
+    pages = mock.Mock(spec=PageImages)
+    pages.open.return_value = Image.new("RGB", (100, 50), "white")
+
+    with (
+        mock.patch("asyncio.to_thread", wraps=asyncio.to_thread) as to_thread,
+        # no debug crops in the working directory
+        mock.patch.object(settings, "DEBUG", False),
+    ):
+        _, stats = await parser._parse_tables_with_llm(pages, layout)
+
+    to_thread.assert_awaited_once_with(parser._crop_tables, pages, 1, [table])
+    assert "Revenue" in table.text
+    assert stats["extracted"] == 1
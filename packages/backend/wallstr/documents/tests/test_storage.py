@@ -0,0 +1,33 @@
+from typing import IO
+from unittest import mock
+
+import pytest
+
+from wallstr.documents.storage import Storage, download_document
+
+
+def get_storage(content: bytes) -> Storage:
+    async def download(key: str, fileobj: IO[bytes]) -> None:
+        fileobj.write(content)
+
+    return mock.Mock(spec=Storage, download=download)
+
+
+async def test_download_document() -> None:
+    storage = get_storage(b"%PDF-1.7 content")
+
+    async with download_document(storage, "user/document.pdf") as file:
+        assert file.path.exists()
+        assert file.path.suffix == ".pdf"
+        assert file.size == 16
+        assert file.buffer[:8] == b"%PDF-1.7"
+        assert file.path.read_bytes() == b"%PDF-1.7 content"
+        path = file.path
+
+    assert not path.exists()
+
+
+async def test_download_empty_document() -> None:
+    with pytest.raises(ValueError, match="empty"):
+        async with download_document(get_storage(b""), "user/document.pdf"):
+            pass
@@ -0,0 +1,235 @@
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+from unittest import mock
+from uuid import UUID, uuid4
+
+import pytest
+import pytest_mock
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from wallstr.core.embeddings import Embedder, pack_vector
+from wallstr.core.redis import close_redis, get_redis
+from wallstr.documents.models import DocumentModel
+from wallstr.documents.services import (
+    LEGACY_STAGE_PROPERTIES,
+    DocumentService,
+    backfill_stage_properties,
+    get_stage_properties,
+)
+from wallstr.documents.storage import Storage
+
+
+def _object(element_id: str, record_id: UUID | None = None, **stages: Any) -> mock.Mock:
+    return mock.Mock(
+        uuid=uuid4(),
+        properties={
+            "record_id": record_id,
+            "element_id": element_id,
+            **get_stage_properties(),
+            **stages,
+        },
+        vector={"default": [1.0]},
+    )
+
+
+@pytest.fixture
+def collection(mocker: pytest_mock.MockFixture) -> mock.Mock:
+    collection = mock.Mock()
+    collection.with_tenant.return_value = collection
+    collection.tenants.get_by_names = mock.AsyncMock(return_value={"tenant": {}})
+    collection.query.fetch_objects = mock.AsyncMock()
+    collection.data.insert_many = mock.AsyncMock(return_value=mock.Mock(errors={}))
+    collection.data.update = mock.AsyncMock()
+    collection.data.delete_many = mock.AsyncMock()
+
+    @asynccontextmanager
+    async def weaviate_client() -> AsyncGenerator[mock.Mock, None]:
+        yield mock.Mock(collections=mock.Mock(get=mock.Mock(return_value=collection)))
+
+    mocker.patch("wallstr.documents.services.weaviate_client", weaviate_client)
+    mocker.patch(
+        "wallstr.documents.services.get_embedder",
+        return_value=mock.Mock(
+            embed_many=mock.AsyncMock(
+                side_effect=lambda texts, **_: [[float(len(t))] for t in texts]
+            )
+        ),
+    )
+    return collection
+
+
+async def test_upsert_chunks_writes_only_the_diff(
+    db_session: AsyncSession, collection: mock.Mock
+) -> None:
+    record_id = uuid4()
+    unchanged = _object("unchanged", record_id)
+    stale = _object("stale", record_id, chunking_version=0)
+    unembedded = _object("unembedded", record_id, embedding_version=0)
+    vanished = _object("vanished", record_id)
+    duplicate = _object("unchanged", record_id)
+    other_record = _object("other", uuid4())
+    collection.query.fetch_objects.side_effect = [
+        # the cursor over the tenant, pages aren't filtered by the record
+        mock.Mock(objects=[unchanged, stale, other_record]),
+        mock.Mock(objects=[unembedded, vanished, duplicate]),
+        mock.Mock(objects=[]),
+        # vectors of the record's chunks
+        mock.Mock(objects=[unchanged, stale, unembedded, vanished]),
+    ]
+
+    document = mock.Mock(spec=DocumentModel, id=uuid4(), user_id=uuid4())
+    document_svc = DocumentService(db_session, storage=mock.Mock(spec=Storage))
+
+    stored_chunks = await document_svc._get_stored_chunks(document, record_id)
+    assert set(stored_chunks) == {"unchanged", "stale", "unembedded", "vanished"}
+    assert stored_chunks["unchanged"]["vector"] == pack_vector([1.0])
+    assert collection.query.fetch_objects.await_args_list[1].kwargs["after"] == (
+        other_record.uuid
+    )
+    assert collection.data.delete_many.await_count == 1
+
+    chunks = [
+        {"element_id": "unchanged", "text": "Revenue"},
+        {"element_id": "stale", "text": "EBITDA"},
+        {"element_id": "unembedded", "text": "Capex"},
+        {"element_id": "new", "text": "Net income"},
+    ]
+    await document_svc._upsert_chunks(document, record_id, chunks, stored_chunks, {})
+    [inserted] = collection.data.insert_many.await_args.args
+    assert [obj.properties["element_id"] for obj in inserted] == ["new"]
+    assert inserted[0].properties["record_id"] == record_id
+    assert inserted[0].vector == [float(len("Net income"))]
+    # the stored chunk is re-embedded without a new chunking
+    collection.data.update.assert_has_awaits(
+        [
+            mock.call(
+                uuid=unembedded.uuid,
+                properties=get_stage_properties(),
+                vector=[float(len("Capex"))],
+            ),
+            # the stored vector is kept, the stage properties aren't vectorized
+            mock.call(uuid=stale.uuid, properties=get_stage_properties(), vector=[1.0]),
+        ]
+    )
+    assert collection.data.update.await_count == 2
+    assert set(stored_chunks) == {"vanished"}
+
+    await document_svc._delete_chunks(document, stored_chunks)
+    assert collection.data.delete_many.await_count == 2
+    assert stored_chunks == {}
+
+
+async def test_upsert_chunks_embeds_the_same_text_once(
+    db_session: AsyncSession, collection: mock.Mock, mocker: pytest_mock.MockFixture
+) -> None:
+    embedder = Embedder()
+    aembed_documents = mocker.patch.object(
+        type(embedder.embeddings),
+        "aembed_documents",
+        mock.AsyncMock(side_effect=lambda texts: [[0.5] for _ in texts]),
+    )
+    mocker.patch("wallstr.documents.services.get_embedder", return_value=embedder)
+    document_svc = DocumentService(db_session, storage=mock.Mock(spec=Storage))
+    text = f"Revenue {uuid4()}"
+    try:
+        # the same text in the documents of two users
+        for _ in range(2):
+            document = mock.Mock(spec=DocumentModel, id=uuid4(), user_id=uuid4())
+            chunks = [{"element_id": str(uuid4()), "text": text}]
+            await document_svc._upsert_chunks(document, uuid4(), chunks, {}, {})
+        aembed_documents.assert_awaited_once_with([text])
+        assert collection.data.insert_many.await_count == 2
+        assert len(embedder.cache) == 0
+    finally:
+        await get_redis().delete(embedder._key(text))
+        await close_redis()
+
+
+async def test_ingest_document_reuses_cached_vectors(
+    db_session: AsyncSession, collection: mock.Mock, mocker: pytest_mock.MockFixture
+) -> None:
+    cache: dict[str, bytes] = {}
+    storage = mock.Mock(spec=Storage)
+    storage.get = mock.AsyncMock(side_effect=cache.get)
+    storage.put = mock.AsyncMock(
+        side_effect=lambda key, body, **_: cache.update({key: body})
+    )
+
+    async def parse_pages(file: Any) -> AsyncIterator[dict[str, Any]]:
+        yield {
+            "chunks": [
+                {"element_id": "revenue", "text": "Revenue"},
+                {"element_id": "capex", "text": "Capex"},
+            ],
+            "pages": [],
+            "pages_done": 1,
+            "pages_total": 1,
+        }
+
+    parser_cls = mocker.patch("wallstr.documents.services.get_parser_cls")
+    parser_cls.return_value.return_value.parse_pages = parse_pages
+    mocker.patch("wallstr.documents.services.get_llm")
+    mocker.patch("wallstr.documents.services.get_llm_with_vision")
+    collection.query.fetch_objects.return_value = mock.Mock(objects=[])
+    document_svc = DocumentService(db_session, storage=storage)
+    get_embedder = mocker.patch("wallstr.documents.services.get_embedder")
+    embed_many = get_embedder.return_value.embed_many = mock.AsyncMock()
+    embed_many.side_effect = lambda texts, **_: [[float(len(t))] for t in texts]
+
+    # the same file uploaded by two users, the second one hits the parse cache
+    file = mock.Mock(buffer=b"%PDF-1.7")
+    for _ in range(2):
+        document = mock.Mock(
+            spec=DocumentModel,
+            id=uuid4(),
+            user_id=uuid4(),
+            storage_path=f"{uuid4()}/report.pdf",
+        )
+        await document_svc._ingest_document(document, file)
+    embed_many.assert_awaited_once()
+    assert parser_cls.call_count == 1
+    [first, second] = [
+        call.args[0] for call in collection.data.insert_many.await_args_list
+    ]
+    assert [obj.vector for obj in second] == [[7.0], [5.0]]
+    assert [obj.vector for obj in first] == [obj.vector for obj in second]
+    assert second[0].properties["user_id"] == document.user_id
+
+
+async def test_backfill_stage_properties(collection: mock.Mock) -> None:
+    # stored before the stage properties, tables and chunking stages are null
+    legacy = mock.Mock(
+        uuid=uuid4(),
+        properties={
+            "version": 1,
+            "inference_model": "yolox_quantized",
+            "tables_version": None,
+            "chunking_version": None,
+        },
+        vector={"default": [0.5]},
+    )
+    current = _object("current")
+    collection.query.fetch_objects.side_effect = [
+        mock.Mock(objects=[legacy, current]),
+        mock.Mock(objects=[]),
+    ]
+
+    assert await backfill_stage_properties(collection) == 1
+    properties = {
+        name: LEGACY_STAGE_PROPERTIES[name]
+        for name in (
+            "tables_version",
+            "chunking_version",
+            "embedding_model",
+            "embedding_version",
+        )
+    }
+    # the vector is sent back, so the update isn't vectorized
+    collection.data.update.assert_awaited_once_with(
+        uuid=legacy.uuid, properties=properties, vector=[0.5]
+    )
+    assert collection.query.fetch_objects.await_args.kwargs["after"] == current.uuid
+    # the backfilled stages are stale for the reprocess filter
+    stages = get_stage_properties()
+    assert all(stages[name] != value for name, value in properties.items())
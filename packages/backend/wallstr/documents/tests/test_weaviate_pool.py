@@ -0,0 +1,100 @@
+import asyncio
+from unittest import mock
+
+import pytest
+import pytest_mock
+from weaviate import WeaviateAsyncClient
+
+from wallstr.documents.weaviate import WeaviateClientPool
+
+
+@pytest.fixture
+def clients(mocker: pytest_mock.MockFixture) -> list[mock.Mock]:
+    """
+    Fake clients in the order the pool creates them
+    """
+    clients: list[mock.Mock] = []
+
+    def get_weaviate_client(**_: object) -> mock.Mock:
+        client = mock.Mock(spec=WeaviateAsyncClient)
+        client.connect = mock.AsyncMock()
+        client.close = mock.AsyncMock()
+        client.is_ready = mock.AsyncMock(return_value=True)
+        client.is_connected.return_value = True
+        clients.append(client)
+        return client
+
+    mocker.patch(
+        "wallstr.documents.weaviate.get_weaviate_client",
+        side_effect=get_weaviate_client,
+    )
+    return clients
+
+
+async def test_pool_reuses_connected_client(clients: list[mock.Mock]) -> None:
+    pool = WeaviateClientPool(2)
+
+    async with pool.acquire() as first:
+        pass
+    async with pool.acquire() as second:
+        pass
+
+    assert first is second
+    assert clients == [first]
+    clients[0].connect.assert_awaited_once()
+
+
+async def test_pool_reconnects_unhealthy_client(clients: list[mock.Mock]) -> None:
+    pool = WeaviateClientPool(2, health_check_interval=0)
+
+    async with pool.acquire() as first:
+        pass
+    clients[0].is_ready.return_value = False
+    async with pool.acquire() as second:
+        pass
+
+    assert first is not second
+    clients[0].close.assert_awaited_once()
+
+
+async def test_pool_discards_disconnected_client_on_error(
+    clients: list[mock.Mock],
+) -> None:
+    pool = WeaviateClientPool(2)
+
+    with pytest.raises(ConnectionError):
+        async with pool.acquire():
+            clients[0].is_connected.return_value = False
+            raise ConnectionError()
+
+    async with pool.acquire() as second:
+        pass
+    assert clients == [clients[0], second]
+
+    await pool.close()
+    clients[1].close.assert_awaited_once()
+
+
+async def test_pool_discards_client_of_cancelled_borrower(
+    clients: list[mock.Mock],
+) -> None:
+    pool = WeaviateClientPool(1)
+    borrowed = asyncio.Event()
+
+    async def borrow() -> None:
+        async with pool.acquire():
+            borrowed.set()
+            await asyncio.sleep(60)
+
+    task = asyncio.create_task(borrow())
+    await borrowed.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    clients[0].close.assert_awaited_once()
+    assert pool._clients == set()
+    async with pool.acquire():
+        pass
+    assert len(clients) == 2
+    clients[1].close.assert_not_awaited()
@@ -1,11 +1,8 @@
-import io
 import tempfile
 from pathlib import Path
 from typing import Any
 from uuid import NAMESPACE_DNS, uuid5
 
-import boto3
-import botocore.config
 import structlog
 from pydantic import Secret
 from structlog.contextvars import bind_contextvars, clear_contextvars
@@ -32,6 +29,7 @@ from weaviate.classes.query import Filter
 
 from wallstr.conf import settings
 from wallstr.documents.models import DocumentModel
+from wallstr.documents.storage import download_document, get_storage
 from wallstr.documents.weaviate import get_weaviate_client
 
 logger = structlog.get_logger()
@@ -105,27 +103,16 @@ async def upload_document_to_weaviate_v2(
     clear_contextvars()
     bind_contextvars(user_id=document.user_id, document_id=document.id)
 
-    s3_client = boto3.client(
-        "s3",
-        endpoint_url=str(settings.STORAGE_URL),
-        aws_access_key_id=settings.STORAGE_ACCESS_KEY.get_secret_value(),
-        aws_secret_access_key=settings.STORAGE_SECRET_KEY.get_secret_value(),
-        config=botocore.config.Config(signature_version="s3v4"),
-    )
-
-    file_buffer = io.BytesIO()
-    s3_client.download_fileobj(
-        Bucket=settings.STORAGE_BUCKET, Key=document.storage_path, Fileobj=file_buffer
-    )
-    logger.info("Partitioning the file...")
-    elements = partition_pdf(
-        file=file_buffer,
-        strategy="hi_res",
-        split_pdf_page=True,
-        split_pdf_allow_failed=True,
-        split_pdf_concurrency_level=15,
-        infer_table_structure=True,
-    )
+    async with download_document(get_storage(), document.storage_path) as file:
+        logger.info("Partitioning the file...")
+        elements = partition_pdf(
+            filename=str(file.path),
+            strategy="hi_res",
+            split_pdf_page=True,
+            split_pdf_allow_failed=True,
+            split_pdf_concurrency_level=15,
+            infer_table_structure=True,
+        )
     logger.info("Chunking the file...")
     chunks = dispatch.chunk(elements=elements, chunking_strategy="by_title")
 
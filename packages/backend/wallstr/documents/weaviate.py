@@ -1,10 +1,33 @@
+import asyncio
+import json
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from types import TracebackType
+from typing import Any, Self
 from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
 
+import structlog
 import weaviate
 from weaviate import WeaviateAsyncClient
+from weaviate.classes.data import DataObject
+from weaviate.collections import CollectionAsync
 
 from wallstr.conf import settings
 
+logger = structlog.get_logger()
+
+# objects without a vector are vectorized by Weaviate, the batches are kept small
+BATCH_MAX_OBJECTS = 100
+BATCH_MAX_BYTES = 1024 * 1024
+BATCH_CONCURRENCY = 4
+BATCH_RETRIES = 3
+BATCH_RETRY_DELAY = 1.0
+
+# properties, or properties with a precomputed vector
+type BatchObject = dict[str, Any] | DataObject[dict[str, Any], None]
+
 
 def get_weaviate_client(with_openai: bool = False) -> WeaviateAsyncClient:
     if settings.WEAVIATE_API_URL and settings.WEAVIATE_GRPC_URL:
@@ -41,3 +64,249 @@ def get_weaviate_client(with_openai: bool = False) -> WeaviateAsyncClient:
         return client
 
     raise ValueError("WEAVIATE_API_URL, WEAVIATE_GRPC_URL are not set")
+
+
+class WeaviateClientPool:
+    """
+    Pool of connected Weaviate clients bound to a single event loop.
+    Clients are created lazily up to `size`, checked with `is_ready()`
+    when idle longer than `health_check_interval` and reconnected on failure.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        *,
+        with_openai: bool = False,
+        health_check_interval: float = 30.0,
+    ) -> None:
+        self.size = size
+        self.with_openai = with_openai
+        self.health_check_interval = health_check_interval
+
+        self._idle: asyncio.LifoQueue[tuple[WeaviateAsyncClient, float]] = (
+            asyncio.LifoQueue()
+        )
+        self._semaphore = asyncio.Semaphore(size)
+        self._clients: set[WeaviateAsyncClient] = set()
+        self._closed = False
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncGenerator[WeaviateAsyncClient, None]:
+        if self._closed:
+            raise RuntimeError("Weaviate client pool is closed")
+
+        async with self._semaphore:
+            client = await self._checkout()
+            try:
+                yield client
+            except Exception:
+                if not client.is_connected():
+                    await self._discard(client)
+                else:
+                    self._idle.put_nowait((client, time.monotonic()))
+                raise
+            except BaseException:
+                # cancelled in the middle of a call, the connection state is unknown
+                await self._discard(client)
+                raise
+            else:
+                self._idle.put_nowait((client, time.monotonic()))
+
+    async def warmup(self, count: int = 1) -> None:
+        """Opens `count` connections ahead of the first request"""
+        clients = [await self._checkout() for _ in range(min(count, self.size))]
+        for client in clients:
+            self._idle.put_nowait((client, time.monotonic()))
+
+    async def close(self) -> None:
+        self._closed = True
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        for client in list(self._clients):
+            await self._discard(client)
+
+    async def _checkout(self) -> WeaviateAsyncClient:
+        while not self._idle.empty():
+            client, released_at = self._idle.get_nowait()
+            if time.monotonic() - released_at < self.health_check_interval:
+                return client
+            if await self._is_healthy(client):
+                return client
+            logger.warning("Weaviate client is unhealthy, reconnecting")
+            await self._discard(client)
+
+        client = get_weaviate_client(with_openai=self.with_openai)
+        await client.connect()
+        self._clients.add(client)
+        return client
+
+    async def _is_healthy(self, client: WeaviateAsyncClient) -> bool:
+        if not client.is_connected():
+            return False
+        try:
+            return await client.is_ready()
+        except Exception as e:
+            logger.warning(f"Weaviate health check failed: {e}")
+            return False
+
+    async def _discard(self, client: WeaviateAsyncClient) -> None:
+        self._clients.discard(client)
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close Weaviate client: {e}")
+
+
+_pools: WeakKeyDictionary[asyncio.AbstractEventLoop, WeaviateClientPool] = (
+    WeakKeyDictionary()
+)
+
+
+def get_weaviate_pool() -> WeaviateClientPool:
+    """
+    Returns the pool of the running event loop,
+    API process and every dramatiq worker have their own loop
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None or pool._closed:
+        pool = WeaviateClientPool(settings.WEAVIATE_POOL_SIZE)
+        _pools[loop] = pool
+    return pool
+
+
+@asynccontextmanager
+async def weaviate_client() -> AsyncGenerator[WeaviateAsyncClient, None]:
+    """
+    Usage:
+        async with weaviate_client() as wvc:
+            collection = wvc.collections.get("Documents")
+    """
+    async with get_weaviate_pool().acquire() as client:
+        yield client
+
+
+class BatchWriter:
+    """
+    Inserts objects with several batches in flight.
+    Batches are cut by the number of objects and by the payload size,
+    objects rejected by Weaviate are retried, a failed request is retried by halves.
+
+    Usage:
+        async with BatchWriter(collection) as writer:
+            for obj in objects:
+                await writer.add(obj)
+    """
+
+    def __init__(
+        self,
+        collection: CollectionAsync[Any, Any],
+        *,
+        concurrency: int = BATCH_CONCURRENCY,
+        max_objects: int = BATCH_MAX_OBJECTS,
+        max_bytes: int = BATCH_MAX_BYTES,
+    ) -> None:
+        self.collection = collection
+        self.concurrency = concurrency
+        self.max_objects = max_objects
+        self.max_bytes = max_bytes
+        self.inserted = 0
+        self.errors: list[str] = []
+
+        # bounded, so the producer waits for Weaviate instead of buffering
+        self._queue: asyncio.Queue[list[BatchObject] | None] = asyncio.Queue(
+            concurrency
+        )
+        self._batch: list[BatchObject] = []
+        self._batch_bytes = 0
+        self._workers: list[asyncio.Task[None]] = []
+
+    async def __aenter__(self) -> Self:
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        if exc_type is not None:
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            return
+
+        await self.flush()
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers)
+        if self.errors:
+            raise Exception(
+                f"Failed to insert {len(self.errors)} objects: {self.errors[0]}"
+            )
+
+    async def add(self, obj: dict[str, Any], vector: list[float] | None = None) -> None:
+        """
+        Objects without a vector are vectorized by Weaviate
+        """
+        # vectors are sent as float32
+        size = len(json.dumps(obj, default=str)) + 4 * len(vector or ())
+        if self._batch and (
+            len(self._batch) >= self.max_objects
+            or self._batch_bytes + size > self.max_bytes
+        ):
+            await self.flush()
+        self._batch.append(
+            obj if vector is None else DataObject(properties=obj, vector=vector)
+        )
+        self._batch_bytes += size
+
+    async def flush(self) -> None:
+        """
+        Sends the pending objects to a worker
+        """
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        await self._queue.put(batch)
+
+    async def _worker(self) -> None:
+        while (batch := await self._queue.get()) is not None:
+            await self._insert(batch)
+
+    async def _insert(self, batch: list[BatchObject], attempt: int = 1) -> None:
+        try:
+            result = await self.collection.data.insert_many(batch)
+        except Exception as e:
+            if attempt >= BATCH_RETRIES:
+                self.errors.extend(str(e) for _ in batch)
+                return
+            logger.warning(
+                f"Failed to insert a batch of {len(batch)} objects, "
+                f"attempt {attempt}/{BATCH_RETRIES}: {e}"
+            )
+            await asyncio.sleep(BATCH_RETRY_DELAY * 2 ** (attempt - 1))
+            # large batches are the likely ones to time out
+            half = (len(batch) + 1) // 2
+            for part in (batch[:half], batch[half:]):
+                if part:
+                    await self._insert(part, attempt + 1)
+            return
+
+        self.inserted += len(batch) - len(result.errors)
+        if not result.errors:
+            return
+        if attempt >= BATCH_RETRIES:
+            self.errors.extend(error.message for error in result.errors.values())
+            return
+        logger.warning(
+            f"Failed to insert {len(result.errors)}/{len(batch)} objects, "
+            f"attempt {attempt}/{BATCH_RETRIES}: "
+            f"{next(iter(result.errors.values())).message}"
+        )
+        await asyncio.sleep(BATCH_RETRY_DELAY * 2 ** (attempt - 1))
+        await self._insert([batch[index] for index in result.errors], attempt + 1)
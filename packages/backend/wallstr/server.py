@@ -10,21 +10,23 @@ from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.security.utils import get_authorization_scheme_param
 from redis.asyncio import Redis
 from structlog.contextvars import bind_contextvars, clear_contextvars
-from weaviate import WeaviateAsyncClient
 
 import wallstr.sentry  #  type: ignore[import]
 from wallstr.auth.api import router as auth_router
 from wallstr.auth.dependencies import Authenticator, bearer_security
 from wallstr.chat.api import router as chat_router
 from wallstr.conf import config, settings
+from wallstr.core.redis import close_redis
 from wallstr.core.schemas import AuthConfig, ConfigResponse
 from wallstr.db import AsyncSessionMaker, create_async_engine, create_session_maker
 from wallstr.documents.api import router as documents_router
 from wallstr.documents.api_backoffice import router as documents_backoffice_router
-from wallstr.documents.weaviate import get_weaviate_client
+from wallstr.documents.storage import Storage, close_storage, get_storage
+from wallstr.documents.weaviate import WeaviateClientPool, get_weaviate_pool
 from wallstr.logging import configure_logging
 from wallstr.openapi import configure_openapi, generate_unique_id_function
 from wallstr.sse.api import router as sse_router
+from wallstr.sse.broker import SSEBroker
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +34,9 @@ logger = logging.getLogger(__name__)
 class AppState(TypedDict):
     redis: Redis
     session_maker: AsyncSessionMaker
-    wvc: WeaviateAsyncClient
+    sse_broker: SSEBroker
+    storage: Storage
+    wvc_pool: WeaviateClientPool
 
 
 @asynccontextmanager
@@ -43,15 +47,24 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[AppState, None]:
         logfire.instrument_sqlalchemy(engine)
 
     redis = Redis.from_url(settings.REDIS_URL.get_secret_value())
-    wvc = get_weaviate_client(with_openai=True)
-    await wvc.connect()
+    sse_broker = SSEBroker(redis)
+    sse_broker.start()
+    storage = get_storage()
+    wvc_pool = get_weaviate_pool()
+    await wvc_pool.warmup()
     try:
         yield {
             "redis": redis,
             "session_maker": session_maker,
-            "wvc": wvc,
+            "sse_broker": sse_broker,
+            "storage": storage,
+            "wvc_pool": wvc_pool,
         }
     finally:
+        try:
+            await sse_broker.close()
+        except Exception as e:
+            logger.exception(e)
         try:
             await redis.aclose()
         except Exception as e:
@@ -61,7 +74,15 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[AppState, None]:
         except Exception as e:
             logger.exception(e)
         try:
-            await wvc.close()
+            await wvc_pool.close()
+        except Exception as e:
+            logger.exception(e)
+        try:
+            await close_redis()
+        except Exception as e:
+            logger.exception(e)
+        try:
+            close_storage()
         except Exception as e:
             logger.exception(e)
 
@@ -5,13 +5,15 @@ from typing import Annotated
 import structlog
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from redis.asyncio import Redis
-from sse_starlette.sse import EventSourceResponse
+from sse_starlette import EventSourceResponse, ServerSentEvent
 from structlog.contextvars import bind_contextvars, clear_contextvars
 
 from wallstr.auth.schemas import HTTPUnauthorizedError
 from wallstr.auth.services import UserService
 from wallstr.core.utils import uvicorn_should_exit
 from wallstr.openapi import generate_unique_id_function
+from wallstr.sse.broker import SSEBroker
+from wallstr.sse.publisher import event_id_key, is_valid_event_id, read_events
 
 logger = structlog.get_logger()
 router = APIRouter(
@@ -25,8 +27,14 @@ router = APIRouter(
 async def connect(
     request: Request,
     user_svc: Annotated[UserService, Depends(UserService.inject_svc)],
+    last_event_id: str | None = None,
 ) -> EventSourceResponse:
+    """
+    Resumes after `Last-Event-ID` header or `last_event_id` query parameter,
+    the latter is for clients that reconnect with a new EventSource
+    """
     redis: Redis = request.state.redis
+    sse_broker: SSEBroker = request.state.sse_broker
 
     # TODO: refresh_token is used for authentincation, needs to introduce additional cookie based auth
     # for sse only
@@ -44,28 +52,35 @@ async def connect(
     clear_contextvars()
     bind_contextvars(user_id=auth_session.user_id)
 
-    async def generator() -> AsyncGenerator[str, None]:
-        async with redis.pubsub() as pubsub:
-            await pubsub.psubscribe(f"{auth_session.user_id}:*")
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    if last_event_id and not is_valid_event_id(last_event_id):
+        last_event_id = None
 
-            while not uvicorn_should_exit():
-                if await request.is_disconnected():
-                    await pubsub.aclose()
-                    break
+    async def generator() -> AsyncGenerator[ServerSentEvent, None]:
+        # subscribe before the replay, so no event is lost in between
+        async with sse_broker.subscribe(auth_session.user_id) as subscription:
+            last_id = last_event_id
+            if last_id:
+                events = await read_events(redis, auth_session.user_id, last_id)
+                logger.info(f"Replaying {len(events)} events after {last_id}")
+                for replayed_id, replayed in events:
+                    yield ServerSentEvent(data=replayed, id=replayed_id)
+                    last_id = replayed_id
 
+            while not uvicorn_should_exit():
                 try:
-                    message = await pubsub.get_message(
-                        ignore_subscribe_messages=True,
-                        timeout=5.0,
-                    )
-
-                    if message is not None:
-                        yield message["data"].decode("utf-8")
-                except asyncio.CancelledError as e:
-                    await pubsub.aclose()
-                    raise e
-                except ConnectionError as e:
-                    await pubsub.aclose()
-                    raise e
+                    item = await asyncio.wait_for(subscription.queue.get(), 5.0)
+                except TimeoutError:
+                    continue
+                if item is None:
+                    # dropped as a slow consumer, the client reconnects
+                    break
+                event_id, data = item
+                if event_id:
+                    if last_id and event_id_key(event_id) <= event_id_key(last_id):
+                        # already replayed
+                        continue
+                    last_id = event_id
+                yield ServerSentEvent(data=data, id=event_id)
 
     return EventSourceResponse(generator())
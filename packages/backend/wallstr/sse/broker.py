@@ -0,0 +1,131 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from uuid import UUID
+
+import structlog
+from redis.asyncio import Redis
+
+from wallstr.sse.publisher import parse_message
+
+logger = structlog.get_logger()
+
+SSE_QUEUE_SIZE = 256
+
+
+class Subscription:
+    """
+    SSE connection of a user, receives the user's events from the broker
+    """
+
+    def __init__(self, user_id: UUID, maxsize: int) -> None:
+        self.user_id = user_id
+        # (event id, data), None closes the connection
+        self.queue: asyncio.Queue[tuple[str | None, str] | None] = asyncio.Queue(
+            maxsize
+        )
+        self.dropped = False
+
+    def put(self, event_id: str | None, data: str) -> None:
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait((event_id, data))
+        except asyncio.QueueFull:
+            logger.warning(f"Dropping slow SSE consumer of user {self.user_id}")
+            self.close()
+
+    def close(self) -> None:
+        """
+        Discards pending events, so the consumer disconnects on the next read
+        """
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class SSEBroker:
+    """
+    Single Redis pub/sub reader of the process, demultiplexes events
+    into per-connection queues. A user pattern is subscribed while
+    the user has at least one open connection
+    """
+
+    def __init__(self, redis: Redis, *, queue_size: int = SSE_QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+        self._pubsub = redis.pubsub()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._lock = asyncio.Lock()
+        self._has_subscriptions = asyncio.Event()
+        self._reader: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._reader
+            self._reader = None
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.close()
+        self._subscriptions.clear()
+        await self._pubsub.aclose()  # type: ignore[no-untyped-call]
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: UUID) -> AsyncIterator[Subscription]:
+        key = str(user_id)
+        subscription = Subscription(user_id, self.queue_size)
+        async with self._lock:
+            if key not in self._subscriptions:
+                await self._pubsub.psubscribe(f"{key}:*")
+                self._subscriptions[key] = set()
+            self._subscriptions[key].add(subscription)
+            self._has_subscriptions.set()
+        try:
+            yield subscription
+        finally:
+            async with self._lock:
+                subscriptions = self._subscriptions.get(key, set())
+                subscriptions.discard(subscription)
+                if not subscriptions and key in self._subscriptions:
+                    del self._subscriptions[key]
+                    try:
+                        await self._pubsub.punsubscribe(f"{key}:*")
+                    except Exception as e:
+                        logger.exception(e)
+
+    def dispatch(self, channel: str, message: str) -> None:
+        user_id = channel.split(":", 1)[0]
+        event_id, data = parse_message(message)
+        for subscription in list(self._subscriptions.get(user_id, ())):
+            subscription.put(event_id, data)
+
+    async def _read(self) -> None:
+        while True:
+            if not self._subscriptions:
+                self._has_subscriptions.clear()
+                await self._has_subscriptions.wait()
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "pmessage":
+                continue
+            self.dispatch(
+                message["channel"].decode("utf-8"), message["data"].decode("utf-8")
+            )
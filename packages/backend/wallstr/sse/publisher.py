@@ -0,0 +1,168 @@
+import asyncio
+import re
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from types import TracebackType
+from typing import Self
+from uuid import UUID
+
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+SSE_STREAM_MAXLEN = 1000
+SSE_STREAM_TTL = timedelta(hours=1)
+
+# Appends the event to the user's stream and publishes it with the stream id,
+# so live subscribers and replays share the same event ids
+PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', ARGV[4], id .. '\\n' .. ARGV[3])
+return id
+"""
+
+EVENT_ID_RE = re.compile(r"^\d+-\d+$")
+
+
+def get_stream_key(user_id: UUID | str) -> str:
+    return f"sse:{user_id}"
+
+
+async def publish_event(redis: Redis, topic: str, event: BaseModel) -> str:
+    """
+    Publishes the event to the topic `{user_id}:...` and returns its id
+    """
+    user_id = topic.split(":", 1)[0]
+    event_id = await redis.eval(  # type: ignore[misc]
+        PUBLISH_SCRIPT,
+        1,
+        get_stream_key(user_id),
+        str(SSE_STREAM_MAXLEN),
+        str(int(SSE_STREAM_TTL.total_seconds())),
+        event.model_dump_json(),
+        topic,
+    )
+    return event_id.decode() if isinstance(event_id, bytes) else str(event_id)
+
+
+async def read_events(
+    redis: Redis, user_id: UUID, last_event_id: str
+) -> list[tuple[str, str]]:
+    """
+    Returns the user's events published after `last_event_id`
+    """
+    entries = await redis.xrange(
+        get_stream_key(user_id), min=f"({last_event_id}", max="+"
+    )
+    return [
+        (event_id.decode(), fields[b"data"].decode()) for event_id, fields in entries
+    ]
+
+
+def parse_message(message: str) -> tuple[str | None, str]:
+    """
+    Splits a pub/sub message into the event id and the data,
+    JSON data never contains raw new lines
+    """
+    event_id, sep, data = message.partition("\n")
+    if not sep:
+        return None, message
+    return event_id, data
+
+
+def is_valid_event_id(event_id: str) -> bool:
+    return EVENT_ID_RE.match(event_id) is not None
+
+
+def event_id_key(event_id: str) -> tuple[int, int]:
+    ms, seq = event_id.split("-")
+    return int(ms), int(seq)
+
+
+class ChunkCoalescer:
+    """
+    Batches streamed LLM chunks before publishing them,
+    a batch is flushed after `interval` seconds or once it reaches `max_bytes`.
+    The first chunk is published right away to keep the time to first token
+
+    Usage:
+        async with ChunkCoalescer(publish) as coalescer:
+            async for chunk in llm.astream(messages):
+                await coalescer.add(chunk.content)
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str], Awaitable[None]],
+        *,
+        interval: float = 0.04,
+        max_bytes: int = 1024,
+    ) -> None:
+        self.publish = publish
+        self.interval = interval
+        self.max_bytes = max_bytes
+
+        self.published = 0
+        self._buffer: list[str] = []
+        self._size = 0
+        self._timer: asyncio.Task[None] | None = None
+        self._timer_publishing = False
+        self._lock = asyncio.Lock()
+
+    async def add(self, content: str) -> None:
+        if self._timer is not None and self._timer.done():
+            # raises if the timer failed to publish
+            await self._wait_timer()
+        self._buffer.append(content)
+        self._size += len(content.encode())
+        if not self.published or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        await self._wait_timer()
+        await self._flush()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        # chunks added while publishing wait for the next window
+        while self._buffer:
+            await asyncio.sleep(self.interval)
+            # flush() waits for the publishing timer instead of cancelling it
+            self._timer_publishing = True
+            try:
+                await self._flush()
+            finally:
+                self._timer_publishing = False
+
+    async def _wait_timer(self) -> None:
+        timer, self._timer = self._timer, None
+        if timer is None:
+            return
+        if not self._timer_publishing:
+            timer.cancel()
+        await asyncio.wait([timer])
+        if not timer.cancelled():
+            # re-raises the exception of a failed publish
+            timer.result()
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+            content = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.published += 1
+            await self.publish(content)
@@ -0,0 +1,47 @@
+from unittest import mock
+from uuid import uuid4
+
+from wallstr.sse.broker import SSEBroker
+
+
+def get_broker(queue_size: int = 4) -> tuple[SSEBroker, mock.AsyncMock]:
+    redis = mock.Mock()
+    pubsub = redis.pubsub.return_value = mock.AsyncMock()
+    return SSEBroker(redis, queue_size=queue_size), pubsub
+
+
+async def test_broker_dispatches_user_events() -> None:
+    broker, pubsub = get_broker()
+    user_id, other_user_id = uuid4(), uuid4()
+
+    async with (
+        broker.subscribe(user_id) as first,
+        broker.subscribe(user_id) as second,
+        broker.subscribe(other_user_id) as other,
+    ):
+        assert broker.connections == 3
+        broker.dispatch(f"{user_id}:chat:message", '1-0\n{"type": "event"}')
+
+        assert first.queue.get_nowait() == ("1-0", '{"type": "event"}')
+        assert second.queue.get_nowait() == ("1-0", '{"type": "event"}')
+        assert other.queue.empty()
+
+    assert broker.connections == 0
+    assert pubsub.psubscribe.await_count == 2
+    pubsub.punsubscribe.assert_has_awaits(
+        [mock.call(f"{user_id}:*"), mock.call(f"{other_user_id}:*")], any_order=True
+    )
+
+
+async def test_broker_drops_slow_consumer() -> None:
+    broker, _ = get_broker(queue_size=2)
+    user_id = uuid4()
+
+    async with broker.subscribe(user_id) as subscription:
+        for i in range(3):
+            broker.dispatch(f"{user_id}:chat", f"event {i}")
+
+        assert subscription.dropped
+        assert subscription.queue.get_nowait() is None
+        broker.dispatch(f"{user_id}:chat", "event")
+        assert subscription.queue.empty()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from wallstr.sse.publisher import (
+    ChunkCoalescer,
+    event_id_key,
+    is_valid_event_id,
+    parse_message,
+)
+
+
+async def test_coalescer_batches_chunks() -> None:
+    published: list[str] = []
+
+    async def publish(content: str) -> None:
+        published.append(content)
+
+    async with ChunkCoalescer(publish, interval=0.05) as coalescer:
+        for chunk in ["Hello", ",", " wor", "ld"]:
+            await coalescer.add(chunk)
+        # the first chunk goes out immediately, the rest waits for the window
+        assert published == ["Hello"]
+
+    assert published == ["Hello", ", world"]
+    assert coalescer.published == 2
+
+
+async def test_coalescer_flushes_by_interval() -> None:
+    published: list[str] = []
+
+    async def publish(content: str) -> None:
+        published.append(content)
+
+    async with ChunkCoalescer(publish, interval=0.01) as coalescer:
+        await coalescer.add("a")
+        await coalescer.add("b")
+        await asyncio.sleep(0.05)
+        assert published == ["a", "b"]
+        await coalescer.add("c")
+
+    assert published == ["a", "b", "c"]
+
+
+async def test_coalescer_flushes_by_size() -> None:
+    published: list[str] = []
+
+    async def publish(content: str) -> None:
+        published.append(content)
+
+    async with ChunkCoalescer(publish, interval=10, max_bytes=4) as coalescer:
+        for chunk in ["x", "ab", "cd", "e"]:
+            await coalescer.add(chunk)
+        assert published == ["x", "abcd"]
+
+    assert published == ["x", "abcd", "e"]
+
+
+def test_parse_message() -> None:
+    assert parse_message('1700000000000-0\n{"type": "event"}') == (
+        "1700000000000-0",
+        '{"type": "event"}',
+    )
+    # messages published without a stream id
+    assert parse_message('{"type": "event"}') == (None, '{"type": "event"}')
+
+
+def test_event_ids() -> None:
+    assert is_valid_event_id("1700000000000-1")
+    assert not is_valid_event_id("1700000000000")
+    assert not is_valid_event_id("-1")
+    assert event_id_key("1700000000000-2") > event_id_key("1700000000000-1")
+    assert event_id_key("1700000000001-0") > event_id_key("1700000000000-10")
+
+
+async def test_coalescer_raises_timer_publish_error() -> None:
+    published: list[str] = []
+
+    async def publish(content: str) -> None:
+        if published:
+            raise ConnectionError("redis is down")
+        published.append(content)
+
+    coalescer = ChunkCoalescer(publish, interval=0.01)
+    await coalescer.add("a")
+    await coalescer.add("b")
+    # the timer fails to publish "b"
+    await asyncio.sleep(0.05)
+    with pytest.raises(ConnectionError):
+        await coalescer.add("c")
+
+    coalescer = ChunkCoalescer(publish, interval=0.01)
+    published.clear()
+    with pytest.raises(ConnectionError):
+        async with coalescer:
+            await coalescer.add("a")
+            await coalescer.add("b")
+            await asyncio.sleep(0.05)
+    assert published == ["a"]
@@ -13,7 +13,7 @@ from dramatiq.results.backends import RedisBackend
 import wallstr.sentry  #  type: ignore[import]
 from wallstr.conf import settings
 
-from .middlewares import AsyncSessionMiddleware
+from .middlewares import AsyncSessionMiddleware, RateLimiterStatsMiddleware
 
 rabbitmq_broker = RabbitmqBroker(
     url=settings.RABBITMQ_URL.get_secret_value(),
@@ -25,6 +25,7 @@ rabbitmq_broker = RabbitmqBroker(
         ShutdownNotifications(),  # type: ignore[no-untyped-call]
         Callbacks(),
         AsyncSessionMiddleware(),
+        RateLimiterStatsMiddleware(),
         CurrentMessage(),
     ],
 )  # type: ignore[no-untyped-call]
@@ -1,5 +1,13 @@
+from wallstr.documents.layout import get_layout_pool
+from wallstr.documents.pdf_parser import PdfParser
 from wallstr.documents.tasks import *
 from wallstr.documents.tasks_backoffice import *
 from wallstr.logging import configure_logging
+from wallstr.worker import dramatiq
+from wallstr.worker.middlewares import LayoutModelMiddleware
 
 configure_logging(name="heavy")
+
+dramatiq.get_broker().add_middleware(  # type: ignore[no-untyped-call]
+    LayoutModelMiddleware(get_layout_pool(PdfParser.inference_model))
+)
@@ -1,19 +1,34 @@
-from typing import Any, TypeVar
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TypeVar
 
 import logfire
-from dramatiq import Broker, Message, Worker
+import structlog
+from dramatiq import Broker, Message, Middleware, Worker
 from dramatiq.asyncio import get_event_loop_thread
 from dramatiq.middleware import AsyncIO
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
-from weaviate import WeaviateAsyncClient
 
 from wallstr.conf import settings
+from wallstr.core.rate_limiters import log_rate_limiter_stats
+from wallstr.core.redis import close_redis
 from wallstr.db import AsyncSessionMaker, create_async_engine, create_session_maker
-from wallstr.documents.weaviate import get_weaviate_client
+from wallstr.documents.storage import Storage, close_storage, get_storage
+from wallstr.documents.weaviate import WeaviateClientPool, get_weaviate_pool
+
+if TYPE_CHECKING:
+    # unstructured_inference is only needed by the heavy worker
+    from wallstr.documents.layout import LayoutPool
+
+logger = structlog.get_logger()
 
 T = TypeVar("T")
 
+LAYOUT_READY_FILE = Path(tempfile.gettempdir()) / "wallstr-layout-ready"
+
 
 class AsyncSessionMiddleware(AsyncIO):
     """Middleware that provides an async session for each actor and manages the AsyncIO event loop."""
@@ -22,14 +37,21 @@ class AsyncSessionMiddleware(AsyncIO):
         super().__init__()  # type: ignore[no-untyped-call]
         self.engine: AsyncEngine
         self.session_maker: AsyncSessionMaker
-        self.wvc: WeaviateAsyncClient
+        self.wvc_pool: WeaviateClientPool
+        self.storage: Storage
 
     def before_worker_boot(self, broker: Broker, worker: Worker) -> None:
         super().before_worker_boot(broker, worker)  # type: ignore[no-untyped-call]
         self.redis = Redis.from_url(settings.REDIS_URL.get_secret_value())
         self.engine = create_async_engine(settings.DATABASE_URL, "dramatiq-worker")
         self.session_maker = create_session_maker(self.engine)
-        self.wvc = get_weaviate_client(with_openai=True)
+        self.storage = get_storage()
+
+        event_loop_thread = get_event_loop_thread()
+        if not event_loop_thread:
+            raise RuntimeError("Event loop thread not initialized")
+        # the pool is bound to the worker's event loop, create it inside the loop
+        self.wvc_pool = event_loop_thread.run_coroutine(_get_weaviate_pool())
 
         if settings.LOGFIRE_TOKEN:
             logfire.instrument_sqlalchemy(self.engine)
@@ -41,7 +63,8 @@ class AsyncSessionMiddleware(AsyncIO):
         message.options["session_maker"] = self.session_maker
         message.options["session"] = self.session_maker()
         message.options["redis"] = self.redis
-        message.options["wvc"] = self.wvc
+        message.options["wvc_pool"] = self.wvc_pool
+        message.options["storage"] = self.storage
 
     def after_process_message(
         self,
@@ -71,4 +94,101 @@ class AsyncSessionMiddleware(AsyncIO):
         if event_loop_thread and self.redis:
             event_loop_thread.run_coroutine(self.redis.aclose())
 
+        if event_loop_thread and self.wvc_pool:
+            event_loop_thread.run_coroutine(self.wvc_pool.close())
+
+        if event_loop_thread:
+            event_loop_thread.run_coroutine(close_redis())
+
+        close_storage()
+
         super().before_worker_shutdown(broker, worker)  # type: ignore[no-untyped-call]
+
+
+class RateLimiterStatsMiddleware(Middleware):
+    """
+    Logs the rate limiter wait times by priority class every `interval` seconds
+    and on worker shutdown. Must be added after AsyncSessionMiddleware
+    """
+
+    def __init__(self, interval: float = 5 * 60) -> None:
+        self.interval = interval
+        self._logged_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def after_process_message(
+        self,
+        broker: Broker,
+        message: Message[T],
+        *,
+        result: Any | None = None,
+        exception: Exception | None = None,
+    ) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._logged_at < self.interval:
+                return
+            self._logged_at = now
+
+        event_loop_thread = get_event_loop_thread()
+        if event_loop_thread:
+            # the stats are updated on the event loop thread
+            event_loop_thread.loop.call_soon_threadsafe(log_rate_limiter_stats)
+
+    def before_worker_shutdown(self, broker: Broker, worker: Worker) -> None:
+        # the event loop is stopped by AsyncSessionMiddleware at this point
+        log_rate_limiter_stats()
+
+
+class LayoutModelMiddleware(Middleware):
+    """
+    Loads the layout model in every process of the layout pool before the worker
+    consumes messages, and touches the ready file for the readiness probe.
+    A pool broken by a dead process is rebuilt after the message,
+    the worker isn't ready meanwhile
+    """
+
+    def __init__(self, layout_pool: "LayoutPool", ready_file: Path = LAYOUT_READY_FILE):
+        self.layout_pool = layout_pool
+        self.ready_file = ready_file
+        # worker threads finish their messages concurrently
+        self._lock = threading.Lock()
+
+    def before_worker_boot(self, broker: Broker, worker: Worker) -> None:
+        self._warmup()
+
+    def after_process_message(
+        self,
+        broker: Broker,
+        message: Message[T],
+        *,
+        result: Any | None = None,
+        exception: Exception | None = None,
+    ) -> None:
+        if self.layout_pool.ready:
+            return
+        with self._lock:
+            if not self.layout_pool.ready:
+                logger.warning("Layout pool is broken, loading the model again")
+                self._warmup()
+
+    def _warmup(self) -> None:
+        self.ready_file.unlink(missing_ok=True)
+        start = time.perf_counter()
+        stats = self.layout_pool.warmup()
+        total_rss = sum(process["max_rss"] for process in stats)
+        logger.info(
+            f"Layout model {self.layout_pool.model_name} loaded "
+            f"in {len(stats)} processes in {time.perf_counter() - start:.1f}s, "
+            f"memory {total_rss / 2**20:_.0f}MB",
+            processes=stats,
+        )
+        self.ready_file.touch()
+
+    def before_worker_shutdown(self, broker: Broker, worker: Worker) -> None:
+        self.ready_file.unlink(missing_ok=True)
+        self.layout_pool.close()
+
+
+async def _get_weaviate_pool() -> WeaviateClientPool:
+    return get_weaviate_pool()
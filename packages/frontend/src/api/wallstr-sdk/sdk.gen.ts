@@ -351,6 +351,8 @@ export class DocumentsService {
 export class DefaultService {
   /**
    * Connect
+   * Resumes after `Last-Event-ID` header or `last_event_id` query parameter,
+   * the latter is for clients that reconnect with a new EventSource
    */
   public static connect<ThrowOnError extends boolean = false>(options?: Options<ConnectData, ThrowOnError>) {
     return (options?.client ?? client).get<unknown, ConnectError, ThrowOnError>({
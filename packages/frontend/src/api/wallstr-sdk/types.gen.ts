@@ -632,7 +632,9 @@ export type ReprocessDocumentsResponses = {
 export type ConnectData = {
   body?: never;
   path?: never;
-  query?: never;
+  query?: {
+    last_event_id?: string | null;
+  };
   url: "/sse/";
 };
 
@@ -641,6 +643,10 @@ export type ConnectErrors = {
    * Unauthorized
    */
   401: HttpUnauthorizedError;
+  /**
+   * Validation Error
+   */
+  422: HttpValidationError;
 };
 
 export type ConnectError = ConnectErrors[keyof ConnectErrors];
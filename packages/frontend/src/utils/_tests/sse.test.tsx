@@ -0,0 +1,74 @@
+import { expect, test } from "@playwright/experimental-ct-react";
+
+import { getReconnectDelay, SSEConnection, type SSEEvent } from "../sse";
+
+class FakeEventSource {
+  readyState = 1;
+  onopen: (() => void) | null = null;
+  onmessage: ((event: { data: string; lastEventId: string }) => void) | null =
+    null;
+  onerror: ((error: unknown) => void) | null = null;
+
+  constructor(readonly url: string) {}
+
+  emit(id: string, data: SSEEvent) {
+    this.onmessage?.({ data: JSON.stringify(data), lastEventId: id });
+  }
+
+  fail(readyState: number) {
+    this.readyState = readyState;
+    this.onerror?.(new Error("dropped"));
+  }
+
+  close() {
+    this.readyState = 2;
+  }
+}
+
+function connect() {
+  const sources: FakeEventSource[] = [];
+  const events: SSEEvent[] = [];
+  const connection = new SSEConnection(
+    "http://api/sse",
+    (event) => events.push(event),
+    (url) => {
+      const source = new FakeEventSource(url);
+      sources.push(source);
+      return source as unknown as EventSource;
+    },
+  );
+  connection.open();
+  return { connection, sources, events };
+}
+
+test("keeps the browser's reconnect while it is connecting", async () => {
+  const { connection, sources } = connect();
+  sources[0].fail(0);
+
+  await new Promise((resolve) => setTimeout(resolve, getReconnectDelay(0)));
+  expect(sources).toHaveLength(1);
+  expect(sources[0].readyState).toBe(0);
+  connection.close();
+});
+
+test("reconnects after the last event once the stream is dropped", async () => {
+  const { connection, sources, events } = connect();
+  sources[0].emit("1-0", { type: "chat_title_updated" });
+  sources[0].fail(2);
+
+  await expect.poll(() => sources.length).toBe(2);
+  expect(sources[1].url).toBe("http://api/sse?last_event_id=1-0");
+  sources[1].emit("2-0", { type: "chat_title_updated" });
+  expect(events).toHaveLength(2);
+  connection.close();
+});
+
+test("stops reconnecting once closed", async () => {
+  const { connection, sources } = connect();
+  sources[0].fail(2);
+  connection.close();
+
+  await new Promise((resolve) => setTimeout(resolve, getReconnectDelay(0)));
+  expect(sources).toHaveLength(1);
+  expect(connection.isOpen).toBe(false);
+});
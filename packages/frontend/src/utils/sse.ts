@@ -0,0 +1,73 @@
+const CONNECTING = 0;
+const MAX_RECONNECT_DELAY = 30_000;
+
+export type SSEEvent = { type: string } & Record<string, unknown>;
+
+type EventSourceFactory = (url: string) => EventSource;
+
+const createEventSource: EventSourceFactory = (url) =>
+  new EventSource(url, { withCredentials: true });
+
+export function getReconnectDelay(attempt: number): number {
+  return Math.min(1000 * 2 ** attempt, MAX_RECONNECT_DELAY);
+}
+
+/**
+ * Keeps an EventSource open, resuming after the last received event.
+ * The browser retries dropped streams itself and sends Last-Event-ID,
+ * once it gives up (e.g. on an error response) a new EventSource is created
+ * with backoff and the `last_event_id` query parameter.
+ */
+export class SSEConnection {
+  lastEventId: string | null = null;
+  private eventSource: EventSource | null = null;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+  private attempt = 0;
+
+  constructor(
+    private readonly url: string,
+    private readonly onEvent: (event: SSEEvent) => void,
+    private readonly factory: EventSourceFactory = createEventSource,
+  ) {}
+
+  get isOpen(): boolean {
+    return this.eventSource !== null || this.reconnectTimer !== null;
+  }
+
+  open(): void {
+    const query = this.lastEventId
+      ? `?last_event_id=${encodeURIComponent(this.lastEventId)}`
+      : "";
+    const eventSource = this.factory(`${this.url}${query}`);
+
+    eventSource.onopen = () => {
+      this.attempt = 0;
+    };
+
+    eventSource.onmessage = (event) => {
+      if (event.lastEventId) this.lastEventId = event.lastEventId;
+      this.onEvent(JSON.parse(event.data));
+    };
+
+    eventSource.onerror = (error) => {
+      console.warn("SSE Error:", error);
+      if (eventSource.readyState === CONNECTING) return;
+
+      eventSource.close();
+      this.eventSource = null;
+      this.reconnectTimer = setTimeout(() => {
+        this.reconnectTimer = null;
+        this.open();
+      }, getReconnectDelay(this.attempt++));
+    };
+
+    this.eventSource = eventSource;
+  }
+
+  close(): void {
+    if (this.reconnectTimer) clearTimeout(this.reconnectTimer);
+    this.reconnectTimer = null;
+    this.eventSource?.close();
+    this.eventSource = null;
+  }
+}